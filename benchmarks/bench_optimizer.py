@@ -0,0 +1,182 @@
+"""
+Micro-benchmark of MosaicOptimizer.select_tiles on synthetic PSScene strips over coastal ROIs.
+Each case is an ROI complexity, a number of candidate items, a cloud cover distribution and a number of layers.
+It measures wall time, peak memory, ordered area, wasted area and missing fraction, and compares them with
+stored baselines: a run fails (exit code 1) when a case is slower, uses more memory or covers the ROI worse.
+
+python3 ./benchmarks/bench_optimizer.py --save-baseline          # record baselines on this machine
+python3 ./benchmarks/bench_optimizer.py                          # compare with them
+python3 ./benchmarks/bench_optimizer.py --suite full --items 10000 50000
+"""
+import itertools
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import time
+import tracemalloc
+from argparse import ArgumentParser
+from pathlib import Path
+
+from synthetic_scenes import coastal_roi, synthetic_items
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+BASELINE_PATH = Path(__file__).resolve().parent / "baselines" / "mosaic_optimizer.json"
+SUITES = {
+    "quick": {"rois": ["simple", "coastal"], "items": [100, 1000], "clouds": ["clear"], "layers": [1, 3]},
+    "full": {
+        "rois": ["simple", "coastal", "complex", "islands"],
+        "items": [100, 1000, 10000, 50000],
+        "clouds": ["clear", "mixed", "cloudy"],
+        "layers": [1, 2, 3, 4, 5],
+    },
+}
+# Allowed differences before a case counts as a regression
+TIME_TOLERANCE = 0.25
+TIME_SLACK = 0.05
+MEMORY_TOLERANCE = 0.25
+MISSING_FRACTION_TOLERANCE = 0.01
+AREA_TOLERANCE = 0.05
+
+
+class SyntheticQuery:
+    # The parts of AvailableDataQuery that MosaicOptimizer uses
+    def __init__(self, roi, items):
+        self.filter = type("Filter", (), {"roi": roi})()
+        self.items = items
+        self.session = None
+        self.metrics = None
+
+    def within_tide(self, index):
+        return True
+
+
+def case_name(roi, n_items, clouds, n_layers):
+    return f"{roi}-{n_items}-{clouds}-{n_layers}"
+
+
+def run_case(case):
+    # Runs in a fresh process, so that the peak memory of one case does not hide the next
+    from MosaicOptimizer import MosaicOptimizer
+
+    roi_name, n_items, clouds, n_layers, repeat = case
+    roi = coastal_roi(roi_name)
+    items = synthetic_items(roi, n_items, seed=n_items, clouds=clouds)
+    query = SyntheticQuery(roi, items)
+
+    setup_times = []
+    select_times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        optimizer = MosaicOptimizer(query)
+        setup_times.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        mosaics = optimizer.select_tiles(n_layers, 0.90)
+        select_times.append(time.perf_counter() - start)
+
+    # Python allocations only. GEOS memory shows in the peak RSS of the process
+    tracemalloc.start()
+    MosaicOptimizer(query).select_tiles(n_layers, 0.90)
+    python_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != "darwin":
+        peak_rss *= 1024
+
+    mosaics = mosaics or []
+    return {
+        "setup_seconds": min(setup_times),
+        "select_seconds": min(select_times),
+        "peak_rss_mb": peak_rss / 1e6,
+        "python_peak_mb": python_peak / 1e6,
+        "selected_items": sum(len(mosaic[0]) for mosaic in mosaics),
+        "ordered_area": sum(mosaic[1]["mosaic_area"] for mosaic in mosaics),
+        "wasted_area": sum(mosaic[1]["wasted_area"] for mosaic in mosaics),
+        "missing_fraction": max((mosaic[1]["missing_fraction"] for mosaic in mosaics), default=1.0),
+    }
+
+
+def regressions(result, baseline):
+    found = []
+    time_now = result["setup_seconds"] + result["select_seconds"]
+    time_before = baseline["setup_seconds"] + baseline["select_seconds"]
+    if time_now > time_before * (1 + TIME_TOLERANCE) + TIME_SLACK:
+        found.append(f"time {time_before:.2f}s -> {time_now:.2f}s")
+    if result["peak_rss_mb"] > baseline["peak_rss_mb"] * (1 + MEMORY_TOLERANCE):
+        found.append(f'memory {baseline["peak_rss_mb"]:.0f} MB -> {result["peak_rss_mb"]:.0f} MB')
+    if result["missing_fraction"] > baseline["missing_fraction"] + MISSING_FRACTION_TOLERANCE:
+        found.append(f'missing fraction {baseline["missing_fraction"]:.3f} -> {result["missing_fraction"]:.3f}')
+    if result["wasted_area"] > baseline["wasted_area"] * (1 + AREA_TOLERANCE) + 0.1:
+        found.append(f'wasted area {baseline["wasted_area"]:.1f} -> {result["wasted_area"]:.1f} km2')
+    return found
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--suite", choices=SUITES, default="quick")
+    parser.add_argument("--rois", nargs="+", choices=["simple", "coastal", "complex", "islands"], help="Override the ROIs of the suite")
+    parser.add_argument("--items", nargs="+", type=int, help="Override the numbers of candidate items of the suite")
+    parser.add_argument("--clouds", nargs="+", choices=["clear", "mixed", "cloudy"], help="Override the cloud cover distributions of the suite")
+    parser.add_argument("--layers", nargs="+", type=int, help="Override the numbers of layers of the suite")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs of each case, the fastest one is kept")
+    parser.add_argument("--baseline", default=str(BASELINE_PATH), help="Baseline file")
+    parser.add_argument("--save-baseline", action="store_true", help="Store the results as the new baselines")
+    parser.add_argument("--output", help="Write the results as JSON")
+    args = parser.parse_args()
+
+    suite = SUITES[args.suite]
+    cases = list(
+        itertools.product(
+            args.rois or suite["rois"],
+            args.items or suite["items"],
+            args.clouds or suite["clouds"],
+            args.layers or suite["layers"],
+        )
+    )
+
+    baseline_path = Path(args.baseline)
+    baselines = json.loads(baseline_path.read_text()) if baseline_path.exists() else {}
+
+    print(f'{"case":<28}{"setup (s)":>10}{"select (s)":>11}{"RSS (MB)":>10}{"items":>7}{"area":>9}{"wasted":>9}{"missing":>9}')
+    results = {}
+    failed = []
+    # One process per case, recycled after each one
+    with multiprocessing.Pool(1, maxtasksperchild=1) as pool:
+        for case in cases:
+            name = case_name(*case)
+            result = pool.apply(run_case, (case + (args.repeat,),))
+            results[name] = result
+
+            found = regressions(result, baselines[name]) if name in baselines and not args.save_baseline else []
+            status = "  REGRESSION: " + ", ".join(found) if found else ""
+            if found:
+                failed.append(name)
+            print(
+                f'{name:<28}{result["setup_seconds"]:>10.3f}{result["select_seconds"]:>11.3f}{result["peak_rss_mb"]:>10.0f}'
+                f'{result["selected_items"]:>7}{result["ordered_area"]:>9.1f}{result["wasted_area"]:>9.1f}'
+                f'{result["missing_fraction"]:>9.3f}{status}'
+            )
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=4))
+
+    if args.save_baseline:
+        baselines.update(results)
+        baseline_path.parent.mkdir(parents=True, exist_ok=True)
+        baseline_path.write_text(json.dumps(baselines, indent=4, sort_keys=True))
+        print(f"Baselines of {len(results)} cases saved to {baseline_path}")
+        return
+
+    missing = [case_name(*case) for case in cases if case_name(*case) not in baselines]
+    if missing:
+        print(f"{len(missing)} cases have no baseline. Record them with --save-baseline")
+    if failed:
+        print(f"{len(failed)} of {len(cases)} cases regressed")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
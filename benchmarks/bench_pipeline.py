@@ -0,0 +1,227 @@
+"""
+End-to-end benchmark of prepare_download_queues and download_orders against the local Planet API simulator.
+Each scale is a number of queries and of items found by each query. For each stage it reports wall time,
+peak memory, throughput and the HTTP latency seen by the pipeline (from its --metrics output).
+
+python3 ./benchmarks/bench_pipeline.py --scales 1x50 4x200 8x1000 --latency 0.05
+python3 ./benchmarks/bench_pipeline.py --scales 4x200 --error-429 0.05 --error-5xx 0.02 --output results.json
+"""
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+
+from planet_simulator import PlanetSimulator
+
+SRC_PATH = Path(__file__).resolve().parent.parent / "src"
+CSV_HEADER = "roi,min_date,max_date,max_cloud_cover,asset_type,min_tide,max_tide,port,layers,clip"
+
+
+def write_queries(folder, n_queries, tide=True):
+    # Small coastal ROIs along the Algarve coast, one per query
+    rows = [CSV_HEADER]
+    for i in range(n_queries):
+        lon = -8.9 + 0.12 * (i % 10)
+        lat = 37.0 + 0.05 * (i // 10)
+        roi = {
+            "type": "Polygon",
+            "coordinates": [[[lon, lat], [lon + 0.1, lat], [lon + 0.1, lat + 0.06], [lon, lat + 0.06], [lon, lat]]],
+        }
+        roi_path = folder / f"roi_{i:03d}.geojson"
+        roi_path.write_text(json.dumps(roi))
+        tide_range = "0.0,3.0" if tide else "NA,NA"
+        rows.append(f"{roi_path},2023-01-01,2023-06-30,0.5,ortho_analytic_8b_sr,{tide_range},19,1,TRUE")
+
+    queries_path = folder / "queries.csv"
+    queries_path.write_text("\n".join(rows) + "\n")
+    return queries_path
+
+
+def run_stage(script, argv, env):
+    # Each stage runs in its own process, so that its peak memory is measured alone
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, __file__, "--child", script, "--"] + argv,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    wall = time.perf_counter() - start
+    if result.returncode != 0:
+        print(result.stdout[-2000:])
+        print(result.stderr[-2000:])
+        raise RuntimeError(f"{script} failed")
+
+    peak_rss = json.loads(result.stderr.strip().splitlines()[-1])["peak_rss"]
+    return {"wall_seconds": wall, "peak_rss_mb": peak_rss / 1e6}
+
+
+def child(script, argv):
+    sys.path.insert(0, str(SRC_PATH))
+    module = __import__(script)
+    try:
+        module.main(argv)
+    finally:
+        # ru_maxrss is in kB on Linux, and in bytes on macOS
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform != "darwin":
+            peak_rss *= 1024
+        sys.stdout.flush()
+        print(json.dumps({"peak_rss": peak_rss}), file=sys.stderr)
+
+
+def latency_summary(requests):
+    # Mean latency and approximate 95th percentile (histogram bucket bound) by endpoint
+    endpoints = {}
+    for request in requests:
+        endpoint = endpoints.setdefault(request["endpoint"], {"count": 0, "seconds": 0.0, "buckets": {}})
+        endpoint["count"] += request["count"]
+        endpoint["seconds"] += request["seconds"]
+        for bound, count in request["buckets"].items():
+            endpoint["buckets"][bound] = endpoint["buckets"].get(bound, 0) + count
+
+    summary = {}
+    for name, endpoint in endpoints.items():
+        p95 = None
+        for bound, count in sorted(endpoint["buckets"].items(), key=lambda bucket: float(bucket[0])):
+            if count >= 0.95 * endpoint["count"]:
+                p95 = float(bound)
+                break
+        summary[name] = {
+            "requests": endpoint["count"],
+            "mean_ms": endpoint["seconds"] / endpoint["count"] * 1000,
+            "p95_ms": p95 * 1000 if p95 is not None else None,
+        }
+    return summary
+
+
+def counter(metrics, name, **labels):
+    return sum(
+        c["value"] for c in metrics["counters"]
+        if c["name"] == name and all(c["labels"].get(key) == value for key, value in labels.items())
+    )
+
+
+def run_scale(n_queries, n_items, args):
+    simulator = PlanetSimulator(
+        items_per_query=n_items,
+        item_bytes=args.item_bytes,
+        latency=args.latency,
+        error_429=args.error_429,
+        error_5xx=args.error_5xx,
+        order_delay=args.order_delay,
+        delivery_rate=args.delivery_rate * 1e6 if args.delivery_rate else None,
+        fixtures=args.fixtures,
+    )
+    url = simulator.start()
+    env = dict(os.environ, PLANET_API_URL=url, TIDE_API_URL=url, PLANET_KEY="simulator")
+
+    with tempfile.TemporaryDirectory() as folder:
+        folder = Path(folder)
+        queries_path = write_queries(folder, n_queries, tide=not args.no_tide)
+        queue_path = folder / "outputs" / "download_queue.json"
+        metrics_path = folder / "metrics"
+        (folder / "reports").mkdir()
+
+        prepare = run_stage(
+            "prepare_download_queues",
+            ["-q", str(queries_path), "-o", str(queue_path), "-r", str(folder / "reports"),
+             "-t", str(folder / "thumbnails"), "--metrics", str(metrics_path)],
+            env,
+        )
+        download = run_stage(
+            "download_orders",
+            ["-q", str(queue_path), "-s", str(folder / "storage"), "--metrics", str(metrics_path)],
+            env,
+        )
+
+        prepare_metrics = json.loads((metrics_path / "prepare.json").read_text())
+        download_metrics = json.loads((metrics_path / "download_orders.json").read_text())
+
+    simulator.stop()
+
+    found_items = counter(prepare_metrics, "items_processed", stage="search")
+    downloaded_bytes = counter(download_metrics, "bytes_downloaded")
+    prepare.update(
+        items=found_items,
+        items_per_second=found_items / prepare["wall_seconds"],
+        stages=prepare_metrics["stages"],
+        latency=latency_summary(prepare_metrics["requests"]),
+        retries=counter(prepare_metrics, "retries"),
+    )
+    download.update(
+        files=counter(download_metrics, "files_downloaded"),
+        megabytes=downloaded_bytes / 1e6,
+        megabytes_per_second=downloaded_bytes / 1e6 / download["wall_seconds"],
+        stages=download_metrics["stages"],
+        latency=latency_summary(download_metrics["requests"]),
+        retries=counter(download_metrics, "retries"),
+    )
+    return {
+        "queries": n_queries,
+        "items_per_query": n_items,
+        "prepare": prepare,
+        "download": download,
+        "simulator_requests": simulator.requests,
+    }
+
+
+def print_result(result):
+    prepare = result["prepare"]
+    download = result["download"]
+    print(f'\n{result["queries"]} queries x {result["items_per_query"]} items')
+    print(
+        f'  prepare   {prepare["wall_seconds"]:8.2f}s  {prepare["peak_rss_mb"]:7.1f} MB  '
+        f'{prepare["items_per_second"]:8.1f} items/s  retries {prepare["retries"]}'
+    )
+    print(
+        f'  download  {download["wall_seconds"]:8.2f}s  {download["peak_rss_mb"]:7.1f} MB  '
+        f'{download["megabytes_per_second"]:8.1f} MB/s ({download["files"]} files)  retries {download["retries"]}'
+    )
+    for stage_name in ("prepare", "download"):
+        for name, stage in result[stage_name]["stages"].items():
+            print(f'    {name:<12} {stage["seconds"]:8.2f}s in {stage["runs"]} runs')
+        for endpoint, latency in sorted(result[stage_name]["latency"].items()):
+            p95 = f'{latency["p95_ms"]:.0f}' if latency["p95_ms"] is not None else ">60000"
+            print(f'    {endpoint:<60} {latency["requests"]:6d} requests  mean {latency["mean_ms"]:7.1f} ms  p95 <= {p95} ms')
+    errors = {key: value for key, value in result["simulator_requests"].items() if key.startswith("error")}
+    if errors:
+        print(f"  injected errors: {errors}")
+
+
+def main():
+    if len(sys.argv) > 2 and sys.argv[1] == "--child":
+        return child(sys.argv[2], sys.argv[4:])
+
+    parser = ArgumentParser()
+    parser.add_argument("--scales", nargs="+", default=["1x50", "4x200", "8x1000"], help="<queries>x<items per query>")
+    parser.add_argument("--item-bytes", type=int, default=256 * 1024, help="Size of the analytic file of each item")
+    parser.add_argument("--fixtures", help="Serve recorded items instead of synthetic ones")
+    parser.add_argument("--latency", type=float, default=0.0, help="Mean latency (s) added to each API response")
+    parser.add_argument("--error-429", type=float, default=0.0, help="Fraction of API requests rejected with 429")
+    parser.add_argument("--error-5xx", type=float, default=0.0, help="Fraction of API requests failing with 503")
+    parser.add_argument("--order-delay", type=float, default=0.0, help="Seconds until placed orders succeed")
+    parser.add_argument("--delivery-rate", type=float, help="Delivery throughput (MB/s)")
+    parser.add_argument("--no-tide", action="store_true", help="Queries without tide filtering")
+    parser.add_argument("--output", help="Write the results as JSON")
+    args = parser.parse_args()
+
+    results = []
+    for scale in args.scales:
+        n_queries, n_items = (int(value) for value in scale.lower().split("x"))
+        result = run_scale(n_queries, n_items, args)
+        print_result(result)
+        results.append(result)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=4)
+
+
+if __name__ == "__main__":
+    main()
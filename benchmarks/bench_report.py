@@ -0,0 +1,105 @@
+"""
+Benchmark of report rendering: render time and PDF size, with full-size or downscaled thumbnails,
+rendering queries one after the other or in a process pool.
+
+python3 ./benchmarks/bench_report.py --queries 8 --items 60
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from PIL import Image
+from ReportRenderer import render_report
+
+
+def synthetic_thumbnail(seed, size=512):
+    # Noisy RGBA image, so that compression does not make the benchmark unrealistically cheap
+    rng = random.Random(seed)
+    image = Image.effect_noise((size, size), rng.randint(20, 80)).convert("RGB")
+    image = image.resize((size, size))
+    alpha = Image.new("L", (size, size), 255)
+    image.putalpha(alpha)
+    buffer = BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def synthetic_query(query_number, n_items, n_layers):
+    rng = random.Random(query_number)
+    roi = {
+        "type": "Polygon",
+        "coordinates": [[[-8.0, 37.0], [-7.8, 37.0], [-7.8, 37.1], [-8.0, 37.1], [-8.0, 37.0]]],
+    }
+    items = []
+    for i in range(n_items):
+        x = -8.1 + rng.random() * 0.3
+        y = 36.95 + rng.random() * 0.15
+        items.append(
+            {
+                "id": f"{query_number}_{i}",
+                "geometry": {
+                    "type": "Polygon",
+                    "coordinates": [[[x, y], [x + 0.25, y], [x + 0.25, y + 0.08], [x, y + 0.08], [x, y]]],
+                },
+                "properties": {
+                    "acquired": "2023-01-01T10:00:00Z",
+                    "cloud_cover": round(rng.random() * 0.1, 2),
+                    "publishing_stage": "finalized",
+                },
+            }
+        )
+    layer_size = max(1, n_items // n_layers)
+    layers = [
+        (items[i : i + layer_size], {"mosaic_area": 100, "wasted_area": 10})
+        for i in range(0, n_items, layer_size)
+    ]
+    thumbnails = {item["id"]: synthetic_thumbnail(item["id"]) for item in items}
+    return layers, thumbnails, roi
+
+
+def run(reports, downscale, workers):
+    start = time.perf_counter()
+    if workers == 1:
+        paths = [render_report(*report, downscale=downscale) for report in reports]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(render_report, *report, downscale=downscale) for report in reports]
+            paths = [future.result() for future in futures]
+    elapsed = time.perf_counter() - start
+    size = sum(os.path.getsize(path) for path in paths)
+    return elapsed, size
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--queries", type=int, default=8, help="Number of query reports")
+    parser.add_argument("--items", type=int, default=60, help="Items per query")
+    parser.add_argument("--layers", type=int, default=3, help="Mosaic layers per query")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Processes for parallel rendering")
+    args = parser.parse_args()
+
+    print("Generating synthetic queries and thumbnails")
+    queries = [synthetic_query(i, args.items, args.layers) for i in range(args.queries)]
+
+    with tempfile.TemporaryDirectory() as folder:
+        reports = [
+            (os.path.join(folder, f"query_{i}.pdf"), 3, layers, thumbnails, roi)
+            for i, (layers, thumbnails, roi) in enumerate(queries)
+        ]
+        print(f"{'thumbnails':<12}{'workers':>8}{'time (s)':>12}{'size (MB)':>12}")
+        for downscale in (False, True):
+            for workers in (1, args.workers):
+                elapsed, size = run(reports, downscale, workers)
+                label = "downscaled" if downscale else "full size"
+                print(f"{label:<12}{workers:>8}{elapsed:>12.2f}{size / 1e6:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,490 @@
+"""
+Local stand-in for the Planet APIs (quick-search pagination, stats, thumbnails, asset activation, orders,
+deliveries and quota)
+and the hidrografico.pt tide tables, to benchmark and test the pipeline without spending quota.
+Items are synthetic, or served from recorded fixtures. Latency, 429s, 5xx errors, slow orders and slow
+deliveries can be injected.
+
+Point the pipeline at it through the environment:
+
+python3 ./benchmarks/planet_simulator.py --port 8080 --items 500 --latency 0.05 --error-429 0.02
+PLANET_API_URL=http://127.0.0.1:8080 TIDE_API_URL=http://127.0.0.1:8080 python3 ./src/prepare_download_queues.py ...
+"""
+import hashlib
+import json
+import math
+import random
+import struct
+import threading
+import time
+import uuid
+import zlib
+from argparse import ArgumentParser
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from synthetic_scenes import synthetic_items
+
+# Files delivered for each item of an order, and their size relative to --item-bytes
+DELIVERED_ASSETS = (
+    ("3B_AnalyticMS_SR_8b_clip.tif", 1.0),
+    ("3B_udm2_clip.tif", 0.125),
+    ("3B_AnalyticMS_8b_metadata_clip.xml", 0.005),
+)
+# Assets served by the Data API for each item, and their size relative to --item-bytes
+ITEM_ASSETS = (
+    ("ortho_analytic_8b_sr", 1.0),
+    ("ortho_udm2", 0.125),
+    ("ortho_analytic_8b_xml", 0.005),
+)
+# Semi-diurnal tide (M2) period and spring-neap cycle
+TIDE_PERIOD = timedelta(hours=12, minutes=25)
+SPRING_NEAP_DAYS = 14.77
+
+
+class PlanetSimulator:
+    def __init__(
+        self,
+        host="127.0.0.1",
+        port=0,
+        items_per_query=200,
+        item_bytes=256 * 1024,
+        latency=0.0,
+        error_429=0.0,
+        error_5xx=0.0,
+        order_delay=0.0,
+        delivery_rate=None,
+        fixtures=None,
+        quota=1e9,
+        seed=0,
+    ):
+        self.items_per_query = items_per_query
+        self.item_bytes = item_bytes
+        # Mean added latency (s) of each API response
+        self.latency = latency
+        # Fraction of API requests answered with 429 (rate limit) or 503
+        self.error_429 = error_429
+        self.error_5xx = error_5xx
+        # Seconds until a placed order succeeds or an activated asset is active, and delivery throughput (bytes/s, None for unlimited)
+        self.order_delay = order_delay
+        self.delivery_rate = delivery_rate
+        self.fixtures = self.load_fixtures(fixtures) if fixtures else None
+        # Remaining quota (km2) reported to the pipeline
+        self.quota = quota
+        self.seed = seed
+
+        self.searches = {}
+        self.orders = {}
+        self.activations = {}
+        self.requests = {}
+        self._digests = {}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self.__handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self.url
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    @staticmethod
+    def load_fixtures(file_path):
+        # A list of features, a saved quick-search page, or the search stage of a query journal
+        with open(file_path) as file:
+            fixtures = json.load(file)
+        if isinstance(fixtures, dict):
+            fixtures = fixtures.get("features", fixtures.get("data"))
+        return fixtures
+
+    # Data API
+
+    def quick_search(self, search_filter, page_size):
+        return self.search_page(self.search(search_filter), 0, page_size)
+
+    def search(self, search_filter):
+        # Stores the items found by the filter, and returns the id of the search
+        conditions = {condition["type"]: condition for condition in search_filter["filter"]["config"]}
+        if self.fixtures is not None:
+            items = [dict(item, _links=dict(item.get("_links", {}))) for item in self.fixtures]
+        else:
+            date_range = conditions["DateRangeFilter"]["config"]
+            # The same filter always finds the same items
+            seed = int(hashlib.md5(json.dumps(search_filter, sort_keys=True).encode()).hexdigest()[:8], 16)
+            items = synthetic_items(
+                conditions["GeometryFilter"]["config"],
+                self.items_per_query,
+                min_date=date_range["gte"],
+                max_date=date_range["lte"],
+                seed=seed ^ self.seed,
+            )
+
+        max_cloud_cover = conditions.get("RangeFilter", {}).get("config", {}).get("lte", 1)
+        items = [item for item in items if item["properties"]["cloud_cover"] <= max_cloud_cover]
+        for item in items:
+            item["_links"]["thumbnail"] = f'{self.url}/data/v1/item-types/PSScene/items/{item["id"]}/thumb'
+
+        search_id = uuid.uuid4().hex
+        with self._lock:
+            self.searches[search_id] = items
+        return search_id
+
+    def search_page(self, search_id, page, page_size):
+        items = self.searches[search_id]
+        features = items[page * page_size : (page + 1) * page_size]
+        next_page = None
+        if (page + 1) * page_size < len(items):
+            next_page = f"{self.url}/data/v1/searches/{search_id}/results?_page={page + 1}&_page_size={page_size}"
+        return {"type": "FeatureCollection", "features": features, "_links": {"_next": next_page}}
+
+    def stats(self, stats_filter):
+        # Same body as a search, with the interval next to the item types and the filter
+        items = self.searches[self.search({"item_types": stats_filter["item_types"], "filter": stats_filter["filter"]})]
+        buckets = {}
+        for item in items:
+            day = item["properties"]["acquired"][:10]
+            buckets[day] = buckets.get(day, 0) + 1
+        return {
+            "interval": stats_filter.get("interval", "day"),
+            "buckets": [{"start_time": f"{day}T00:00:00.000000Z", "count": count} for day, count in sorted(buckets.items())],
+        }
+
+    def item_assets(self, item_id):
+        assets = {}
+        now = time.monotonic()
+        for asset_type, _ in ITEM_ASSETS:
+            activated = self.activations.get((item_id, asset_type))
+            asset_url = f"{self.url}/data/v1/assets/{item_id}/{asset_type}"
+            asset = {
+                "type": asset_type,
+                "status": "inactive",
+                "_links": {"activate": f"{asset_url}/activate"},
+            }
+            if activated is not None:
+                asset["status"] = "active" if now - activated >= self.order_delay else "activating"
+            if asset["status"] == "active":
+                asset["location"] = f"{self.url}/download/assets/{item_id}/{asset_type}"
+            assets[asset_type] = asset
+        return assets
+
+    def activate(self, item_id, asset_type):
+        with self._lock:
+            self.activations.setdefault((item_id, asset_type), time.monotonic())
+
+    def asset_size(self, asset_type):
+        return max(int(self.item_bytes * dict(ITEM_ASSETS)[asset_type]), 1)
+
+    # Orders API
+
+    def place_order(self, request):
+        order_id = str(uuid.uuid4())
+        with self._lock:
+            self.orders[order_id] = {"request": request, "created": time.monotonic()}
+        return self.order_status(order_id)
+
+    def order_status(self, order_id):
+        order = self.orders[order_id]
+        request = order["request"]
+        ready = time.monotonic() - order["created"] >= self.order_delay
+        status = {
+            "id": order_id,
+            "name": request["name"],
+            "products": request["products"],
+            "tools": request.get("tools", []),
+            "state": "success" if ready else "running",
+            "last_message": "Manifest delivery completed" if ready else "Staging assets",
+            "_links": {"_self": f"{self.url}/compute/ops/orders/v2/{order_id}"},
+        }
+        if ready:
+            status["_links"]["results"] = [
+                {"name": f"{order_id}/{path}", "location": f"{self.url}/download/{order_id}/{path}"}
+                for path in self.delivered_files(order_id)
+            ] + [{"name": f"{order_id}/manifest.json", "location": f"{self.url}/download/{order_id}/manifest.json"}]
+        return status
+
+    def delivered_files(self, order_id):
+        files = {}
+        for item_id in self.orders[order_id]["request"]["products"][0]["item_ids"]:
+            for asset, fraction in DELIVERED_ASSETS:
+                files[f"PSScene/{item_id}_{asset}"] = (item_id, max(int(self.item_bytes * fraction), 1))
+        return files
+
+    def manifest(self, order_id):
+        files = []
+        for path, (item_id, size) in self.delivered_files(order_id).items():
+            files.append(
+                {
+                    "path": path,
+                    "size": size,
+                    "digests": {"sha256": self.digest(path, size)},
+                    "annotations": {"planet/item_id": item_id, "planet/item_type": "PSScene"},
+                }
+            )
+        return {"name": self.orders[order_id]["request"]["name"], "files": files}
+
+    def digest(self, path, size):
+        key = (path, size)
+        if key not in self._digests:
+            digest = hashlib.sha256()
+            for chunk in file_content(path, size):
+                digest.update(chunk)
+            self._digests[key] = digest.hexdigest()
+        return self._digests[key]
+
+    # Tide tables
+
+    @staticmethod
+    def tide_table(port, first_day, n_days):
+        """
+        HTML table in the format of hidrografico.pt, with the high and low tides of n_days from first_day.
+        """
+        start = datetime.strptime(first_day, "%Y%m%d")
+        end = start + timedelta(days=n_days)
+        # Each port gets its own phase
+        origin = datetime(2000, 1, 1) + timedelta(minutes=int(hashlib.md5(str(port).encode()).hexdigest()[:4], 16) % 745)
+        half_period = TIDE_PERIOD / 2
+        k = math.floor((start - origin) / half_period)
+
+        rows = ["<tr><th>Data (UTC)</th><th>Altura</th><th>Fenomeno</th></tr>"]
+        while True:
+            event = origin + k * half_period
+            if event >= end:
+                break
+            if event >= start:
+                spring = (1 + math.cos(2 * math.pi * (event - origin).total_seconds() / 86400 / SPRING_NEAP_DAYS)) / 2
+                amplitude = 0.9 + 0.8 * spring
+                high = k % 2 == 0
+                height = 2.0 + amplitude if high else 2.0 - amplitude
+                phenomenon = "preia-mar" if high else "baixa-mar"
+                rows.append(
+                    f'<tr><td>{event.strftime("%Y-%m-%d %H:%M")}</td><td>{height:.2f} m</td><td>{phenomenon}</td></tr>'
+                )
+            k += 1
+
+        return "<html><body><table>" + "".join(rows) + "</table></body></html>"
+
+    # HTTP
+
+    def _count(self, endpoint):
+        with self._lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+
+    def _fault(self):
+        # Returns the status of an injected error, or None
+        with self._lock:
+            draw = self._rng.random()
+            delay = self._rng.uniform(0.5, 1.5) * self.latency if self.latency else 0
+        if delay:
+            time.sleep(delay)
+        if draw < self.error_429:
+            return 429
+        if draw < self.error_429 + self.error_5xx:
+            return 503
+        return None
+
+    def __handler(self):
+        simulator = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                url = urlsplit(self.path)
+                query = parse_qs(url.query)
+                parts = url.path.strip("/").split("/")
+
+                if url.path.startswith("/download/assets/"):
+                    simulator._count("download")
+                    item_id, asset_type = parts[2], parts[3]
+                    if (item_id, asset_type) not in simulator.activations or asset_type not in dict(ITEM_ASSETS):
+                        return self.send_json({"message": "Not found"}, 404)
+                    return self.send_file(f"{item_id}_{asset_type}", simulator.asset_size(asset_type))
+
+                if url.path.startswith("/download/"):
+                    # Deliveries come from storage, and are not rate limited
+                    simulator._count("download")
+                    order_id, path = parts[1], "/".join(parts[2:])
+                    if order_id not in simulator.orders:
+                        return self.send_json({"message": "Not found"}, 404)
+                    if path == "manifest.json":
+                        return self.send_json(simulator.manifest(order_id))
+                    files = simulator.delivered_files(order_id)
+                    if path not in files:
+                        return self.send_json({"message": "Not found"}, 404)
+                    return self.send_file(path, files[path][1])
+
+                if url.path == "/json/mare.port.val.php":
+                    endpoint = "tide"
+                elif url.path.startswith("/data/v1/searches/"):
+                    endpoint = "search-page"
+                elif url.path.endswith("/thumb"):
+                    endpoint = "thumbnail"
+                elif url.path.startswith("/data/v1/item-types/") and url.path.endswith("/assets"):
+                    endpoint = "assets"
+                elif url.path.startswith("/data/v1/assets/") and url.path.endswith("/activate"):
+                    endpoint = "activate"
+                elif url.path.startswith("/compute/ops/orders/v2/"):
+                    endpoint = "order-status"
+                elif url.path == "/auth/v1/experimental/public/my/subscriptions":
+                    endpoint = "subscriptions"
+                else:
+                    return self.send_json({"message": "Not found"}, 404)
+
+                simulator._count(endpoint)
+                if self.send_fault():
+                    return
+
+                if endpoint == "tide":
+                    table = simulator.tide_table(query["po"][0], query["dd"][0], int(query.get("nd", ["2"])[0]))
+                    return self.send_body(table.encode("utf-8"), "text/html; charset=utf-8")
+                if endpoint == "search-page":
+                    page = int(query.get("_page", ["0"])[0])
+                    page_size = int(query.get("_page_size", ["250"])[0])
+                    if parts[3] not in simulator.searches:
+                        return self.send_json({"message": "Not found"}, 404)
+                    return self.send_json(simulator.search_page(parts[3], page, page_size))
+                if endpoint == "thumbnail":
+                    return self.send_body(thumbnail(parts[-2]), "image/png")
+                if endpoint == "assets":
+                    return self.send_json(simulator.item_assets(parts[-2]))
+                if endpoint == "activate":
+                    simulator.activate(parts[3], parts[4])
+                    return self.send_body(b"", "text/plain", 202)
+                if endpoint == "order-status":
+                    if parts[-1] not in simulator.orders:
+                        return self.send_json({"message": "Not found"}, 404)
+                    return self.send_json(simulator.order_status(parts[-1]))
+                return self.send_json([{"quota_sqkm": simulator.quota, "quota_used": 0}])
+
+            def do_POST(self):
+                url = urlsplit(self.path)
+                query = parse_qs(url.query)
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+
+                if url.path == "/data/v1/quick-search":
+                    endpoint = "quick-search"
+                elif url.path == "/data/v1/stats":
+                    endpoint = "stats"
+                elif url.path.rstrip("/") == "/compute/ops/orders/v2":
+                    endpoint = "orders"
+                else:
+                    return self.send_json({"message": "Not found"}, 404)
+
+                simulator._count(endpoint)
+                if self.send_fault():
+                    return
+
+                if endpoint == "quick-search":
+                    page_size = int(query.get("_page_size", ["250"])[0])
+                    return self.send_json(simulator.quick_search(body, page_size))
+                if endpoint == "stats":
+                    return self.send_json(simulator.stats(body))
+                return self.send_json(simulator.place_order(body), 202)
+
+            def send_fault(self):
+                status = simulator._fault()
+                if status is None:
+                    return False
+                simulator._count(f"error-{status}")
+                message = "Too Many Requests" if status == 429 else "Service Unavailable"
+                self.send_json({"message": message}, status, headers={"Retry-After": "1"})
+                return True
+
+            def send_json(self, data, status=200, headers=None):
+                self.send_body(json.dumps(data).encode("utf-8"), "application/json", status, headers)
+
+            def send_body(self, body, content_type, status=200, headers=None):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def send_file(self, path, size):
+                self.send_response(200)
+                self.send_header("Content-Type", "application/octet-stream")
+                self.send_header("Content-Length", str(size))
+                self.end_headers()
+                for chunk in file_content(path, size):
+                    self.wfile.write(chunk)
+                    # Slow deliveries
+                    if simulator.delivery_rate:
+                        time.sleep(len(chunk) / simulator.delivery_rate)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def file_content(path, size, chunk_size=64 * 1024):
+    # Deterministic bytes, so that digests in the manifest match the delivered files
+    block = hashlib.sha256(path.encode("utf-8")).digest() * (chunk_size // 32)
+    sent = 0
+    while sent < size:
+        chunk = block[: min(chunk_size, size - sent)]
+        sent += len(chunk)
+        yield chunk
+
+
+def thumbnail(item_id, size=64):
+    # Small grey PNG, with a shade that depends on the item
+    shade = hashlib.md5(item_id.encode("utf-8")).digest()[0]
+    raw = b"".join(b"\x00" + bytes([shade, shade, shade, 255]) * size for _ in range(size))
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+
+    header = struct.pack(">IIBBBBB", size, size, 8, 6, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(raw)) + chunk(b"IEND", b"")
+
+
+def main(argv=None):
+    parser = ArgumentParser(description="Local Planet API and tide table simulator")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("-p", "--port", type=int, default=8080)
+    parser.add_argument("--items", type=int, default=200, help="Synthetic items found by each search")
+    parser.add_argument("--item-bytes", type=int, default=256 * 1024, help="Size of the analytic file of each delivered item")
+    parser.add_argument("--fixtures", help="JSON file with the items every search returns (features list, search page or journal search stage)")
+    parser.add_argument("--latency", type=float, default=0.0, help="Mean latency (s) added to each API response")
+    parser.add_argument("--error-429", type=float, default=0.0, help="Fraction of API requests rejected with 429")
+    parser.add_argument("--error-5xx", type=float, default=0.0, help="Fraction of API requests failing with 503")
+    parser.add_argument("--order-delay", type=float, default=0.0, help="Seconds until placed orders succeed")
+    parser.add_argument("--delivery-rate", type=float, help="Delivery throughput (MB/s)")
+    args = parser.parse_args(argv)
+
+    simulator = PlanetSimulator(
+        host=args.host,
+        port=args.port,
+        items_per_query=args.items,
+        item_bytes=args.item_bytes,
+        latency=args.latency,
+        error_429=args.error_429,
+        error_5xx=args.error_5xx,
+        order_delay=args.order_delay,
+        delivery_rate=args.delivery_rate * 1e6 if args.delivery_rate else None,
+        fixtures=args.fixtures,
+    )
+    print(f"Planet simulator listening on {simulator.url}")
+    try:
+        simulator.server.serve_forever()
+    except KeyboardInterrupt:
+        simulator.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""
+Synthetic PSScene items for the simulator and the benchmarks. Scenes come in strips of consecutive footprints
+along the satellite track, slightly rotated, with cloud cover mostly low and a long tail of cloudy scenes.
+"""
+import math
+import random
+from datetime import datetime, timedelta
+
+# Approximate PSScene footprint (km) and track heading (degrees from north)
+SCENE_WIDTH_KM = 24.6
+SCENE_HEIGHT_KM = 16.4
+TRACK_HEADING = -10
+KM_PER_DEGREE = 111.32
+
+
+def scene_footprint(lon, lat, width_km=SCENE_WIDTH_KM, height_km=SCENE_HEIGHT_KM, heading=TRACK_HEADING):
+    # Rectangle centred on lon, lat rotated by the track heading, as a GeoJSON polygon
+    angle = math.radians(heading)
+    corners = []
+    for dx, dy in ((-0.5, -0.5), (0.5, -0.5), (0.5, 0.5), (-0.5, 0.5)):
+        x = dx * width_km
+        y = dy * height_km
+        rx = x * math.cos(angle) - y * math.sin(angle)
+        ry = x * math.sin(angle) + y * math.cos(angle)
+        corners.append(
+            [
+                round(lon + rx / (KM_PER_DEGREE * math.cos(math.radians(lat))), 6),
+                round(lat + ry / KM_PER_DEGREE, 6),
+            ]
+        )
+    corners.append(corners[0])
+    return {"type": "Polygon", "coordinates": [corners]}
+
+
+def bounds(geometry):
+    if geometry["type"] == "Polygon":
+        points = [point for ring in geometry["coordinates"] for point in ring]
+    else:
+        points = [point for polygon in geometry["coordinates"] for ring in polygon for point in ring]
+    return (
+        min(point[0] for point in points),
+        min(point[1] for point in points),
+        max(point[0] for point in points),
+        max(point[1] for point in points),
+    )
+
+
+def cloud_cover(rng, distribution="clear"):
+    # Fraction of the scene covered by clouds
+    if distribution == "clear":
+        return round(min(rng.betavariate(0.6, 6), 1), 2)
+    if distribution == "mixed":
+        return round(min(rng.betavariate(0.8, 2), 1), 2)
+    if distribution == "cloudy":
+        return round(min(rng.betavariate(2, 1.5), 1), 2)
+    return round(rng.random(), 2)
+
+
+def synthetic_items(
+    roi,
+    n_items,
+    min_date="2023-01-01",
+    max_date="2023-12-31",
+    seed=0,
+    clouds="clear",
+    strip_length=(3, 12),
+    thumbnail_url=None,
+):
+    """
+    n_items PSScene features in strips crossing the bounding box of roi (a GeoJSON geometry), acquired between
+    min_date and max_date. thumbnail_url(item_id) sets the thumbnail link of each item.
+    """
+    rng = random.Random(seed)
+    min_lon, min_lat, max_lon, max_lat = bounds(roi)
+    start = datetime.strptime(min_date[:10], "%Y-%m-%d")
+    days = max((datetime.strptime(max_date[:10], "%Y-%m-%d") - start).days, 1)
+    step_lat = SCENE_HEIGHT_KM * 0.9 / KM_PER_DEGREE
+
+    items = []
+    strip_number = 0
+    while len(items) < n_items:
+        strip_number += 1
+        acquired = start + timedelta(days=rng.randrange(days), seconds=rng.randrange(9 * 3600, 12 * 3600))
+        satellite = f"{rng.randrange(0x2200, 0x24ff):04x}"
+        strip_id = str(5000000 + strip_number)
+        strip_clouds = cloud_cover(rng, clouds)
+        # Strips start south of the ROI and move north with the track heading
+        lon = rng.uniform(min_lon, max_lon)
+        lat = min_lat - rng.uniform(0, step_lat * 2)
+        n_scenes = rng.randint(*strip_length)
+
+        for k in range(n_scenes):
+            if len(items) == n_items or lat > max_lat + step_lat:
+                break
+            scene_time = acquired + timedelta(seconds=k * 2)
+            item_id = f'{scene_time.strftime("%Y%m%d_%H%M%S")}_{k:02d}_{satellite}'
+            # Clouds of scenes in the same strip are correlated
+            scene_clouds = round(min(max(strip_clouds + rng.gauss(0, 0.05), 0), 1), 2)
+            item = {
+                "type": "Feature",
+                "id": item_id,
+                "geometry": scene_footprint(lon, lat),
+                "properties": {
+                    "acquired": scene_time.strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+                    "cloud_cover": scene_clouds,
+                    "clear_percent": round((1 - scene_clouds) * 100),
+                    "item_type": "PSScene",
+                    "publishing_stage": "finalized",
+                    "satellite_id": satellite,
+                    "strip_id": strip_id,
+                },
+                "_links": {},
+            }
+            if thumbnail_url is not None:
+                item["_links"]["thumbnail"] = thumbnail_url(item_id)
+            items.append(item)
+
+            lon += step_lat * math.tan(math.radians(-TRACK_HEADING)) / math.cos(math.radians(lat))
+            lat += step_lat
+
+    items.sort(key=lambda item: item["properties"]["acquired"])
+    return items
+
+
+def coastal_roi(complexity="coastal", seed=0):
+    """
+    Coastal ROI as a GeoJSON geometry: a strip of sea along a fractal coastline. "simple" is a rectangle,
+    "coastal" and "complex" have 65 and 1025 coastline vertices, and "islands" adds barrier islands.
+    """
+    west, east, offshore, coast = -8.6, -8.2, 36.95, 37.05
+    if complexity == "simple":
+        return {
+            "type": "Polygon",
+            "coordinates": [[[west, offshore], [east, offshore], [east, coast], [west, coast], [west, offshore]]],
+        }
+
+    levels = {"coastal": 6, "complex": 10, "islands": 8}[complexity]
+    coastline = _coastline(west, east, coast, levels, random.Random(seed))
+    mainland = [[west, offshore], [east, offshore]] + coastline[::-1] + [[west, offshore]]
+    if complexity != "islands":
+        return {"type": "Polygon", "coordinates": [mainland]}
+
+    # Barrier islands off the coast, like the Ria Formosa
+    rng = random.Random(seed + 1)
+    polygons = [[mainland]]
+    for i in range(3):
+        island_west = west + 0.05 + i * 0.12
+        island_east = island_west + 0.08
+        south = _coastline(island_west, island_east, offshore - 0.03, 5, rng, amplitude=0.004)
+        north = _coastline(island_west, island_east, offshore - 0.015, 5, rng, amplitude=0.004)
+        polygons.append([south + north[::-1] + [south[0]]])
+    return {"type": "MultiPolygon", "coordinates": polygons}
+
+
+def _coastline(west, east, lat, levels, rng, amplitude=0.03):
+    # Midpoint displacement. Latitude is a function of longitude, so the line never crosses itself
+    points = [[west, lat], [east, lat]]
+    for level in range(levels):
+        refined = [points[0]]
+        for start, end in zip(points, points[1:]):
+            middle = [(start[0] + end[0]) / 2, (start[1] + end[1]) / 2 + rng.uniform(-1, 1) * amplitude * 0.55**level]
+            refined += [middle, end]
+        points = refined
+    return [[round(lon, 6), round(lat, 6)] for lon, lat in points]
@@ -1,13 +1,14 @@
 import io
 import os
 import re
+from pathlib import Path
 from setuptools import setup, find_packages
 
 scriptFolder = os.path.dirname(os.path.realpath(__file__))
 os.chdir(scriptFolder)
 
 # Find version info from module (without importing the module):
-with open("src/planet_img_pipeline/__init__.py", "r") as fileObj:
+with open("src/__init__.py", "r") as fileObj:
     version = re.search(
         r'^__version__\s*=\s*[\'"]([^\'"]*)[\'"]', fileObj.read(), re.MULTILINE
     ).group(1)
@@ -28,6 +29,9 @@ setup(
     license="MIT",
     packages=find_packages(where="src"),
     package_dir={"": "src"},
+    # Modules live directly in src and import each other by name
+    py_modules=[path.stem for path in Path("src").glob("*.py") if path.stem != "__init__"],
+    entry_points={"console_scripts": ["planet-pipeline=planet_pipeline:main"]},
     test_suite="tests",
     install_requires=[],
     keywords="",
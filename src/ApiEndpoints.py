@@ -0,0 +1,12 @@
+import os
+
+# Base URLs can be pointed at a local simulator (see benchmarks/planet_simulator.py) through the environment
+PLANET_API_URL = os.getenv("PLANET_API_URL", "https://api.planet.com").rstrip("/")
+TIDE_API_URL = os.getenv("TIDE_API_URL", "https://www.hidrografico.pt").rstrip("/")
+
+QUICK_SEARCH_URL = f"{PLANET_API_URL}/data/v1/quick-search"
+STATS_URL = f"{PLANET_API_URL}/data/v1/stats"
+ITEMS_URL = f"{PLANET_API_URL}/data/v1/item-types"
+ORDERS_URL = f"{PLANET_API_URL}/compute/ops/orders/v2"
+SUBSCRIPTIONS_URL = f"{PLANET_API_URL}/auth/v1/experimental/public/my/subscriptions"
+TIDE_URL = f"{TIDE_API_URL}/json/mare.port.val.php"
@@ -0,0 +1,145 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from pathlib import Path
+
+
+class AssetStore:
+    """
+    Content-addressed storage for delivered files. Each file is stored once, as a blob named after its sha256
+    digest and indexed by item id, product bundle and clip AOI, and query folders are trees of links into it.
+    Identical deliveries (the same order under another query name, or re-downloads) are only stored once.
+    """
+
+    def __init__(self, store_path, link_type="hardlink"):
+        self.path = Path(store_path)
+        self.blobs_path = self.path / "blobs"
+        self.blobs_path.mkdir(parents=True, exist_ok=True)
+        if link_type not in ("hardlink", "symlink"):
+            raise ValueError(f"Unknown link type {link_type}")
+        self.link_type = link_type
+        self._local = threading.local()
+        self._connection().execute(
+            """
+            CREATE TABLE IF NOT EXISTS assets (
+                item_id   TEXT NOT NULL,
+                bundle    TEXT NOT NULL,
+                clip_hash TEXT NOT NULL,
+                digest    TEXT NOT NULL,
+                size      INTEGER NOT NULL,
+                PRIMARY KEY (item_id, bundle, clip_hash, digest)
+            )
+            """
+        )
+
+    @staticmethod
+    def clip_hash(clip_aoi):
+        # Unclipped deliveries share the same key. Keys do not depend on the key order of the AOI
+        if clip_aoi is None:
+            return "none"
+        return hashlib.md5(json.dumps(clip_aoi, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def blob_path(self, digest):
+        # Two levels of folders keep directories small on large stores
+        return self.blobs_path / digest[:2] / digest
+
+    def find(self, item_id, bundle, clip_hash, digest):
+        # Blobs are named by digest, so identical bytes delivered under another key are found too
+        blob = self.blob_path(digest)
+        if not blob.exists():
+            return None
+
+        self._index(item_id, bundle, clip_hash, digest, blob)
+        return blob
+
+    def keys(self, digest):
+        # (item id, bundle, clip hash) the blob of a digest is indexed under
+        return self._connection().execute(
+            "SELECT item_id, bundle, clip_hash FROM assets WHERE digest = ?", (digest,)
+        ).fetchall()
+
+    def add(self, source_file, item_id, bundle, clip_hash, digest=None):
+        """
+        Move a downloaded file into the store and return its blob path. The digest is computed if not given.
+        """
+        source_file = Path(source_file)
+        if digest is None:
+            digest = self.file_digest(source_file)
+
+        blob = self.blob_path(digest)
+        blob.parent.mkdir(parents=True, exist_ok=True)
+        if blob.exists():
+            source_file.unlink()
+        else:
+            os.replace(source_file, blob)
+
+        self._index(item_id, bundle, clip_hash, digest, blob)
+        return blob
+
+    def link(self, blob, destination):
+        destination = Path(destination)
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        if destination.exists() or destination.is_symlink():
+            destination.unlink()
+
+        if self.link_type == "symlink":
+            os.symlink(blob.resolve(), destination)
+        else:
+            os.link(blob, destination)
+
+    def collect_garbage(self, view_roots=()):
+        """
+        Remove blobs no query folder links to anymore. Hardlinked blobs are referenced while their link count
+        is above one. Symlinked blobs are only kept if a link to them is found under view_roots.
+        Returns the number of blobs and bytes removed.
+        """
+        referenced = set()
+        for root in view_roots:
+            for dirpath, _, filenames in os.walk(root):
+                for filename in filenames:
+                    file_path = Path(dirpath) / filename
+                    if file_path.is_symlink():
+                        referenced.add(str(file_path.resolve()))
+
+        removed = 0
+        removed_bytes = 0
+        rows = self._connection().execute("SELECT DISTINCT digest FROM assets").fetchall()
+        for (digest,) in rows:
+            blob = self.blob_path(digest)
+            if blob.exists():
+                if blob.stat().st_nlink > 1 or str(blob.resolve()) in referenced:
+                    continue
+                removed_bytes += blob.stat().st_size
+                blob.unlink()
+                removed += 1
+
+            with self._connection() as connection:
+                connection.execute("DELETE FROM assets WHERE digest = ?", (digest,))
+
+        return removed, removed_bytes
+
+    @staticmethod
+    def file_digest(file_path):
+        digest = hashlib.sha256()
+        with open(file_path, "rb") as file:
+            for chunk in iter(lambda: file.read(1024 * 1024), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def _index(self, item_id, bundle, clip_hash, digest, blob):
+        with self._connection() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO assets (item_id, bundle, clip_hash, digest, size) VALUES (?, ?, ?, ?, ?)",
+                (item_id, bundle, clip_hash, digest, blob.stat().st_size),
+            )
+
+    def _connection(self):
+        # sqlite connections can not be shared between threads, so each thread opens its own
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(str(self.path / "index.db"), timeout=60)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
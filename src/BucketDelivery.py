@@ -0,0 +1,186 @@
+import json
+import os
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+from pathlib import Path
+from urllib.parse import urlsplit
+
+from PipelineMetrics import PipelineMetrics
+
+# Size of the byte ranges fetched in parallel, and the most files with ranges in flight at once
+PART_SIZE = 16 * 1024 * 1024
+FILES_IN_FLIGHT = 32
+
+
+class BucketDelivery:
+    """
+    Orders delivered to an S3-compatible bucket (e.g. MinIO) instead of Planet's download links.
+    Orders get a cloud delivery block, and a delivery is complete once the manifest Planet writes next to the files
+    is in the bucket with every file it lists. Files are retrieved with ranged GETs in parallel, several parts of
+    several files at a time. Needs boto3.
+    """
+
+    def __init__(self, url, endpoint=None, region="us-east-1", access_key=None, secret_key=None, part_size=PART_SIZE, max_workers=8, metrics=None, client=None):
+        if client is None:
+            try:
+                import boto3
+                from botocore.config import Config
+            except ImportError:
+                raise ImportError("Bucket delivery needs boto3. Install it with pip install boto3")
+
+        # s3://bucket/prefix
+        parts = urlsplit(url)
+        if parts.scheme != "s3" or not parts.netloc:
+            raise ValueError(f"Bucket {url} is not an s3://bucket/prefix URL")
+        self.bucket = parts.netloc
+        self.prefix = parts.path.strip("/")
+        self.endpoint = endpoint
+        self.region = region
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.part_size = part_size
+        self.max_workers = max_workers
+        self.metrics = metrics or PipelineMetrics(enabled=False)
+        # Clients are thread safe. Path style addressing works with any S3-compatible server
+        self.client = client or boto3.client(
+            "s3",
+            endpoint_url=endpoint,
+            region_name=region,
+            aws_access_key_id=access_key,
+            aws_secret_access_key=secret_key,
+            config=Config(max_pool_connections=max_workers, s3={"addressing_style": "path"}),
+        )
+
+    @property
+    def url(self):
+        return f"s3://{self.bucket}/{self.prefix}" if self.prefix else f"s3://{self.bucket}"
+
+    def delivery_block(self):
+        # Delivery of the Orders API. Planet writes the files of each order under <prefix>/<order id>/
+        delivery = {
+            "s3_compatible": {
+                "endpoint": self.endpoint,
+                "bucket": self.bucket,
+                "region": self.region,
+                "access_key_id": self.access_key,
+                "secret_access_key": self.secret_key,
+                "use_path_style": True,
+            }
+        }
+        if self.prefix:
+            delivery["s3_compatible"]["path_prefix"] = self.prefix
+        return delivery
+
+    def location(self):
+        # Stored in the download queue, so that later runs know where the files of an order are
+        return {"url": self.url, "endpoint": self.endpoint}
+
+    def manifest(self, order_id):
+        """
+        Delivery manifest of an order, or None if it is not in the bucket yet.
+        """
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self._key(order_id, "manifest.json"))
+        except Exception as error:
+            # botocore ClientError, told apart by its error code
+            if getattr(error, "response", {}).get("Error", {}).get("Code") in ("NoSuchKey", "404"):
+                return None
+            raise
+        return json.loads(response["Body"].read())
+
+    def delivered_files(self, order_id):
+        """
+        Files of a complete delivery: [{"key", "path", "size", "digest", "item_id"}], with the manifest itself.
+        Returns None until the manifest and every file it lists are in the bucket.
+        """
+        manifest = self.manifest(order_id)
+        if manifest is None:
+            return None
+
+        sizes = {}
+        order_prefix = self._key(order_id, "")
+        for page in self.client.get_paginator("list_objects_v2").paginate(Bucket=self.bucket, Prefix=order_prefix):
+            for bucket_object in page.get("Contents", []):
+                sizes[bucket_object["Key"][len(order_prefix):]] = bucket_object["Size"]
+
+        files = []
+        for manifest_file in manifest.get("files", []):
+            path = manifest_file["path"]
+            size = manifest_file.get("size", sizes.get(path))
+            if sizes.get(path) is None or sizes[path] != size:
+                return None
+            files.append(
+                {
+                    "key": order_prefix + path,
+                    "path": path,
+                    "size": size,
+                    "digest": manifest_file.get("digests", {}).get("sha256"),
+                    "item_id": manifest_file.get("annotations", {}).get("planet/item_id", ""),
+                }
+            )
+        files.append({"key": order_prefix + "manifest.json", "path": "manifest.json", "size": sizes["manifest.json"], "digest": None, "item_id": ""})
+        return files
+
+    def download(self, files, destination, overwrite=False):
+        """
+        Download delivered files into destination, keeping their paths. Files of the same size already there are
+        skipped unless overwrite. Returns {path in the delivery: local path} of the files that are there.
+        """
+        destination = Path(destination)
+        local_files = {}
+        pending = []
+        for bucket_file in files:
+            file_path = destination / bucket_file["path"]
+            if not overwrite and file_path.is_file() and file_path.stat().st_size == bucket_file["size"]:
+                print(f'{bucket_file["path"]} already exists. Download skipped')
+                local_files[bucket_file["path"]] = file_path
+            else:
+                pending.append((bucket_file, file_path))
+
+        with ThreadPoolExecutor(self.max_workers) as pool:
+            for i in range(0, len(pending), FILES_IN_FLIGHT):
+                in_flight = [(bucket_file, file_path, self._submit(pool, bucket_file, file_path)) for bucket_file, file_path in pending[i:i + FILES_IN_FLIGHT]]
+                for bucket_file, file_path, (descriptor, partial_path, futures) in in_flight:
+                    done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+                    error = next((future.exception() for future in done if future.exception() is not None), None)
+                    if error is not None:
+                        # Queued ranges are cancelled and running ones finish before the descriptor is closed,
+                        # so that none of them writes into a descriptor reused by another file
+                        for future in futures:
+                            future.cancel()
+                        wait(futures)
+                        print(f'\033[31m Could not download {bucket_file["path"]}: {error} \033[0m')
+                        os.close(descriptor)
+                        partial_path.unlink()
+                        continue
+                    os.close(descriptor)
+                    for future in futures:
+                        self.metrics.count("bytes_downloaded", future.result())
+                    # Partial files are only renamed once complete, like every other download
+                    os.replace(partial_path, file_path)
+                    self.metrics.count("files_downloaded")
+                    local_files[bucket_file["path"]] = file_path
+
+        return local_files
+
+    def _submit(self, pool, bucket_file, file_path):
+        print(f'Downloading {bucket_file["path"]}')
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        partial_path = file_path.with_name(file_path.name + ".part")
+        descriptor = os.open(partial_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        os.ftruncate(descriptor, bucket_file["size"])
+        # Each range is written at its offset, so parts can finish in any order
+        futures = [
+            pool.submit(self._fetch_range, bucket_file["key"], start, min(start + self.part_size, bucket_file["size"]) - 1, descriptor)
+            for start in range(0, bucket_file["size"], self.part_size)
+        ]
+        return descriptor, partial_path, futures
+
+    def _fetch_range(self, key, start, end, descriptor):
+        body = self.client.get_object(Bucket=self.bucket, Key=key, Range=f"bytes={start}-{end}")["Body"].read()
+        if len(body) != end - start + 1:
+            raise IOError(f"Range {start}-{end} of {key} returned {len(body)} bytes")
+        os.pwrite(descriptor, body, start)
+        return len(body)
+
+    def _key(self, order_id, path):
+        return "/".join(part for part in (self.prefix, order_id) if part) + "/" + path
@@ -0,0 +1,150 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+# Internal tile size (pixels) and overview factors of converted files
+BLOCK_SIZE = 512
+OVERVIEW_FACTORS = (2, 4, 8, 16, 32, 64)
+
+
+class CogConverter:
+    """
+    Converts delivered GeoTIFFs into tiled, compressed Cloud-Optimized GeoTIFFs with internal overviews.
+    Queries are submitted as soon as they are downloaded and converted in a process pool while downloads continue.
+    Files are copied block by block, so memory use does not depend on the scene size. Needs rasterio (GDAL).
+    Files linked into an asset store are not converted in place, which would leave the link and the stored blob
+    behind. Their COG is added to the store, and the query folder is linked to it instead.
+    """
+
+    def __init__(self, download_queue, max_workers=None, compression="deflate", cache_mb=64, asset_store=None):
+        try:
+            import rasterio  # noqa: F401
+        except ImportError:
+            raise ImportError("COG conversion needs rasterio. Install it with pip install rasterio")
+
+        self.queue = download_queue
+        self.compression = compression
+        # GDAL block cache of each worker
+        self.cache_mb = cache_mb
+        self.pool = ProcessPoolExecutor(max_workers)
+        self.asset_store = asset_store
+        # Query name: [(file path, future)]
+        self.pending = {}
+
+    def submit(self, name, folder):
+        # Files of a previous, interrupted conversion are left behind as .part files
+        files = sorted(path for path in Path(folder).rglob("*.tif") if path.is_file())
+        self.pending[name] = [(path, self._submit(path)) for path in files]
+        print(f"Converting {len(files)} files of {name} to COG")
+        self._record(wait=False)
+
+    def _submit(self, path):
+        if self.asset_store is not None and (path.is_symlink() or path.stat().st_nlink > 1):
+            return self.pool.submit(convert_linked_file, str(path), str(self._cog_path(path)), self.compression, self.cache_mb)
+        return self.pool.submit(convert_file, str(path), self.compression, self.cache_mb)
+
+    def wait(self):
+        self._record(wait=True)
+        self.pool.shutdown()
+
+    def _record(self, wait):
+        # Only the main process writes to the queue
+        for name, futures in list(self.pending.items()):
+            if not wait and not all(future.done() for _, future in futures):
+                continue
+
+            converted = 0
+            failed = []
+            for path, future in futures:
+                try:
+                    result = future.result()
+                    # Linked files return the digests of the stored file and of its COG
+                    if isinstance(result, tuple):
+                        self._store(path, result[0])
+                    if result:
+                        converted += 1
+                except Exception as error:
+                    print(f"\033[31m Could not convert {path.name} to COG: {error} \033[0m")
+                    failed.append(path.name)
+
+            self.queue.set_field(name, "cog", {"converted": converted, "failed": failed})
+            print(f"{name}: {converted} files converted to COG" + (f", {len(failed)} failed" if failed else ""))
+            del self.pending[name]
+
+    def _store(self, path, stored_digest):
+        # The COG is indexed under the keys of the file it was converted from
+        cog_path = self._cog_path(path)
+        digest = self.asset_store.file_digest(cog_path)
+        blob = None
+        for item_id, bundle, clip_hash in self.asset_store.keys(stored_digest) or [("", "", "none")]:
+            if blob is None:
+                blob = self.asset_store.add(cog_path, item_id, bundle, clip_hash, digest)
+            else:
+                self.asset_store.find(item_id, bundle, clip_hash, digest)
+        self.asset_store.link(blob, path)
+
+    @staticmethod
+    def _cog_path(path):
+        # Not matched by *.tif, so that it is never converted itself
+        return path.with_name(path.name + ".cog")
+
+
+def convert_file(file_path, compression="deflate", cache_mb=64, block_size=BLOCK_SIZE, output_path=None):
+    """
+    Convert a GeoTIFF into a COG, in place or into output_path. Returns False if it already was a COG.
+    """
+    import rasterio
+    from rasterio.enums import Resampling
+    from rasterio.shutil import copy as copy_dataset
+
+    file_path = Path(file_path)
+    tiled_path = file_path.with_name(file_path.name + ".tiled.part")
+    cog_path = file_path.with_name(file_path.name + ".cog.part")
+
+    with rasterio.Env(GDAL_CACHEMAX=cache_mb):
+        with rasterio.open(file_path) as source:
+            if source.profile.get("tiled") and source.overviews(1):
+                return False
+
+            profile = source.profile.copy()
+            creation_options = {
+                "tiled": True,
+                "blockxsize": block_size,
+                "blockysize": block_size,
+                "compress": compression,
+                # Horizontal differencing for integers, floating point prediction for floats
+                "predictor": 3 if source.dtypes[0].startswith("float") else 2,
+                "bigtiff": "IF_SAFER",
+            }
+            profile.update(driver="GTiff", **creation_options)
+
+            # Tiled copy, one block at a time
+            with rasterio.open(tiled_path, "w", **profile) as tiled:
+                for _, window in tiled.block_windows(1):
+                    tiled.write(source.read(window=window), window=window)
+
+            factors = [factor for factor in OVERVIEW_FACTORS if min(source.width, source.height) // factor >= block_size // 2]
+
+        # Masks are categorical, and are not averaged
+        resampling = Resampling.nearest if "udm" in file_path.name.lower() else Resampling.average
+        with rasterio.open(tiled_path, "r+") as tiled:
+            tiled.build_overviews(factors or [2], resampling)
+
+        # Copying with the source overviews puts them before the full resolution data, as the COG layout requires
+        copy_dataset(tiled_path, cog_path, driver="GTiff", copy_src_overviews=True, **creation_options)
+
+    os.replace(cog_path, output_path or file_path)
+    tiled_path.unlink()
+    return True
+
+
+def convert_linked_file(file_path, output_path, compression="deflate", cache_mb=64):
+    """
+    Convert a file linked into the asset store into output_path, leaving the stored file unchanged. Returns the
+    digests of the stored file and of the COG, or False if it already was a COG.
+    """
+    from AssetStore import AssetStore
+
+    if not convert_file(file_path, compression, cache_mb, output_path=output_path):
+        return False
+    return AssetStore.file_digest(file_path), AssetStore.file_digest(output_path)
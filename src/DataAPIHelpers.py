@@ -1,16 +1,22 @@
 import time
 import json
 import hashlib
-from TideInterpolator import TideInterpolator
+from ApiEndpoints import ITEMS_URL, QUICK_SEARCH_URL, STATS_URL
+from OrderTools import DEFAULT_BUNDLE
+from PipelineMetrics import PipelineMetrics
 
 class PlanetFilter:
-    def __init__(self, roi, min_date, max_date, max_cloud_cover, asset_type):
-        self.roi = self.__load_roi(roi)
+    def __init__(self, roi, min_date, max_date, max_cloud_cover, asset_type, search_roi=None):
+        # ROI file, or a GeoJSON geometry already loaded by RoiPreprocessor
+        self.roi = roi if isinstance(roi, dict) else self.__load_roi(roi)
+        # Simplified geometry sent to the Data API. The exact ROI is kept for clipping and local filters
+        self.search_roi = search_roi or self.roi
         self.min_date = f"{min_date}T00:00:01.000Z"
         self.max_date = f"{max_date}T23:59:59.000Z"
         self.max_cloud_cover = float(max_cloud_cover)
         self.asset_type = asset_type
         self.filter = None
+        self.search_filter = None
 
     def build_filter(self):
         date_range_filter = {
@@ -40,7 +46,10 @@ class PlanetFilter:
 
         planet_filter = {"item_types": ["PSScene"], "filter": combined_filter}
 
+        # Queries are identified by the filter with the exact ROI, and searched with the simplified one
         self.filter = planet_filter
+        self.search_filter = json.loads(json.dumps(planet_filter))
+        self.search_filter["filter"]["config"][1]["config"] = self.search_roi
 
     @staticmethod
     def __load_roi(roi):
@@ -81,6 +90,14 @@ class AvailableDataQuery:
         layers,
         clip,
         query_name,
+        min_overlap=0.01,
+        lazy_tide=False,
+        journal=None,
+        tide_interpolator=None,
+        metrics=None,
+        catalog=None,
+        bundle=DEFAULT_BUNDLE,
+        tools=None,
     ):
         self.filter = planet_filter
         self.session = planet_session
@@ -97,25 +114,172 @@ class AvailableDataQuery:
         self.layers = layers
         self.clip = clip
         self.name = query_name
+        # Product bundle and tool chain (OrderTools.parse_tools), which tell apart queries of the same scenes
+        self.bundle = bundle
+        self.tools = tools or {}
+        # Items covering less than this fraction of the ROI are dropped before any tide lookup
+        self.min_overlap = min_overlap
+        # Evaluate tides only for the items the optimizer considers, instead of every item found
+        self.lazy_tide = lazy_tide and self.__tide_filtering()
+        # Shared interpolators keep the tidal tables they already downloaded
+        self.tide_interpolator = tide_interpolator
+        self.tide_checks = {}
+        # Stage results of previous (interrupted) runs
+        self.journal = journal
+        self.metrics = metrics or PipelineMetrics(enabled=False)
+        # Optional local catalog of the scenes found by previous searches, and of their tide heights
+        self.catalog = catalog
         self.hash = self.__hashname()
         self.items = self.__concat_items()
 
     def query_stats(self, interval):
-        stats_filter = {"interval": interval, "filter": self.filter.filter}
+        return query_stats(self.session, self.filter, interval, metrics=self.metrics)
 
-        image_stats = self.session.post(
-            "https://api.planet.com/data/v1/stats", json=stats_filter
-        )
+    def within_tide(self, index):
+        """
+        Check if an item is within the tidal range of the query. Tides are only interpolated here in lazy mode.
+        """
+        if not self.lazy_tide:
+            return True
+
+        if index not in self.tide_checks:
+            item = self.items[index]
+            tidal_height = self.__tidal_height(item)
+            item["properties"]["tidal_height"] = tidal_height
+            self.tide_checks[index] = self.min_tide <= tidal_height <= self.max_tide
+
+        return self.tide_checks[index]
+
+    def __tide_filtering(self):
+        return (self.max_tide is not None) & (self.min_tide is not None)
+
+    def __tidal_height(self, item):
+        if self.catalog is not None:
+            tidal_height = self.catalog.tide(item["id"], self.port)
+            if tidal_height is not None:
+                return tidal_height
+
+        if self.tide_interpolator is None:
+            # Loads lxml and numpy, only needed when tides are checked
+            from TideInterpolator import TideInterpolator
+
+            self.tide_interpolator = TideInterpolator(metrics=self.metrics)
+        with self.metrics.stage("tide"):
+            tidal_height = self.tide_interpolator.interpolate_tide(
+                date_time=item["properties"]["acquired"], port=self.port
+            )
 
-        print(image_stats)
+        if self.catalog is not None:
+            self.catalog.set_tide(item["id"], self.port, tidal_height)
+        return tidal_height
 
-        return image_stats.json()
+    def __local_filters(self, items):
+        """
+        Filters that need no requests, applied cheapest first so that the expensive ones see fewer items
+        """
+        n_items = len(items)
+
+        # Cloud cover (scene level property)
+        items = [
+            item for item in items
+            if item["properties"].get("cloud_cover", 0) <= self.filter.max_cloud_cover
+        ]
+
+        # Duplicated scenes of the same strip and acquisition time (e.g. re-processed scenes). Keep the clearest
+        unique_items = {}
+        for item in items:
+            key = (item["properties"].get("strip_id"), item["properties"]["acquired"])
+            if key not in unique_items or (
+                item["properties"].get("cloud_cover", 0)
+                < unique_items[key]["properties"].get("cloud_cover", 0)
+            ):
+                unique_items[key] = item
+        items = sorted(unique_items.values(), key=lambda item: item["properties"]["acquired"])
+
+        # Fraction of the ROI covered by each item. Ratios of areas in geographic coordinates are close enough
+        from shapely.geometry import shape
+
+        roi = shape(self.filter.roi).buffer(0)
+        items = [
+            item for item in items
+            if roi.intersection(shape(item["geometry"]).buffer(0)).area / roi.area >= self.min_overlap
+        ]
+
+        print(f"{n_items - len(items)} of {n_items} items removed by cloud cover, duplicate and ROI overlap filters.")
+        return items
 
     def __concat_items(self):
         """
         Go through all available pages returned by the query and combine them in a single object. Called at init
         """
 
+        # Items of a previous run, already filtered and annotated with tides
+        if self.journal is not None and self.journal.has(self.hash, "items"):
+            print("Loading filtered items from journal.")
+            return self.journal.load(self.hash, "items")
+
+        if self.journal is not None and self.journal.has(self.hash, "search"):
+            print("Loading search results from journal.")
+            items = self.journal.load(self.hash, "search")
+        else:
+            with self.metrics.stage("search"):
+                items = self.__search() if self.catalog is None else self.__catalog_search()
+            # Failed and empty searches are not journaled, so that they are tried again
+            if self.journal is not None and items:
+                self.journal.save(self.hash, "search", items)
+
+        if not items:
+            return None
+
+        self.metrics.count("items_processed", len(items), stage="search")
+        items = self.__local_filters(items)
+
+        if self.lazy_tide:
+            print("Tide heights will be evaluated for the items considered by the optimizer.")
+            items_filtered = items
+        elif self.__tide_filtering():
+            items_filtered = []
+            print(
+                "Acquiring tide height at time of image captures. This might take a while."
+            )
+            for i, item in enumerate(items):
+                tidal_height = self.__tidal_height(item)
+
+                if tidal_height >= self.min_tide and tidal_height <= self.max_tide:
+                    print(
+                        f"Asset {i + 1} of {len(items)} is within tidal range.",
+                        end="\r",
+                    )
+                    item["properties"]["tidal_height"] = tidal_height
+                    items_filtered.append(item)
+        else:
+            print("No tidal height filtering.")
+            items_filtered = items
+
+        # If no items match the filters, return None
+        self.metrics.count("items_processed", len(items_filtered), stage="filter")
+        if len(items_filtered) == 0:
+            items_filtered = None
+
+        if self.journal is not None and items_filtered is not None:
+            self.journal.save(self.hash, "items", items_filtered)
+
+        return items_filtered
+
+    def __catalog_search(self):
+        # Only the parts of the query that no previous search covered are sent to the Data API
+        search_filters = self.catalog.missing(self.filter)
+        if not search_filters:
+            print("Query answered by the scene catalog.")
+        for search_filter in search_filters:
+            items = self.__search(search_filter)
+            if items is None:
+                return None
+            self.catalog.add(items, search_filter)
+
+        return self.catalog.lookup(self.filter)
+
+    def __search(self, search_filter=None):
         tries = 0
         sleep = 1
         # Submit query
@@ -123,14 +287,16 @@ class AvailableDataQuery:
             tries += 1
             try:
                 first_response_page = self.session.post(
-                    "https://api.planet.com/data/v1/quick-search?_sort=acquired asc&_page_size=50",
-                    json=self.filter.filter,
+                    f"{QUICK_SEARCH_URL}?_sort=acquired asc&_page_size=50",
+                    json=search_filter or self.filter.search_filter,
                 )
+                break
             except Exception:
                 # If the query fails, re-try
                 print(
                     f"Error in checking delivery status. Retrying in {sleep ** 2 * 10} seconds"
                 )
+                self.metrics.count("retries", endpoint="quick-search")
                 time.sleep(sleep**2 * 10)
                 sleep += 1
                 continue
@@ -146,7 +312,7 @@ class AvailableDataQuery:
 
         if not current_page["features"]:
             print("No features found for this query.")
-            return None
+            return []
 
         while not last_page:
             items.extend(current_page["features"])
@@ -157,33 +323,7 @@ class AvailableDataQuery:
             else:
                 current_page = self.session.get(next_page_link).json()
 
-        if (self.max_tide is not None) & (self.min_tide is not None):
-            items_filtered = []
-            tide_interpolator = TideInterpolator()
-            print(
-                "Acquiring tide height at time of image captures. This might take a while."
-            )
-            for i, item in enumerate(items):
-                tidal_height = tide_interpolator.interpolate_tide(
-                    date_time=item["properties"]["acquired"], port=self.port
-                )
-
-                if tidal_height >= self.min_tide and tidal_height <= self.max_tide:
-                    print(
-                        f"Asset {i + 1} of {len(items)} is within tidal range.",
-                        end="\r",
-                    )
-                    item["properties"]["tidal_height"] = tidal_height
-                    items_filtered.append(item)
-        else:
-            print("No tidal height filtering.")
-            items_filtered = items
-
-        # If no items match the filters, return None
-        if len(items_filtered) == 0:
-            items_filtered = None
-
-        return items_filtered
+        return items
 
     def __hashname(self):
         query_str = str(
@@ -192,6 +332,69 @@ class AvailableDataQuery:
             + str(self.max_tide)
             + json.dumps(self.filter.filter)
         )
+        # Queries that only differ by their delivery are queued separately. Queries with the default bundle
+        # and no tools keep the hash they had in queues of older versions
+        if self.bundle != DEFAULT_BUNDLE or self.tools:
+            query_str += json.dumps([self.bundle, self.tools], sort_keys=True)
         query_hash = hashlib.md5(query_str.encode("utf-8")).hexdigest()
 
         return query_hash
+
+
+def query_stats(planet_session, planet_filter, interval="day", metrics=None):
+    """
+    Number of items matching a filter in each interval (hour, day, week, month or year), from a single /stats
+    request. Returns the buckets ([{"start_time", "count"}]), or None if the request was refused.
+    """
+    metrics = metrics or PipelineMetrics(enabled=False)
+    stats_filter = {"interval": interval, "item_types": planet_filter.search_filter["item_types"], "filter": planet_filter.search_filter["filter"]}
+
+    tries = 0
+    sleep = 1
+    while True:
+        tries += 1
+        try:
+            response = planet_session.post(STATS_URL, json=stats_filter)
+            break
+        except Exception:
+            if tries >= 30:
+                raise
+            print(f"Error in requesting item statistics. Retrying in {sleep ** 2 * 10} seconds")
+            metrics.count("retries", endpoint="stats")
+            time.sleep(sleep**2 * 10)
+            sleep += 1
+
+    if not response.ok:
+        print("There was an error with the statistics of this query, please check your inputs.")
+        print(response.text)
+        return None
+
+    return response.json()["buckets"]
+
+
+def item_details(planet_session, item_id, item_type="PSScene", metrics=None):
+    """
+    Item of the Data API with the given id, as searches return it. Returns None if the request was refused.
+    """
+    metrics = metrics or PipelineMetrics(enabled=False)
+
+    tries = 0
+    sleep = 1
+    while True:
+        tries += 1
+        try:
+            response = planet_session.get(f"{ITEMS_URL}/{item_type}/items/{item_id}")
+            break
+        except Exception:
+            if tries >= 30:
+                raise
+            print(f"Error in requesting item {item_id}. Retrying in {sleep ** 2 * 10} seconds")
+            metrics.count("retries", endpoint="items")
+            time.sleep(sleep**2 * 10)
+            sleep += 1
+
+    if not response.ok:
+        print(f"Could not get the details of item {item_id}.")
+        return None
+
+    return response.json()
@@ -0,0 +1,144 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from ApiEndpoints import ITEMS_URL
+from PipelineMetrics import PipelineMetrics
+
+# Assets of the analytic_8b_sr_udm2 bundle
+DEFAULT_ASSET_TYPES = ("ortho_analytic_8b_sr", "ortho_analytic_8b_xml", "ortho_udm2")
+
+
+class DataApiDownloader:
+    """
+    Downloads item assets through the Data API, without placing an order. Every asset is activated, activation
+    is polled for all of them concurrently, and each asset is streamed to disk as soon as it is active.
+    There is no clipping or server side processing, so it only suits small jobs that need whole scenes.
+    """
+
+    def __init__(
+        self,
+        planet_session,
+        asset_types=DEFAULT_ASSET_TYPES,
+        max_workers=8,
+        poll_interval=5,
+        timeout=3600,
+        metrics=None,
+    ):
+        self.session = planet_session
+        self.asset_types = asset_types
+        self.max_workers = max_workers
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.metrics = metrics or PipelineMetrics(enabled=False)
+        # (item id, asset type) of the assets the last download found the items do not have
+        self.unavailable = set()
+
+    def download(self, item_ids, destination, overwrite=False):
+        """
+        Download the assets of item_ids into destination. Returns {(item id, asset type): file path} of the
+        downloaded assets. Assets that are not available, or not active before the timeout, are left out.
+        """
+        destination = Path(destination)
+        self.unavailable = set()
+        pending = {(item_id, asset_type) for item_id in item_ids for asset_type in self.asset_types}
+        downloads = {}
+
+        # Existing files are not downloaded again
+        for item_id, asset_type in list(pending):
+            file_path = self._file_path(destination, item_id, asset_type)
+            if file_path.exists() and not overwrite:
+                print(f"{file_path.name} already exists. Download skipped")
+                downloads[(item_id, asset_type)] = None
+                pending.discard((item_id, asset_type))
+
+        deadline = time.monotonic() + self.timeout
+        interval = self.poll_interval
+        # Polling and downloads use separate pools, so that long downloads never delay activation checks
+        with ThreadPoolExecutor(self.max_workers) as poll_pool, ThreadPoolExecutor(self.max_workers) as download_pool:
+            while pending and time.monotonic() < deadline:
+                pending_items = sorted({item_id for item_id, _ in pending})
+                for item_id, assets in zip(pending_items, poll_pool.map(self._poll, pending_items)):
+                    if assets is None:
+                        # Request failed, poll again in the next round
+                        continue
+
+                    for asset_type in self.asset_types:
+                        key = (item_id, asset_type)
+                        if key not in pending:
+                            continue
+                        asset = assets.get(asset_type)
+                        if asset is None:
+                            print(f"Asset {asset_type} of {item_id} is not available. Skipping")
+                            pending.discard(key)
+                            self.unavailable.add(key)
+                        elif asset["status"] == "active" and asset.get("location"):
+                            pending.discard(key)
+                            file_path = self._file_path(destination, item_id, asset_type)
+                            downloads[key] = download_pool.submit(self._stream, asset["location"], file_path)
+
+                if pending:
+                    print(f"{len(pending)} assets activating, checking again in {interval:.0f} seconds", end="\r")
+                    time.sleep(interval)
+                    interval = min(interval * 1.5, 60)
+
+            for key in pending:
+                print(f"Asset {key[1]} of {key[0]} was not activated in time")
+
+            files = {}
+            for key, download in downloads.items():
+                file_path = self._file_path(destination, *key)
+                if download is None or download.result():
+                    files[key] = file_path
+        return files
+
+    def _poll(self, item_id):
+        # Returns the assets of an item, after requesting the activation of the inactive ones
+        try:
+            response = self.session.get(f"{ITEMS_URL}/PSScene/items/{item_id}/assets")
+        except Exception:
+            response = None
+        if response is None or not response.ok:
+            self.metrics.count("retries", endpoint="assets")
+            return None
+
+        assets = response.json()
+        for asset_type in self.asset_types:
+            asset = assets.get(asset_type)
+            if asset is not None and asset["status"] == "inactive":
+                try:
+                    self.session.get(asset["_links"]["activate"])
+                except Exception:
+                    # Activation is requested again in the next round
+                    pass
+        return assets
+
+    def _stream(self, location, file_path):
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        # Write to a temporary file first, so that a worker taking over never mistakes a partial download for a file
+        partial_path = file_path.with_name(file_path.name + ".part")
+        print(f"Downloading {file_path.name}")
+        for tries in range(1, 6):
+            try:
+                with self.session.get(location, stream=True) as response:
+                    if response.ok:
+                        with open(partial_path, "wb") as file:
+                            for chunk in response.iter_content(chunk_size=1024 * 1024):
+                                file.write(chunk)
+                                self.metrics.count("bytes_downloaded", len(chunk))
+                        os.replace(partial_path, file_path)
+                        self.metrics.count("files_downloaded")
+                        return True
+            except Exception:
+                pass
+            self.metrics.count("retries", endpoint="asset-download")
+            time.sleep(tries**2 * 10)
+
+        print(f"\033[31m Could not download {file_path.name} \033[0m")
+        return False
+
+    @staticmethod
+    def _file_path(destination, item_id, asset_type):
+        extension = ".xml" if asset_type.endswith("_xml") else ".tif"
+        return destination / f"{item_id}_{asset_type}{extension}"
@@ -0,0 +1,311 @@
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+
+class DownloadQueue:
+    """
+    Stores the download queue in a SQLite database (WAL mode), so that each order can be updated on its own
+    and status checks do not have to load every ROI polygon in the queue.
+    Queues created by older versions (download_queue.json) are imported the first time they are opened.
+
+    Several workers can share the same queue. Each one leases the orders it works on, so that no order is
+    placed or downloaded twice, and leases of workers that stop sending heartbeats expire.
+    WAL mode needs shared memory between processes, so queues on network storage (NFS, SMB) must be opened
+    with shared_storage=True, which uses a rollback journal and file locks instead.
+    """
+
+    # Optional fields of queue entries. Each is stored as a JSON column, added to older databases when opened
+    OPTIONAL_FIELDS = ("members", "footprints", "parts", "order_group", "clip", "bundle", "tools", "layers", "cog", "mosaics", "mosaic_state", "delivery", "unavailable")
+
+    def __init__(self, queue_path, shared_storage=False):
+        queue_path = Path(queue_path)
+        # Older queues were plain JSON files. Keep the same CLI argument, but store the queue next to it
+        if queue_path.suffix == ".json":
+            self.path = queue_path.with_suffix(".db")
+            json_path = queue_path
+        else:
+            self.path = queue_path
+            json_path = None
+
+        self._local = threading.local()
+        self.shared_storage = shared_storage
+        new_database = not self.path.exists()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._create_tables()
+
+        if new_database and json_path is not None and json_path.is_file():
+            print(f"Importing download queue {json_path} into {self.path}")
+            self.import_json(json_path)
+
+    def __contains__(self, name):
+        row = self._connection().execute(
+            "SELECT 1 FROM queries WHERE name = ?", (name,)
+        ).fetchone()
+        return row is not None
+
+    def __iter__(self):
+        return iter(self.names())
+
+    def __len__(self):
+        return self._connection().execute("SELECT COUNT(*) FROM queries").fetchone()[0]
+
+    def names(self, status=None):
+        if status is None:
+            rows = self._connection().execute("SELECT name FROM queries ORDER BY rowid")
+        else:
+            rows = self._connection().execute(
+                "SELECT name FROM queries WHERE status = ? ORDER BY rowid", (status,)
+            )
+        return [row[0] for row in rows]
+
+    def statuses(self):
+        # Only reads the indexed columns, ROIs and item lists are never loaded
+        rows = self._connection().execute("SELECT name, status FROM queries ORDER BY rowid")
+        return [(row[0], row[1]) for row in rows]
+
+    def has_hash(self, query_hash):
+        row = self._connection().execute(
+            "SELECT 1 FROM queries WHERE hash = ? LIMIT 1", (query_hash,)
+        ).fetchone()
+        return row is not None
+
+    def name_of_hash(self, query_hash):
+        # Name the query with this hash was queued under, which may differ from its name in a later CSV
+        row = self._connection().execute(
+            "SELECT name FROM queries WHERE hash = ? ORDER BY rowid LIMIT 1", (query_hash,)
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def get(self, name):
+        row = self._connection().execute(
+            f"SELECT {self._columns()} FROM queries WHERE name = ?", (name,)
+        ).fetchone()
+        if row is None:
+            raise KeyError(name)
+
+        return self._row_to_entry(row)
+
+    def items(self):
+        rows = self._connection().execute(
+            f"SELECT {self._columns()} FROM queries ORDER BY rowid"
+        )
+        return [(row[0], self._row_to_entry(row)) for row in rows]
+
+    def add(self, name, entry):
+        with self._transaction() as connection:
+            self._insert(connection, name, entry)
+
+    def set_items(self, name, items):
+        with self._transaction() as connection:
+            connection.execute(
+                "UPDATE queries SET items = ? WHERE name = ?", (json.dumps(items), name)
+            )
+
+    def set_field(self, name, field, value):
+        if field not in self.OPTIONAL_FIELDS:
+            raise ValueError(f"Unknown queue field {field}")
+
+        with self._transaction() as connection:
+            connection.execute(
+                f"UPDATE queries SET {field} = ? WHERE name = ?",
+                (None if value is None else json.dumps(value), name),
+            )
+
+    def mark_ordered(self, name, order_id):
+        with self._transaction() as connection:
+            connection.execute(
+                "UPDATE queries SET status = 'ordered', order_id = ? WHERE name = ?",
+                (order_id, name),
+            )
+
+    def set_order_id(self, name, order_id):
+        # Stores the order id as soon as the order is placed, so that a worker taking over
+        # this order does not place it a second time
+        with self._transaction() as connection:
+            connection.execute(
+                "UPDATE queries SET order_id = ? WHERE name = ?", (order_id, name)
+            )
+
+    def mark_downloaded(self, name):
+        with self._transaction() as connection:
+            connection.execute(
+                "UPDATE queries SET status = 'downloaded' WHERE name = ?", (name,)
+            )
+
+    def acquire_lease(self, name, worker, status, duration):
+        """
+        Lease an order to a worker, if it is still in the expected status and no other worker holds a valid lease.
+        Returns True if the lease was acquired.
+        """
+        now = time.time()
+        with self._transaction() as connection:
+            row = connection.execute(
+                "SELECT status FROM queries WHERE name = ?", (name,)
+            ).fetchone()
+            if row is None or row[0] != status:
+                return False
+
+            lease = connection.execute(
+                "SELECT worker, expires_at FROM leases WHERE name = ?", (name,)
+            ).fetchone()
+            if lease is not None and lease[0] != worker and lease[1] > now:
+                return False
+
+            if lease is not None and lease[0] != worker:
+                print(f"Lease of {name} held by {lease[0]} expired. Taking over.")
+
+            connection.execute(
+                "INSERT OR REPLACE INTO leases (name, worker, status, expires_at) VALUES (?, ?, ?, ?)",
+                (name, worker, status, now + duration),
+            )
+        return True
+
+    def renew_lease(self, name, worker, duration):
+        # Heartbeat. Returns False if the lease was lost to another worker
+        with self._transaction() as connection:
+            cursor = connection.execute(
+                "UPDATE leases SET expires_at = ? WHERE name = ? AND worker = ?",
+                (time.time() + duration, name, worker),
+            )
+        return cursor.rowcount == 1
+
+    def release_lease(self, name, worker):
+        with self._transaction() as connection:
+            connection.execute(
+                "DELETE FROM leases WHERE name = ? AND worker = ?", (name, worker)
+            )
+
+    def leases(self):
+        rows = self._connection().execute(
+            "SELECT name, worker, status, expires_at FROM leases ORDER BY name"
+        )
+        return [tuple(row) for row in rows]
+
+    def import_json(self, json_path):
+        with open(json_path, "r", encoding="utf-8") as file:
+            json_queue = json.load(file)
+
+        # A single transaction, so that large queues are imported in one write
+        with self._transaction() as connection:
+            for name, entry in json_queue.items():
+                self._insert(connection, name, entry)
+
+        return len(json_queue)
+
+    def export_json(self, json_path):
+        with open(json_path, "w", encoding="utf-8") as file:
+            json.dump(dict(self.items()), file, indent=4)
+
+    def close(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+    def _connection(self):
+        # sqlite connections can not be shared between threads, so each thread opens its own
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(str(self.path), timeout=60, isolation_level=None)
+            if self.shared_storage:
+                connection.execute("PRAGMA journal_mode=DELETE")
+                connection.execute("PRAGMA synchronous=FULL")
+            else:
+                connection.execute("PRAGMA journal_mode=WAL")
+                connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    @contextmanager
+    def _transaction(self):
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    def _create_tables(self):
+        connection = self._connection()
+        connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS queries (
+                name     TEXT PRIMARY KEY,
+                hash     TEXT NOT NULL,
+                status   TEXT NOT NULL DEFAULT 'queued',
+                order_id TEXT,
+                area     REAL,
+                roi      TEXT,
+                items    TEXT
+            );
+            CREATE INDEX IF NOT EXISTS queries_hash ON queries (hash);
+            CREATE INDEX IF NOT EXISTS queries_status ON queries (status);
+            CREATE TABLE IF NOT EXISTS leases (
+                name       TEXT PRIMARY KEY,
+                worker     TEXT NOT NULL,
+                status     TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            );
+            """
+        )
+
+        existing_columns = [row[1] for row in connection.execute("PRAGMA table_info(queries)")]
+        for field in self.OPTIONAL_FIELDS:
+            if field not in existing_columns:
+                connection.execute(f"ALTER TABLE queries ADD COLUMN {field} TEXT")
+
+    @classmethod
+    def _columns(cls):
+        return ", ".join(("name", "hash", "status", "order_id", "area", "roi", "items") + cls.OPTIONAL_FIELDS)
+
+    @classmethod
+    def _insert(cls, connection, name, entry):
+        if entry.get("downloaded"):
+            status = "downloaded"
+        elif entry.get("ordered"):
+            status = "ordered"
+        else:
+            status = "queued"
+
+        optional_values = [
+            None if entry.get(field) is None else json.dumps(entry[field])
+            for field in cls.OPTIONAL_FIELDS
+        ]
+        placeholders = ", ".join(["?"] * (7 + len(cls.OPTIONAL_FIELDS)))
+        connection.execute(
+            f"INSERT OR REPLACE INTO queries ({cls._columns()}) VALUES ({placeholders})",
+            [
+                name,
+                entry["hash"],
+                status,
+                entry.get("id"),
+                entry.get("area"),
+                json.dumps(entry["roi"]),
+                json.dumps(entry["items"]),
+            ]
+            + optional_values,
+        )
+
+    @classmethod
+    def _row_to_entry(cls, row):
+        name, query_hash, status, order_id, area, roi, items = row[:7]
+        entry = {
+            "roi": json.loads(roi),
+            "hash": query_hash,
+            "items": json.loads(items),
+            "ordered": status in ("ordered", "downloaded"),
+            "downloaded": status == "downloaded",
+            "area": area,
+        }
+        if order_id is not None:
+            entry["id"] = order_id
+        for field, value in zip(cls.OPTIONAL_FIELDS, row[7:]):
+            if value is not None:
+                entry[field] = json.loads(value)
+        return entry
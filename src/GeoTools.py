@@ -0,0 +1,21 @@
+"""
+Geometry helpers shared by the stages that measure areas. ROIs and footprints are in WGS84 (EPSG:4326), and
+areas are measured in PT-TM06 (EPSG:3763), in square meters.
+"""
+import threading
+
+# Transformers are slow to create and can not be shared between threads, so each thread keeps its own
+_local = threading.local()
+
+
+def project_vectors(vector):
+    # Project a shapely geometry from WGS84 to PT-TM06
+    # https://medium.com/@pramukta/recipe-importing-geojson-into-shapely-da1edf79f41d
+    import pyproj
+    from shapely.ops import transform
+
+    transformer = getattr(_local, "transformer", None)
+    if transformer is None:
+        transformer = pyproj.Transformer.from_crs(pyproj.CRS("EPSG:4326"), pyproj.CRS("EPSG:3763"), always_xy=True)
+        _local.transformer = transformer
+    return transform(transformer.transform, vector)
@@ -0,0 +1,289 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from xml.sax.saxutils import escape
+
+# Output windows (pixels) processed by each worker, and the most windows in flight per worker
+WINDOW_SIZE = 1024
+WINDOWS_IN_FLIGHT = 2
+# udm2 bands: clear (1) and confidence (7, 0-100)
+UDM2_CLEAR_BAND = 1
+UDM2_CONFIDENCE_BAND = 7
+
+
+class MosaicBuilder:
+    """
+    Assembles the layers chosen by MosaicOptimizer (stored in the download queue) into one mosaic per layer.
+    COG mosaics keep, for each pixel, the scene whose udm2 mask is clear with the highest confidence, and are
+    masked to the ROI. The output is computed in windows by a process pool, so that memory use depends on the
+    window size and not on the ROI or scene sizes. VRT mosaics only reference the scenes, clearest on top. They are
+    not masked to the ROI: they cover the union of the scene bounds, and unclipped scenes show past the ROI.
+    Needs rasterio (GDAL) and numpy.
+    """
+
+    def __init__(self, output_format="cog", max_workers=None, window_size=WINDOW_SIZE):
+        try:
+            import rasterio  # noqa: F401
+            import numpy  # noqa: F401
+        except ImportError:
+            raise ImportError("Mosaics need rasterio and numpy. Install them with pip install rasterio numpy")
+        if output_format not in ("cog", "vrt"):
+            raise ValueError(f"Unknown mosaic format {output_format}")
+
+        self.output_format = output_format
+        self.max_workers = max_workers or os.cpu_count()
+        self.window_size = window_size
+
+    def build(self, name, entry, folder, destination):
+        """
+        Build the mosaic of each layer of a downloaded query in folder. Returns the paths of the mosaics.
+        """
+        if not entry.get("layers"):
+            print(f"Query {name} has no layers in the queue. Prepare it again to build mosaics")
+            return []
+
+        files = find_scene_files(folder, [item_id for layer in entry["layers"] for item_id in layer])
+        destination = Path(destination)
+        destination.mkdir(parents=True, exist_ok=True)
+        mosaics = []
+        for j, layer in enumerate(entry["layers"]):
+            scenes = [files[item_id] for item_id in layer if item_id in files]
+            missing = len(layer) - len(scenes)
+            if missing:
+                print(f"{missing} scenes of layer {j + 1} of {name} were not found in {folder}")
+            if not scenes:
+                continue
+
+            output_path = destination / f"{name}_layer{j + 1}.{'tif' if self.output_format == 'cog' else 'vrt'}"
+            print(f"Building mosaic of layer {j + 1} of {name} from {len(scenes)} scenes")
+            if self.output_format == "vrt":
+                if not entry.get("clip", True):
+                    print(f"\033[33m Scenes of {name} were not clipped, and the VRT is not masked to the ROI. Build a COG mosaic to mask it \033[0m")
+                self._build_vrt(scenes, output_path)
+            else:
+                self._build_cog(scenes, entry["roi"], output_path)
+            mosaics.append(str(output_path))
+
+        return mosaics
+
+    def _build_cog(self, scenes, roi, output_path):
+        import rasterio
+
+        from CogConverter import convert_file
+
+        grid = output_grid(scenes, roi)
+        with rasterio.open(scenes[0]["analytic"]) as first:
+            profile = {
+                "driver": "GTiff",
+                "count": first.count,
+                "dtype": first.dtypes[0],
+                "nodata": 0,
+                "tiled": True,
+                "blockxsize": 512,
+                "blockysize": 512,
+                "compress": "deflate",
+                "bigtiff": "IF_SAFER",
+            }
+        profile.update(crs=grid["crs"], transform=grid["transform"], width=grid["width"], height=grid["height"])
+
+        windows = [
+            (row, col, min(self.window_size, grid["height"] - row), min(self.window_size, grid["width"] - col))
+            for row in range(0, grid["height"], self.window_size)
+            for col in range(0, grid["width"], self.window_size)
+        ]
+        partial_path = output_path.with_name(output_path.name + ".part")
+        with rasterio.open(partial_path, "w", **profile) as mosaic:
+            with ProcessPoolExecutor(self.max_workers) as pool:
+                # Windows are submitted a few at a time, so finished windows never pile up in memory
+                in_flight = []
+                for window in windows:
+                    in_flight.append((window, pool.submit(mosaic_window, scenes, roi, grid, window)))
+                    if len(in_flight) >= self.max_workers * WINDOWS_IN_FLIGHT:
+                        self._write_window(mosaic, *in_flight.pop(0))
+                for window, future in in_flight:
+                    self._write_window(mosaic, window, future)
+
+        os.replace(partial_path, output_path)
+        # Overviews and COG layout
+        convert_file(str(output_path))
+
+    @staticmethod
+    def _write_window(mosaic, window, future):
+        from rasterio.windows import Window
+
+        row, col, height, width = window
+        mosaic.write(future.result(), window=Window(col, row, width, height))
+
+    @staticmethod
+    def _build_vrt(scenes, output_path):
+        # The extent is the union of the scene bounds, pixels outside the ROI are kept
+        import rasterio
+
+        # Later sources are drawn over earlier ones, so the clearest scenes go last
+        scenes = sorted(scenes, key=clear_fraction)
+        datasets = [rasterio.open(scene["analytic"]) for scene in scenes]
+        try:
+            crs = datasets[0].crs
+            if any(dataset.crs != crs for dataset in datasets):
+                raise ValueError("Scenes of a layer are in different projections. Build a COG mosaic instead")
+
+            resolution = datasets[0].res
+            left = min(dataset.bounds.left for dataset in datasets)
+            top = max(dataset.bounds.top for dataset in datasets)
+            right = max(dataset.bounds.right for dataset in datasets)
+            bottom = min(dataset.bounds.bottom for dataset in datasets)
+            width = round((right - left) / resolution[0])
+            height = round((top - bottom) / resolution[1])
+            data_type = {"uint8": "Byte", "uint16": "UInt16", "int16": "Int16", "float32": "Float32"}[datasets[0].dtypes[0]]
+
+            lines = [f'<VRTDataset rasterXSize="{width}" rasterYSize="{height}">']
+            lines.append(f"  <SRS>{escape(crs.to_wkt())}</SRS>")
+            lines.append(f"  <GeoTransform>{left}, {resolution[0]}, 0, {top}, 0, {-resolution[1]}</GeoTransform>")
+            for band in range(1, datasets[0].count + 1):
+                lines.append(f'  <VRTRasterBand dataType="{data_type}" band="{band}">')
+                lines.append("    <NoDataValue>0</NoDataValue>")
+                for dataset in datasets:
+                    x_offset = round((dataset.bounds.left - left) / resolution[0])
+                    y_offset = round((top - dataset.bounds.top) / resolution[1])
+                    lines += [
+                        "    <ComplexSource>",
+                        f'      <SourceFilename relativeToVRT="0">{escape(str(Path(dataset.name).resolve()))}</SourceFilename>',
+                        f"      <SourceBand>{band}</SourceBand>",
+                        f'      <SrcRect xOff="0" yOff="0" xSize="{dataset.width}" ySize="{dataset.height}"/>',
+                        f'      <DstRect xOff="{x_offset}" yOff="{y_offset}" xSize="{dataset.width}" ySize="{dataset.height}"/>',
+                        "      <NODATA>0</NODATA>",
+                        "    </ComplexSource>",
+                    ]
+                lines.append("  </VRTRasterBand>")
+            lines.append("</VRTDataset>")
+        finally:
+            for dataset in datasets:
+                dataset.close()
+
+        output_path.write_text("\n".join(lines) + "\n")
+
+
+def find_scene_files(folder, item_ids):
+    """
+    Analytic and udm2 files of each item in a query folder, for Orders API and Data API deliveries:
+    {item id: {"analytic": path, "udm2": path or None}}
+    """
+    item_ids = set(item_ids)
+    files = {}
+    for path in sorted(Path(folder).rglob("*.tif")):
+        name = path.name
+        # File names start with the item id, which has 3 or 4 parts (e.g. 20230101_103045_12_2455)
+        parts = name.split("_")
+        item_id = next((candidate for candidate in ("_".join(parts[:4]), "_".join(parts[:3])) if candidate in item_ids), None)
+        if item_id is None:
+            continue
+        scene = files.setdefault(item_id, {"analytic": None, "udm2": None})
+        if "udm2" in name.lower():
+            scene["udm2"] = str(path)
+        elif scene["analytic"] is None or "analytic" in name.lower():
+            scene["analytic"] = str(path)
+
+    return {item_id: scene for item_id, scene in files.items() if scene["analytic"] is not None}
+
+
+def clear_fraction(scene):
+    # Fraction of clear pixels of a scene, read from a decimated udm2 so that it stays cheap
+    import rasterio
+
+    if scene["udm2"] is None:
+        return 0
+    with rasterio.open(scene["udm2"]) as udm2:
+        clear = udm2.read(UDM2_CLEAR_BAND, out_shape=(max(udm2.height // 16, 1), max(udm2.width // 16, 1)))
+    return float(clear.mean())
+
+
+def output_grid(scenes, roi):
+    # Grid of the mosaic: projection and resolution of the first scene, extent of the ROI
+    import rasterio
+    from rasterio.transform import from_origin
+    from rasterio.warp import transform_geom
+
+    with rasterio.open(scenes[0]["analytic"]) as first:
+        crs = first.crs
+        resolution = first.res[0]
+    roi = transform_geom("EPSG:4326", crs, roi)
+    points = [
+        point
+        for polygon in ([roi["coordinates"]] if roi["type"] == "Polygon" else roi["coordinates"])
+        for ring in polygon
+        for point in ring
+    ]
+    left = min(point[0] for point in points)
+    top = max(point[1] for point in points)
+    width = int((max(point[0] for point in points) - left) / resolution) + 1
+    height = int((top - min(point[1] for point in points)) / resolution) + 1
+    return {
+        "crs": crs.to_wkt(),
+        "transform": from_origin(left, top, resolution, resolution),
+        "width": width,
+        "height": height,
+    }
+
+
+def mosaic_window(scenes, roi, grid, window):
+    """
+    Pixels of one window of a mosaic. Each pixel comes from the scene with the best udm2 score:
+    clear and confident pixels first, then any pixel with data. Pixels outside the ROI are left empty.
+    """
+    import numpy as np
+    import rasterio
+    from rasterio.enums import Resampling
+    from rasterio.features import geometry_mask
+    from rasterio.vrt import WarpedVRT
+    from rasterio.warp import transform_bounds, transform_geom
+    from rasterio.windows import Window, bounds as window_bounds, transform as window_transform
+
+    row, col, height, width = window
+    output_window = Window(col, row, width, height)
+    left, bottom, right, top = window_bounds(output_window, grid["transform"])
+    # Scenes are warped to the mosaic grid, and only this window is read from them
+    warp = {
+        "crs": grid["crs"],
+        "transform": grid["transform"],
+        "width": grid["width"],
+        "height": grid["height"],
+        "resampling": Resampling.nearest,
+    }
+
+    pixels = None
+    best_score = np.zeros((height, width), dtype="float32")
+    for scene in scenes:
+        with rasterio.open(scene["analytic"]) as source:
+            # Skip scenes that do not reach this window
+            scene_left, scene_bottom, scene_right, scene_top = transform_bounds(source.crs, grid["crs"], *source.bounds)
+            if scene_left >= right or scene_right <= left or scene_bottom >= top or scene_top <= bottom:
+                continue
+            with WarpedVRT(source, **warp) as analytic:
+                data = analytic.read(window=output_window)
+
+        if pixels is None:
+            pixels = np.zeros_like(data)
+        valid = np.any(data != 0, axis=0)
+        score = valid.astype("float32")
+        if scene["udm2"] is not None:
+            with rasterio.open(scene["udm2"]) as source, WarpedVRT(source, **warp) as udm2:
+                clear = udm2.read(UDM2_CLEAR_BAND, window=output_window).astype("float32")
+                confidence = udm2.read(UDM2_CONFIDENCE_BAND, window=output_window).astype("float32")
+            score += valid * clear * (1 + confidence)
+
+        better = score > best_score
+        pixels[:, better] = data[:, better]
+        best_score[better] = score[better]
+
+    if pixels is None:
+        with rasterio.open(scenes[0]["analytic"]) as first:
+            return np.zeros((first.count, height, width), dtype=first.dtypes[0])
+
+    inside = geometry_mask(
+        [transform_geom("EPSG:4326", grid["crs"], roi)],
+        out_shape=(height, width),
+        transform=window_transform(output_window, grid["transform"]),
+        invert=True,
+    )
+    pixels[:, ~inside] = 0
+    return pixels
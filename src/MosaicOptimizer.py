@@ -1,6 +1,14 @@
-import pyproj
-from shapely.geometry import shape, GeometryCollection
-from shapely.ops import transform
+from shapely.geometry import mapping, shape, GeometryCollection
+from shapely.ops import unary_union
+from GeoTools import project_vectors
+from PipelineMetrics import PipelineMetrics
+
+# Tolerance (m) of the ROI used for coverage. Well under a PSScene pixel, but coastlines lose most of their vertices
+ROI_TOLERANCE = 1
+# Cloud cover at which the coverage of a tile stops counting. Scenes whose delivered udm2 showed less of an ROI
+# clear than MIN_SCORED_CLEAR are not selected again
+MAX_PENALIZED_CLOUD_COVER = 0.1
+MIN_SCORED_CLEAR = 0.5
 
 
 class MosaicOptimizer:
@@ -9,12 +17,14 @@ class MosaicOptimizer:
     tile selection would look like.
     """
 
-    def __init__(self, data_query):
-        self.roi = self.__project_vectors(shape(data_query.filter.roi).buffer(0))
+    def __init__(self, data_query, scores=None):
+        self.roi = project_vectors(shape(data_query.filter.roi).buffer(0))
+        # Every intersection and difference below is with the ROI, and scales with its number of vertices
+        self.roi = self.roi.simplify(ROI_TOLERANCE, preserve_topology=True)
         # Project all vector data to EPSG 3763 to allow calculating areas in square kilometers
         # https://medium.com/@pramukta/recipe-importing-geojson-into-shapely-da1edf79f41d
         if data_query.items:
-            self.items = self.__project_vectors(
+            self.items = project_vectors(
                 GeometryCollection(
                     [shape(item["geometry"]).buffer(0) for item in data_query.items]
                 )
@@ -23,15 +33,11 @@ class MosaicOptimizer:
             self.items = None
         self.query = data_query.items
         self.session = data_query.session
-
-    @staticmethod
-    def __project_vectors(vector):
-        wgs84 = pyproj.CRS("EPSG:4326")
-        pttm06 = pyproj.CRS("EPSG:3763")
-        transformation = pyproj.Transformer.from_crs(
-            wgs84, pttm06, always_xy=True
-        ).transform
-        return transform(transformation, vector)
+        # With lazy tide evaluation, tides are only checked for the tiles the optimizer is about to use
+        self.within_tide = data_query.within_tide
+        self.metrics = getattr(data_query, "metrics", None) or PipelineMetrics(enabled=False)
+        # Clear fraction of the scenes that were delivered before, from their udm2 masks (SceneCatalog.scores)
+        self.scores = scores or {}
 
     def select_tiles(self, n_layers, min_coverage):
         if not self.items:
@@ -46,9 +52,18 @@ class MosaicOptimizer:
             intersection_area.append(current_intersect.area / 1000000)
 
         # Select the nth items with highest ROI cover to start the mosaic, where n = number of layers
-        starter_indices = sorted(
-            range(len(intersection_area)), key=lambda i: intersection_area[i]
-        )[-int(n_layers) :]
+        # Items outside of the tidal range are only found out (and skipped) here in lazy mode
+        rejected_items = {i for i in range(len(self.query)) if self.__unusable(i)}
+        starter_indices = []
+        for i in sorted(
+            range(len(intersection_area)), key=lambda i: intersection_area[i], reverse=True
+        ):
+            if len(starter_indices) == int(n_layers):
+                break
+            if i not in rejected_items and self.within_tide(i):
+                starter_indices.append(i)
+            else:
+                rejected_items.add(i)
         mosaics.extend(starter_indices)
         # Keep track of which items were already used in this query
         included_items = mosaics.copy()
@@ -67,20 +82,20 @@ class MosaicOptimizer:
                 intersection_area = []
                 wasted_area = []
                 for j, item in enumerate(self.items.geoms):
-                    if j in included_items:
+                    if j in included_items or j in rejected_items:
                         intersection_area.append(0)
                         wasted_area.append(item.area)
                         continue
 
-                    # Penalize
+                    # Penalize cloudy tiles, from their udm2 score if they were delivered before
                     cloud_cover_penalty = 1 - (
-                        self.query[j]["properties"]["cloud_cover"] / 0.1
+                        (1 - self._clearness(j)) / MAX_PENALIZED_CLOUD_COVER
                     )
                     cloud_cover_penalty = (
                         1 if cloud_cover_penalty > 1 else cloud_cover_penalty
                     )
                     cloud_cover_penalty = (
-                        0 if cloud_cover_penalty > 0 else cloud_cover_penalty
+                        0 if cloud_cover_penalty < 0 else cloud_cover_penalty
                     )
                     # Area of missing region covered by item
                     current_intersect = (
@@ -96,11 +111,20 @@ class MosaicOptimizer:
                     intersection_area.append(current_intersect / 1000000)
                     wasted_area.append(current_waste / 1000000)
 
-                new_tile_index = intersection_area.index(max(intersection_area))
+                # Best tile that adds clear coverage and is within the tidal range. Used and rejected tiles add nothing
+                new_tile_index = None
+                for j in sorted(range(len(intersection_area)), key=lambda j: intersection_area[j], reverse=True):
+                    if intersection_area[j] <= 0:
+                        break
+                    if self.within_tide(j):
+                        new_tile_index = j
+                        break
+                    rejected_items.add(j)
                 loops += 1
-                # If we are out of tiles, and are starting to re-use them, go to next mosaic
-                if new_tile_index in included_items:
-                    continue
+                self.metrics.count("optimizer_iterations")
+                # No tile adds clear coverage, go to next mosaic
+                if new_tile_index is None:
+                    break
 
                 mosaics[i][0].append(new_tile_index)
                 included_items.append(new_tile_index)
@@ -116,3 +140,108 @@ class MosaicOptimizer:
             }
 
         return mosaics
+
+    def mosaic_state(self, mosaics):
+        """
+        Covered and missing regions (EPSG 3763) of each mosaic chosen by select_tiles, and the items that were
+        candidates. Kept in the download queue, so that new scenes can be added later without starting over.
+        """
+        layers = []
+        for indices, _ in mosaics or []:
+            covered = unary_union([self.items.geoms[i] for i in indices])
+            layers.append(self.__layer_state([self.query[i]["id"] for i in indices], covered))
+        return {"layers": layers, "candidates": [item["id"] for item in self.query or []]}
+
+    def state_from_queue(self, entry):
+        # Queues prepared before mosaic states were kept. Every current item counts as a new candidate
+        footprints = entry.get("footprints", {})
+        layers = []
+        for layer in entry.get("layers") or [entry["items"]]:
+            geometries = [project_vectors(shape(footprints[item_id]).buffer(0)) for item_id in layer if item_id in footprints]
+            layers.append(self.__layer_state(list(layer), unary_union(geometries) if geometries else GeometryCollection()))
+        return {"layers": layers, "candidates": []}
+
+    def update_tiles(self, state, min_coverage, replaceable=True):
+        """
+        Incremental version of select_tiles for a query whose items grew. Only items that were not candidates
+        in state are checked: against the missing region of each mosaic (additions), and, if the queued items
+        are replaceable (not ordered yet), against the part of the ROI that only one queued item covers (swaps
+        for a clearer scene). Returns the new state and the list of changes.
+        """
+        if not self.items:
+            return state, []
+
+        ids = [item["id"] for item in self.query]
+        index = {item_id: i for i, item_id in enumerate(ids)}
+        known = set(state["candidates"])
+        new_items = [i for i, item_id in enumerate(ids) if item_id not in known and not self.__unusable(i)]
+        used = {item_id for layer in state["layers"] for item_id in layer["items"]}
+        changes = []
+        layers = []
+
+        for j, layer in enumerate(state["layers"]):
+            layer_items = list(layer["items"])
+            covered = shape(layer["covered"])
+            missing = shape(layer["missing"])
+
+            # Swap queued items for clearer new items that cover all the ROI only they cover
+            if replaceable and all(item_id in index for item_id in layer_items):
+                for k, item_id in enumerate(list(layer_items)):
+                    old_item = self.items.geoms[index[item_id]]
+                    others = unary_union([self.items.geoms[index[other]] for other in layer_items if other != item_id])
+                    contribution = self.roi.intersection(old_item).difference(others)
+                    for i in new_items:
+                        if ids[i] in used or self._clearness(i) <= self._clearness(index[item_id]):
+                            continue
+                        if self.items.geoms[i].buffer(1).contains(contribution) and self.within_tide(i):
+                            layer_items[k] = ids[i]
+                            used.add(ids[i])
+                            changes.append({"type": "swap", "layer": j, "old": item_id, "new": ids[i]})
+                            break
+                if any(change["layer"] == j and change["type"] == "swap" for change in changes):
+                    covered = unary_union([self.items.geoms[index[item_id]] for item_id in layer_items])
+                    missing = self.roi.difference(covered)
+
+            # Add the new items that cover most of the missing region, clearest first, like select_tiles does
+            loops = 0
+            while missing.area / self.roi.area > (1 - min_coverage) and loops <= 10:
+                loops += 1
+                self.metrics.count("optimizer_iterations")
+                gains = [
+                    (missing.intersection(self.items.geoms[i].convex_hull).area * self._clearness(i), i)
+                    for i in new_items
+                    if ids[i] not in used
+                ]
+                gains = sorted((gain for gain in gains if gain[0] > 0), reverse=True)
+                best = next((i for _, i in gains if self.within_tide(i)), None)
+                if best is None:
+                    break
+
+                layer_items.append(ids[best])
+                used.add(ids[best])
+                missing = missing.difference(self.items.geoms[best])
+                covered = covered.union(self.items.geoms[best])
+                changes.append({"type": "add", "layer": j, "new": ids[best]})
+
+            layers.append(self.__layer_state(layer_items, covered))
+
+        return {"layers": layers, "candidates": ids}, changes
+
+    def _clearness(self, index):
+        # Fraction of an item expected to be clear. Measured over the ROI for scenes that were delivered before
+        item_id = self.query[index]["id"]
+        if item_id in self.scores:
+            return self.scores[item_id]
+        return 1 - self.query[index]["properties"].get("cloud_cover", 0)
+
+    def __unusable(self, index):
+        return self.scores.get(self.query[index]["id"], 1) < MIN_SCORED_CLEAR
+
+    def __layer_state(self, item_ids, covered):
+        missing = self.roi.difference(covered)
+        return {
+            "items": item_ids,
+            "covered": mapping(covered),
+            "missing": mapping(missing),
+            "missing_fraction": missing.area / self.roi.area,
+        }
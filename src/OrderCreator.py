@@ -1,100 +1,195 @@
 import csv
+import hashlib
 import json
-import math
-from io import BytesIO
-import PIL
 import time
-import pyproj
 import pathlib
 import os
 
 # Access helper classes
 from DataAPIHelpers import AvailableDataQuery
 from DataAPIHelpers import PlanetFilter
-from MosaicOptimizer import MosaicOptimizer
+from DataAPIHelpers import item_details
+from DownloadQueue import DownloadQueue
+from GeoTools import project_vectors
+from OrderPacker import OrderPacker
+from OrderTools import parse_tools
+from PipelineMetrics import PipelineMetrics
+from RoiPreprocessor import RoiPreprocessor
+from ThumbnailCache import ThumbnailCache
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
-from reportlab.lib.utils import ImageReader
-from reportlab.pdfgen.canvas import Canvas
-from shapely.geometry import shape
-from shapely.ops import transform
 
 
 class OrderCreator:
-    def __init__(self, download_queue_path, planet_session):
+    def __init__(self, download_queue_path, planet_session, thumbnail_cache=None, journal=None, tide_interpolator=None, metrics=None, roi_preprocessor=None, scene_catalog=None):
         self.planet_session = planet_session
+        # Splits multi-polygon ROI files and simplifies the geometries sent to the Data API
+        self.roi_preprocessor = roi_preprocessor or RoiPreprocessor()
+        self.metrics = metrics or PipelineMetrics(enabled=False)
+        self.tide_interpolator = tide_interpolator
+        # Optional local catalog of previous searches, so that only what it does not cover is searched
+        self.scene_catalog = scene_catalog
+        # Optional journal of completed query stages, to resume interrupted runs
+        self.journal = journal
+        self.thumbnail_cache = thumbnail_cache or ThumbnailCache(planet_session, metrics=self.metrics)
         self.queries = []
+        # Product bundle and server side tools of each query
+        self.query_tools = []
         self.optimal_tiles = []
+        self.mosaic_states = []
         self.download_queue_path = download_queue_path
-        # If a download queue already exists, load it
-        if os.path.isfile(download_queue_path):
-            with open(download_queue_path, "r", encoding="utf-8") as file:
-                self.download_queue = json.load(file)
-        else:
-            self.download_queue = {}
-
-    def query_available_data(self, file_path):
-        row_count = sum(1 for row in open(file_path)) - 1
-        with open(file_path) as file:
-            filter_csv = csv.reader(file, delimiter=",")
-            next(filter_csv, None)  # Skip header
-
-            for i, row in enumerate(filter_csv):
-                planet_filter = PlanetFilter(
-                    roi=row[0],
-                    min_date=row[1],
-                    max_date=row[2],
-                    max_cloud_cover=row[3],
-                    asset_type=row[4]
-                )
-
-                planet_filter.build_filter()
-
-                                # ROI file name   _ start date              - end date                _min tide-max tide
-                query_name = f'{Path(row[0]).stem}_{row[1].replace("-", "")}-{row[2].replace("-", "")}_{row[5]}-{row[6]}'
-                print(f"\nQuerying DATA API: {filter_csv.line_num - 1} of {row_count}")
-
-                query_result = AvailableDataQuery(
-                    planet_filter=planet_filter,
-                    min_tide=row[5],
-                    max_tide=row[6],
-                    port    =row[7],
-                    layers  =row[8],
-                    clip    =row[9],
-                    query_name=query_name,
-                    planet_session=self.planet_session
-                )
-
-                self.queries.append(query_result)
+        # Opens the existing download queue, or creates a new one
+        self.download_queue = DownloadQueue(download_queue_path)
+
+    def query_available_data(self, file_path, min_overlap=0.01, lazy_tide=False, max_workers=4, refresh=False):
+        # Each polygon of an ROI file is its own query, and queries are searched concurrently
+        queries = read_queries(file_path, self.roi_preprocessor)
+
+        def run_query(i, planet_filter, row, query_name, bundle, tools):
+            print(f"\nQuerying DATA API: {i + 1} of {len(queries)} ({query_name})")
+            return AvailableDataQuery(
+                planet_filter=planet_filter,
+                min_tide=row[5],
+                max_tide=row[6],
+                port    =row[7],
+                layers  =row[8],
+                clip    =row[9],
+                query_name=query_name,
+                planet_session=self.planet_session,
+                min_overlap=min_overlap,
+                lazy_tide=lazy_tide,
+                # Refreshed queries are searched again, instead of loading their last results
+                journal=None if refresh else self.journal,
+                tide_interpolator=self.tide_interpolator,
+                metrics=self.metrics,
+                catalog=self.scene_catalog,
+                bundle=bundle,
+                tools=tools,
+            )
 
+        with ThreadPoolExecutor(max_workers) as pool:
+            futures = []
+            for i, (planet_filter, row, query_name, (bundle, tools)) in enumerate(queries):
+                futures.append(pool.submit(run_query, i, planet_filter, row, query_name, bundle, tools))
                 # Sleep to respect rate limit of 10 requests per second
                 time.sleep(0.1)
 
-    def optimize_available_data(self, min_coverage):
+            # Queries keep the order of the CSV
+            for future, (_, _, _, delivery) in zip(futures, queries):
+                self.queries.append(future.result())
+                self.query_tools.append(delivery)
+
+    def optimize_available_data(self, min_coverage, skip_queued=True, refresh=False):
+        # Geometry libraries are only loaded by the stages that use them
+        from MosaicOptimizer import MosaicOptimizer
+
         optimal_tiles = []
-        geometries = []
+        mosaic_states = []
         query_number = len(self.queries)
-        queued_hashes = [query["hash"] for query in self.download_queue.values()]
 
         for i, query in enumerate(self.queries):
             # If this query is already in the download queue, skip to next one
             query_hash = query.hash
             n_layers = query.layers
 
-            if query_hash in queued_hashes:
+            if skip_queued and self.download_queue.has_hash(query_hash):
                 optimal_tiles.append(None)
-                print(f"Query {query.name} is already in queue. Skipping.")
+                mosaic_states.append(None)
+                if refresh and query.items:
+                    self.__refresh_query(query, min_coverage)
+                else:
+                    print(f"Query {query.name} is already in queue. Skipping.")
+                if self.journal is not None:
+                    self.journal.forget(query_hash)
                 continue
 
-            optimizer = MosaicOptimizer(query)
-            query_result = optimizer.select_tiles(n_layers, min_coverage)
+            if self.journal is not None and self.journal.has(query_hash, "optimized"):
+                print(f"Loading optimized assets of {query.name} from journal.")
+                optimal_tiles.append(self.journal.load(query_hash, "optimized"))
+                mosaic_states.append(None)
+                continue
+
+            with self.metrics.stage("optimize"):
+                optimizer = MosaicOptimizer(query, scores=self.__scores(query))
+                query_result = optimizer.select_tiles(n_layers, min_coverage)
+                mosaic_states.append(optimizer.mosaic_state(query_result))
             optimal_tiles.append(query_result)
-            geometries.append(optimizer.items)
+            if self.journal is not None:
+                self.journal.save(query_hash, "optimized", query_result)
 
             print(f"Optimizing selected assets: {i + 1} of {query_number}")
 
         self.optimal_tiles = optimal_tiles
+        self.mosaic_states = mosaic_states
+
+    def __refresh_query(self, query, min_coverage):
+        """
+        Add the new items of a queued query to its mosaics, starting from the covered and missing regions kept
+        in the queue. Queries that were not ordered yet are updated in place, and may swap items for clearer ones.
+        New items of ordered queries are queued as an update query of their own.
+        """
+        from MosaicOptimizer import MosaicOptimizer
+
+        # The query may have been queued under another name, with the same filter
+        name = self.download_queue.name_of_hash(query.hash)
+        entry = self.download_queue.get(name)
+        replaceable = not entry["ordered"]
+        with self.metrics.stage("optimize"):
+            optimizer = MosaicOptimizer(query, scores=self.__scores(query))
+            state = entry.get("mosaic_state") or optimizer.state_from_queue(entry)
+            state, changes = optimizer.update_tiles(state, min_coverage, replaceable=replaceable)
+
+        if not changes:
+            print(f"Query {name} has no new items worth adding.")
+            self.download_queue.set_field(name, "mosaic_state", state)
+            return
+
+        for change in changes:
+            if change["type"] == "swap":
+                print(f'Query {name}, layer {change["layer"] + 1}: {change["old"]} replaced by clearer {change["new"]}')
+            else:
+                print(f'Query {name}, layer {change["layer"] + 1}: {change["new"]} added')
+
+        footprints = {item["id"]: item["geometry"] for item in query.items}
+        layers = [layer["items"] for layer in state["layers"]]
+        if replaceable:
+            # Items moved into shared orders stay there
+            moved = {item_id for layer in entry.get("layers") or [] for item_id in layer} - set(entry["items"])
+            entry_footprints = entry.get("footprints", {})
+            entry_footprints.update({item_id: footprints[item_id] for layer in layers for item_id in layer if item_id in footprints})
+            self.download_queue.set_items(name, [item_id for layer in layers for item_id in layer if item_id not in moved])
+            self.download_queue.set_field(name, "layers", layers)
+            self.download_queue.set_field(name, "footprints", entry_footprints)
+        else:
+            added = [[change["new"] for change in changes if change["layer"] == j] for j in range(len(layers))]
+            update_number = sum(1 for queued_name in self.download_queue.names() if queued_name.startswith(f"{name}_update")) + 1
+            update_items = [item_id for layer in added for item_id in layer]
+            update_entry = {
+                "roi": entry["roi"],
+                "hash": hashlib.md5(json.dumps([query.hash, update_items]).encode("utf-8")).hexdigest(),
+                "items": update_items,
+                "ordered": False,
+                "downloaded": False,
+                "area": entry["area"],
+                "footprints": {item_id: footprints[item_id] for item_id in update_items},
+                "clip": entry.get("clip", True),
+                "bundle": entry.get("bundle"),
+                "tools": entry.get("tools"),
+                "layers": [layer for layer in added if layer],
+            }
+            self.download_queue.add(f"{name}_update{update_number}", update_entry)
+            print(f"{len(update_items)} new items of {name} queued as {name}_update{update_number}")
+        self.download_queue.set_field(name, "mosaic_state", state)
+
+    def __scores(self, query):
+        # udm2 scores of the items that were delivered before
+        if self.scene_catalog is None or not query.items:
+            return None
+        return self.scene_catalog.scores([item["id"] for item in query.items], query.filter.roi)
 
     def create_download_queue(self):
+        from shapely.geometry import shape
+
         for i, query in enumerate(self.queries):
             # Skip queries that were already in queue
             if query.items is None or self.optimal_tiles[i] is None:
@@ -103,7 +198,7 @@ class OrderCreator:
             query_name = query.name
             query_hash = query.hash
             query_roi = query.filter.roi
-            query_area = self.__project_vectors(shape(query_roi).buffer(0))
+            query_area = project_vectors(shape(query_roi).buffer(0))
             query_area = query_area.area
             query_queue = {
                 "roi": query_roi,
@@ -112,124 +207,157 @@ class OrderCreator:
                 "ordered": False,
                 "downloaded": False,
                 "area": query_area,
+                # Item footprints, used to estimate clipped areas without querying the API again
+                "footprints": {},
+                # Unclipped queries receive whole scenes, and small ones skip the Orders API
+                "clip": self.__parse_clip(query.clip),
+                "bundle": self.query_tools[i][0],
+                "tools": self.query_tools[i][1],
+                # Items of each mosaic layer, used to composite layers on Planet's side
+                "layers": [],
+                # Covered and missing regions of each layer, to add new items later without starting over
+                "mosaic_state": self.mosaic_states[i],
             }
 
             for j, layer in enumerate(self.optimal_tiles[i]):
+                query_queue["layers"].append([])
                 for k, item_index in enumerate(layer[0]):
                     current_item = query.items[item_index]
                     query_queue["items"].append(current_item["id"])
+                    query_queue["layers"][j].append(current_item["id"])
+                    query_queue["footprints"][current_item["id"]] = current_item["geometry"]
+
+            self.download_queue.add(query_name, query_queue)
+            # Queued queries are not resumed, and their journaled searches would be stale in later runs
+            if self.journal is not None:
+                self.journal.forget(query_hash)
 
-            self.download_queue[query_name] = query_queue
+            if query_queue["items"]:
+                delivery = sum(order["bytes"] for order in OrderPacker().pack([(query_name, query_queue)]))
+                print(f'Query {query_name}: {len(query_queue["items"])} items, about {delivery / 1e9:.1f} GB to download')
 
-        with open(self.download_queue_path, "w", encoding="utf-8") as file:
-            json.dump(self.download_queue, file, indent=4)
+    @staticmethod
+    def __parse_clip(value):
+        return str(value).strip().lower() not in ("no", "n", "false", "0", "")
 
-    def generate_report(self, grid_cell_number, destination_folder):
+    def generate_report(self, grid_cell_number, destination_folder, max_workers=None):
+        reports = []
         for i, query in enumerate(self.queries):
             # Skip queries that were already in queue
             if query is None or self.optimal_tiles[i] is None:
                 continue
 
             report_name = f"{query.name}.pdf"
-            PAGE_SIZE = 1200
-            grid_size = math.floor((PAGE_SIZE - 200) / grid_cell_number)
             report_path = pathlib.Path(os.path.join(destination_folder, report_name))
-            canvas = Canvas(str(report_path), pagesize=(PAGE_SIZE, PAGE_SIZE))
-            canvas.translate(0, PAGE_SIZE)
-            # count how many thumbnails were drawn to decide when to change pages
-            drawn_thumbnails = 0
-            cells_per_page = grid_cell_number * grid_cell_number
-            page = 0
-            image_size = grid_size - 50
-            col = 0
-            row = 0
-
-            # Store which items must be included in the report for this query
-            query_items = []
-            # And the total bandwith used / wasted by the query
-            query_stats = {"query_area": 0, "wasted_area": 0}
-
-            for layer in self.optimal_tiles[i]:
-                query_items.extend(layer[0])
-                mosaic_stats = layer[1]
-                query_stats["query_area"] = (
-                    query_stats["query_area"] + mosaic_stats["mosaic_area"]
-                )
-                query_stats["wasted_area"] = (
-                    query_stats["wasted_area"] + mosaic_stats["wasted_area"]
-                )
-
-            # Start by adding the stats of that query to the page
-            canvas.drawString(
-                500, -100, f'used bandwidth:{round(query_stats["query_area"])} km2'
+            layers = [
+                ([query.items[item_index] for item_index in layer[0]], layer[1])
+                for layer in self.optimal_tiles[i]
+            ]
+            # Fetch every thumbnail of this query (concurrently, or from the cache) before laying out the pages
+            thumbnails = self.thumbnail_cache.fetch(
+                [item for layer_items, _ in layers for item in layer_items]
             )
-            canvas.drawString(
-                500, -120, f'wasted bandwidth:{round(query_stats["wasted_area"])} km2'
+            reports.append(
+                (str(report_path), grid_cell_number, layers, thumbnails, query.filter.roi)
             )
 
-            for j, item_index in enumerate(query_items):
-                item = self.queries[i].items[item_index]
-                # Get coordinates in the page for corresponding cell
-                x = col * grid_size
-                y = row * grid_size + 200  # Leave top of page empty for mosaic stats
-
-                # Recommendations from requests author on reading image from a request
-                # https://2.python-requests.org/en/latest/user/quickstart/#binary-response-content
-                thumbnail = self.planet_session.get(
-                    item["_links"]["thumbnail"], stream=True
-                )
-                thumbnail = PIL.Image.open(BytesIO(thumbnail.content))
-                time.sleep(0.1)
+        self.__render_reports(reports, max_workers)
+
+    def generate_queue_report(self, grid_cell_number, destination_folder, names=None, max_workers=None):
+        """
+        Reports of queries as they are in the download queue (all of them unless names are given), without
+        searching or optimizing them again. Items are looked up by id, and mosaic areas measured from the
+        footprints stored in the queue.
+        """
+        from shapely.geometry import shape
+        from shapely.ops import unary_union
+
+        reports = []
+        for name in self.download_queue.names() if names is None else names:
+            try:
+                entry = self.download_queue.get(name)
+            except KeyError:
+                print(f"Query {name} is not in the download queue. Skipping")
+                continue
+            # Shared orders are reported in their member queries, whose layers keep the shared items
+            if "members" in entry:
+                continue
 
-                acquired = str(item["properties"]["acquired"])
-                cloud_cover = str(item["properties"]["cloud_cover"])
-                stage = str(item["properties"]["publishing_stage"])
-                item_id = str(item["id"])
-                tide = (
-                    str(item["properties"]["tidal_height"])
-                    if "tidal_height" in item["properties"]
-                    else "NA"
+            roi = project_vectors(shape(entry["roi"]).buffer(0))
+            footprints = entry.get("footprints") or {}
+            layers = []
+            for layer in entry.get("layers") or [entry["items"]]:
+                covered = unary_union([project_vectors(shape(footprints[item_id]).buffer(0)) for item_id in layer if item_id in footprints])
+                layer_items = [self.__queued_item(item_id, footprints.get(item_id)) for item_id in layer]
+                layers.append(
+                    (layer_items, {"mosaic_area": covered.area / 1000000, "wasted_area": covered.difference(roi).area / 1000000})
                 )
 
-                canvas.drawImage(
-                    ImageReader(thumbnail),
-                    x,
-                    -y - image_size,
-                    width=image_size,
-                    height=image_size,
-                )
-                canvas.drawString(x, -y - image_size - 15, f"{item_id} : {acquired}")
-                canvas.drawString(
-                    x, -y - image_size - 30, f"cloud cover:{cloud_cover}  tide:{tide}"
+            # Items that could not be looked up have no thumbnail link, and are left blank
+            thumbnails = self.thumbnail_cache.fetch(
+                [item for layer_items, _ in layers for item in layer_items if "_links" in item]
+            )
+            report_path = pathlib.Path(os.path.join(destination_folder, f"{name}.pdf"))
+            reports.append((str(report_path), grid_cell_number, layers, thumbnails, entry["roi"]))
+
+        self.__render_reports(reports, max_workers)
+
+    def __queued_item(self, item_id, footprint):
+        item = item_details(self.planet_session, item_id, metrics=self.metrics)
+        # Sleep to respect rate limit of 10 requests per second
+        time.sleep(0.1)
+        if item is None:
+            item = {"id": item_id, "properties": {"acquired": "NA", "cloud_cover": "NA", "publishing_stage": "NA"}}
+        # The footprint the query was optimized with
+        if footprint is not None:
+            item["geometry"] = footprint
+        item.setdefault("geometry", None)
+        return item
+
+    def __render_reports(self, reports, max_workers):
+        from ReportRenderer import render_report
+
+        # Rendering is CPU bound, so each query is rendered in its own process
+        with self.metrics.stage("report"):
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                futures = [executor.submit(render_report, *report) for report in reports]
+                for future in futures:
+                    print(f"Report saved to {future.result()}")
+
+
+def read_queries(file_path, roi_preprocessor):
+    """
+    Read a queries CSV. Returns a list of (PlanetFilter, CSV row, query name, (bundle, tools)), one for each
+    polygon of the ROI files.
+    """
+    queries = []
+    with open(file_path) as file:
+        filter_csv = csv.reader(file, delimiter=",")
+        header = [column.strip().lower() for column in next(filter_csv, [])]
+
+        for i, row in enumerate(filter_csv):
+            # Columns after clip are optional, and matched by name
+            try:
+                bundle, tools = parse_tools(dict(zip(header[10:], row[10:])))
+            except ValueError as error:
+                raise ValueError(f"Invalid tools in line {filter_csv.line_num} of {file_path}: {error}")
+
+            for roi in roi_preprocessor.load(row[0]):
+                planet_filter = PlanetFilter(
+                    roi=roi["roi"],
+                    min_date=row[1],
+                    max_date=row[2],
+                    max_cloud_cover=row[3],
+                    asset_type=row[4],
+                    search_roi=roi["search_roi"]
                 )
-                canvas.drawString(x, -y - image_size - 45, stage)
-
-                drawn_thumbnails += 1
-
-                # If page is full, start new page and skip increments to col and row indices
-                if drawn_thumbnails == cells_per_page:
-                    canvas.showPage()
-                    canvas.translate(0, PAGE_SIZE)
-                    drawn_thumbnails = 0
-                    page += 1
-                    row = 0
-                    col = 0
-                    continue
 
-                # Update row and column indices
-                col += 1
-                if col >= grid_cell_number:
-                    col = 0
-                    row = row + 1
+                planet_filter.build_filter()
 
-            print(f"Report saved to {report_path}")
-            canvas.save()
+                # Polygons of multi-polygon files are told apart by their feature name
+                roi_name = Path(row[0]).stem if roi["name"] is None else f'{Path(row[0]).stem}-{roi["name"]}'
+                                # ROI name     _ start date              - end date                _min tide-max tide
+                query_name = f'{roi_name}_{row[1].replace("-", "")}-{row[2].replace("-", "")}_{row[5]}-{row[6]}'
+                queries.append((planet_filter, row, query_name, (bundle, tools)))
 
-    @staticmethod
-    def __project_vectors(vector):
-        wgs84 = pyproj.CRS("EPSG:4326")
-        pttm06 = pyproj.CRS("EPSG:3763")
-        transformation = pyproj.Transformer.from_crs(
-            wgs84, pttm06, always_xy=True
-        ).transform
-        return transform(transformation, vector)
+    return queries
@@ -1,9 +1,21 @@
 import json
 import os
 import pathlib
+import shutil
 import time
+from contextlib import ExitStack
 import requests
 
+from ApiEndpoints import ORDERS_URL, SUBSCRIPTIONS_URL
+from DownloadQueue import DownloadQueue
+from OrderPacker import OrderPacker
+from OrderTools import DEFAULT_BUNDLE, delivery_mode
+from PipelineMetrics import PipelineMetrics
+from QueueLease import QueueLease
+
+# Largest unclipped query downloaded through the Data API instead of an order
+DIRECT_MAX_ITEMS = 20
+
 
 class OrderExecutor:
     """
@@ -12,25 +24,80 @@ class OrderExecutor:
     https://github.com/planetlabs/notebooks/blob/master/jupyter-notebooks/orders/ordering_and_delivery.ipynb
     """
 
-    def __init__(self, download_queue, planet_session):
-        with open(download_queue, "r", encoding="utf-8") as file:
-            self.queue = json.load(file)
+    def __init__(self, download_queue, planet_session, worker=None, lease_duration=300, shared_storage=False, asset_store=None, packer=None, metrics=None, direct_max_items=DIRECT_MAX_ITEMS, converter=None, bucket=None):
+        self.queue = DownloadQueue(download_queue, shared_storage=shared_storage)
         self.queue_path = download_queue
         self.session = planet_session
+        # Identifies this process when several workers share the same queue
+        self.worker = worker or QueueLease.default_worker()
+        self.lease_duration = lease_duration
+        # Optional content-addressed store. Query folders then only hold links to stored files
+        self.asset_store = asset_store
+        self.packer = packer or OrderPacker()
+        self.metrics = metrics or PipelineMetrics(enabled=False)
+        # Unclipped queries with at most this many items are downloaded through the Data API, without an order
+        self.direct_max_items = direct_max_items
+        # Optional post-download conversion (e.g. CogConverter), started as soon as each query is downloaded
+        self.converter = converter
+        # Optional S3-compatible bucket (BucketDelivery) orders are delivered to, instead of download links
+        self.bucket = bucket
         self.orders, self.orders_area = self._read_orders()
         self.monthly_quotas = self._available_quota()
 
     def place_orders(self):
-        ORDERS_URL = "https://api.planet.com/compute/ops/orders/v2"
-        headers = {"content-type": "application/json"}
+        # Only orders that fit in the remaining quota are placed, instead of finding out about them one at a time
+        scheduled, deferred = self.packer.schedule(self.orders, self.monthly_quotas)
+        for order in deferred:
+            print(f'Order {order["request"]["name"]} ({round(order["cost"])} km2) does not fit in the remaining quota. Deferred')
+        if scheduled:
+            delivery = sum(order["bytes"] for order in scheduled) / 1e9
+            print(f"Placing {len(scheduled)} orders, about {delivery:.1f} GB to download")
 
-        for order in self.orders:
+        for order in scheduled:
             # Check if order was already placed
-            order_queue = self.queue[order["name"]]
-            if order_queue["ordered"]:
-                print(f'Order {order["name"]} was already submitted. Skipping')
+            query_name = order["queries"][0]
+            order_queue = self.queue.get(query_name)
+            if order_queue["ordered"] or self._part_state(order_queue, order["part"]) == "success":
+                print(f'Order {order["request"]["name"]} was already submitted. Skipping')
                 continue
 
+            # Lease every query of the order, so that other workers sharing this queue do not place it too
+            with ExitStack() as stack:
+                leases = [
+                    stack.enter_context(QueueLease(self.queue, name, "queued", self.worker, self.lease_duration))
+                    for name in order["queries"]
+                ]
+                if not all(lease.acquired for lease in leases):
+                    print(f'Order {order["request"]["name"]} is being placed by another worker. Skipping')
+                    continue
+
+                with self.metrics.stage("order"):
+                    placed = self._place_order(order, self.queue.get(query_name), leases)
+                if not placed:
+                    print("Your monthly quota was exhausted. Stopping order placement.")
+                    break
+
+    def _place_order(self, order, order_queue, leases=()):
+        """
+        Place a single order and wait until it is finalized. Returns False if the order failed for lack of quota.
+        Nothing is placed or recorded once a lease is lost, the worker that took it over finishes the order.
+        """
+        headers = {"content-type": "application/json"}
+        order_name = order["request"]["name"]
+
+        # A worker that died after placing this order already stored its id. Resume waiting for it instead
+        if order["part"] is not None:
+            previous_id = order_queue.get("parts", {}).get(order["part"], {}).get("id")
+        else:
+            previous_id = order_queue.get("id")
+
+        if previous_id is not None:
+            order_id = previous_id
+            print(f"Order {order_name} was placed by a previous worker. Waiting until order is finalized.")
+        elif any(lease.lost for lease in leases):
+            print(f"Order {order_name} was taken over by another worker. Skipping")
+            return True
+        else:
             # Place new orders. Retries placement with exponential back off
             tries = 0
             sleep = 1
@@ -38,7 +105,7 @@ class OrderExecutor:
                 tries += 1
                 try:
                     response = self.session.post(
-                        ORDERS_URL, data=json.dumps(order), headers=headers
+                        ORDERS_URL, data=json.dumps(order["request"]), headers=headers
                     )
                     break
                 except Exception:
@@ -46,77 +113,407 @@ class OrderExecutor:
                         f"Error in placing order. Retrying in {sleep ** 2 * 10} seconds",
                         end="\r",
                     )
+                    self.metrics.count("retries", endpoint="orders")
                     time.sleep(sleep**2 * 10)
                     sleep += 1
                     continue
 
-            # If order placement was valid, wait for server to say if it's successful
-            # e.g. you could place a valid order, but be over your monthly quota, which will be a failed query
-            if response.ok:
-                order_id = response.json()["id"]
-                order_name = response.json()["name"]
-                order_url = ORDERS_URL + "/" + order_id
-                print(
-                    f'Order for query {order["name"]} has been placed. Waiting until order is finalized.'
-                )
-                final_response = self._wait_for_final_state(order_url)
-
-                if final_response["state"] == "success":
-                    print(f'Order {final_response["name"]} was a success.')
-                    # Update download queue when order is placed
-                    self.queue[order_name]["ordered"] = True
-                    self.queue[order_name]["id"] = order_id
-                    with open(self.queue_path, "w", encoding="utf-8") as file:
-                        json.dump(self.queue, file, indent=4)
-
-                elif final_response["state"] == "failed":
-                    # If order failed due to lack of quota, stop placing more orders
-                    if (final_response["last_message"] == "Quota check failed - Over quota "):
-                        print("Your monthly quota was exhausted. Stopping order placement.")
-                        break
-                    else:
-                        print(f'Order {final_response["name"]} failed due to:\n{final_response["last_message"]}')
             # If order placement failed, print error and try next order
-            else:
-                print(f'Order {order["name"]} returned an unexpected result:')
+            if not response.ok:
+                print(f"Order {order_name} returned an unexpected result:")
                 try:
                     print(str(response.status_code) + ": " + str(response.json()))
                 except Exception:
                     print("Could not retrieve error message")
 
-                continue
+                return True
+
+            order_id = response.json()["id"]
+            # Quota of this order is used from now on, by later orders and direct downloads of this run
+            self.monthly_quotas -= order["cost"]
+            if "delivery" in order["request"]:
+                for query_name in order["queries"]:
+                    self.queue.set_field(query_name, "delivery", self.bucket.location())
+            self._record_order(order, order_id, "placed")
+            print(
+                f"Order {order_name} has been placed. Waiting until order is finalized."
+            )
+
+        # If order placement was valid, wait for server to say if it's successful
+        # e.g. you could place a valid order, but be over your monthly quota, which will be a failed query
+        order_url = ORDERS_URL + "/" + order_id
+        final_response = self._wait_for_final_state(order_url)
+        if any(lease.lost for lease in leases):
+            print(f"Order {order_name} was taken over by another worker. Not recording its state")
+            return True
+
+        if final_response["state"] in ("success", "partial"):
+            if final_response["state"] == "partial":
+                # Some items could not be delivered. The rest is downloaded, like a successful order
+                print(f'\033[33m Order {final_response["name"]} was partially successful: {final_response.get("last_message")} \033[0m')
+            else:
+                print(f'Order {final_response["name"]} was a success.')
+            # Update download queue when order is placed
+            self._record_order(order, order_id, "success")
+            # Queries whose items were all moved into shared orders have no order of their own
+            for member in order_queue.get("members", []):
+                if not self.queue.get(member)["items"]:
+                    self.queue.mark_ordered(member, None)
+
+        elif final_response["state"] == "failed":
+            # Forget the failed order, so that it is placed again in the next run. Failed orders use no quota
+            self._record_order(order, None, "failed")
+            if previous_id is None:
+                self.monthly_quotas += order["cost"]
+            # If order failed due to lack of quota, stop placing more orders
+            if (final_response["last_message"] == "Quota check failed - Over quota "):
+                return False
+            else:
+                print(f'Order {final_response["name"]} failed due to:\n{final_response["last_message"]}')
+
+        return True
+
+    def _record_order(self, order, order_id, state):
+        # Orders split in parts keep the id of each part. The query is ordered once every part succeeded
+        if order["part"] is not None:
+            query_name = order["queries"][0]
+            parts = self.queue.get(query_name).get("parts", {})
+            if state == "failed":
+                parts.pop(order["part"], None)
+            else:
+                parts[order["part"]] = {"id": order_id, "state": state}
+            self.queue.set_field(query_name, "parts", parts)
+
+            n_parts = len(self.packer.split(query_name, self.queue.get(query_name)))
+            succeeded = [part for part in parts.values() if part["state"] == "success"]
+            if len(succeeded) == n_parts:
+                self.queue.mark_ordered(query_name, succeeded[0]["id"])
+            return
+
+        # Queries grouped in a single order share its id
+        for query_name in order["queries"]:
+            if state == "success":
+                self.queue.mark_ordered(query_name, order_id)
+                if len(order["queries"]) > 1:
+                    self.queue.set_field(query_name, "order_group", order["queries"])
+            else:
+                self.queue.set_order_id(query_name, order_id)
+
+    @staticmethod
+    def _part_state(order_queue, part):
+        if part is None:
+            return None
+        return order_queue.get("parts", {}).get(part, {}).get("state")
+
+    def delivery_mode(self, entry):
+        # With a bucket, everything is ordered, so that every file ends up in the bucket
+        if self.bucket is not None:
+            return "orders"
+        return delivery_mode(entry, self.direct_max_items)
 
     def download_orders(self, download_path, overwrite=False):
-        ORDERS_URL = "https://api.planet.com/compute/ops/orders/v2"
-
-        for order_name in self.queue:
-            order = self.queue[order_name]
-            if order["ordered"] and not order["downloaded"]:
-                print(f"\033[1;33m Downloading order {order_name} \033[0m")
-                order_url = ORDERS_URL + "/" + order["id"]
-                response = self._wait_for_delivery(order_url)
-                results = response["_links"]["results"]
-                results_urls = [r["location"] for r in results]
-                # Retrieve the path to store each item in
-                results_names = [r["name"] for r in results]
-                # Replace the query ID in the file path with our user-based query name
-                results_names = [f'{order_name}/{pathlib.Path(*pathlib.Path(result).parts[1:])}' for result in results_names]
-
-                for url, name in zip(results_urls, results_names):
-                    file_path = pathlib.Path(os.path.join(download_path, name))
-
-                    if overwrite or not file_path.exists():
-                        print(f"Downloading {name}")
-                        r = requests.get(url, allow_redirects=True)
-                        file_path.parent.mkdir(parents=True, exist_ok=True)
-                        open(file_path, "wb").write(r.content)
-                    else:
-                        print(f"{name} already exists. Download skipped")
-
-                # Update download queue when order is downloaded
-                order["downloaded"] = True
-                with open(self.queue_path, "w", encoding="utf-8") as file:
-                    json.dump(self.queue, file, indent=4)
+        # Queued queries with direct delivery are downloaded without an order
+        for query_name in self.queue.names(status="queued"):
+            if self.delivery_mode(self.queue.get(query_name)) != "data-api":
+                continue
+            if download_path is None:
+                print(f"Query {query_name} is downloaded through the Data API. Pass a storage folder to download it")
+                continue
+            with QueueLease(self.queue, query_name, "queued", self.worker, self.lease_duration) as lease:
+                if not lease.acquired:
+                    print(f"Query {query_name} is being downloaded by another worker. Skipping")
+                    continue
+
+                with self.metrics.stage("download"):
+                    self._download_direct(query_name, self.queue.get(query_name), download_path, overwrite, lease)
+
+        for order_name in self.queue.names(status="ordered"):
+            # Lease the order, so that other workers sharing this queue do not download it too
+            with QueueLease(self.queue, order_name, "ordered", self.worker, self.lease_duration) as lease:
+                if not lease.acquired:
+                    print(f"Order {order_name} is being downloaded by another worker. Skipping")
+                    continue
+
+                self._download_order(order_name, download_path, overwrite, lease)
+
+    def _download_direct(self, query_name, entry, download_path, overwrite, lease=None):
+        # Activating assets uses quota like an order does
+        cost = self.packer.estimate_cost(entry)
+        if cost > self.monthly_quotas:
+            print(f"Query {query_name} ({round(cost)} km2) does not fit in the remaining quota. Deferred")
+            return
+
+        from DataApiDownloader import DataApiDownloader
+
+        print(f"\033[1;33m Downloading {query_name} through the Data API \033[0m")
+        downloader = DataApiDownloader(self.session, metrics=self.metrics)
+        destination = pathlib.Path(download_path) / query_name / "PSScene"
+        files = downloader.download(entry["items"], destination, overwrite)
+        self.monthly_quotas -= cost
+        # Assets the item does not have can never be activated. They are recorded instead of retried every run
+        unavailable = sorted({tuple(asset) for asset in entry.get("unavailable") or []} | downloader.unavailable)
+        if unavailable:
+            self.queue.set_field(query_name, "unavailable", unavailable)
+
+        if self.asset_store is not None:
+            clip_hash = self._clip_hash(entry)
+            for (item_id, asset_type), file_path in files.items():
+                if file_path.is_symlink() or file_path.stat().st_nlink > 1:
+                    continue
+                blob = self.asset_store.add(file_path, item_id, asset_type, clip_hash)
+                self.asset_store.link(blob, file_path)
+
+        if len(files) + len(unavailable) < len(entry["items"]) * len(downloader.asset_types):
+            print(f"Some assets of {query_name} were not downloaded. Trying again in the next run")
+            return
+        if lease is not None and lease.lost:
+            print(f"Query {query_name} was taken over by another worker. Not marking it downloaded")
+            return
+
+        self.queue.mark_ordered(query_name, None)
+        self._mark_downloaded(query_name, download_path)
+
+    def _download_order(self, order_name, download_path, overwrite, lease=None):
+        order = self.queue.get(order_name)
+        # Queries without an order of their own receive their files from shared orders
+        if "id" not in order:
+            print(f"Order {order_name} is waiting for its shared orders to be downloaded.")
+            return
+
+        if order.get("delivery") is not None:
+            if self.bucket is None or self.bucket.location() != order["delivery"]:
+                print(f'Order {order_name} was delivered to {order["delivery"]["url"]}. Pass that bucket to download it')
+                return
+        elif download_path is None:
+            print(f"Order {order_name} was delivered through download links. Pass a storage folder to download it")
+            return
+
+        print(f"\033[1;33m Downloading order {order_name} \033[0m")
+        # Queries split in several orders are downloaded part by part into the same folder
+        if "parts" in order:
+            order_ids = [part["id"] for part in order["parts"].values()]
+        else:
+            order_ids = [order["id"]]
+
+        complete = True
+        for order_id in order_ids:
+            with self.metrics.stage("download"):
+                if not self._download_results(order_name, order, order_id, download_path, overwrite):
+                    complete = False
+
+        # Update download queue when order is downloaded, unless files failed or it still waits for its delivery or shared orders
+        if lease is not None and lease.lost:
+            print(f"Order {order_name} was taken over by another worker. Not marking it downloaded")
+        elif complete and not self._pending_shared_orders(order_name):
+            self._mark_downloaded(order_name, download_path)
+
+    def _mark_downloaded(self, name, download_path):
+        self.queue.mark_downloaded(name)
+        # Files of shared orders are converted in the folders of their member queries
+        if self.converter is not None and download_path is not None and "members" not in self.queue.get(name):
+            self.converter.submit(name, pathlib.Path(download_path) / name)
+
+    def _download_results(self, order_name, order, order_id, download_path, overwrite):
+        """
+        Download the files of an order. Returns False if some of them could not be downloaded or stored.
+        """
+        if order.get("delivery") is not None:
+            return self._download_bucket(order_name, order, order_id, download_path, overwrite)
+
+        order_url = ORDERS_URL + "/" + order_id
+        response = self._wait_for_delivery(order_url)
+        results = response["_links"]["results"]
+        # Orders shared by several queries with the same ROI also deliver the items of the other queries
+        if "order_group" in order:
+            results = [
+                r for r in results
+                if pathlib.Path(r["name"]).name == "manifest.json"
+                or any(pathlib.Path(r["name"]).name.startswith(item_id) for item_id in order["items"])
+            ]
+        results_urls = [r["location"] for r in results]
+        # Retrieve the path to store each item in
+        results_names = [r["name"] for r in results]
+        # Replace the query ID in the file path with our user-based query name
+        results_names = [f'{order_name}/{pathlib.Path(*pathlib.Path(result).parts[1:])}' for result in results_names]
+
+        if self.asset_store is not None:
+            manifest = self._read_manifest(results)
+            bundle = response["products"][0]["product_bundle"]
+            clip_hash = self._clip_hash(order)
+
+        complete = True
+        for url, name in zip(results_urls, results_names):
+            file_path = pathlib.Path(os.path.join(download_path, name))
+
+            if self.asset_store is not None:
+                relative_path = str(pathlib.Path(*pathlib.Path(name).parts[1:]))
+                if not self._store_file(url, name, file_path, manifest.get(relative_path), bundle, clip_hash):
+                    complete = False
+            elif overwrite or not file_path.exists():
+                print(f"Downloading {name}")
+                r = requests.get(url, allow_redirects=True, hooks=self.metrics.hooks)
+                self.metrics.count("bytes_downloaded", len(r.content))
+                self.metrics.count("files_downloaded")
+                file_path.parent.mkdir(parents=True, exist_ok=True)
+                # Write to a temporary file first, so that a worker taking over this order
+                # never mistakes a partial download from a dead worker for a finished file
+                partial_path = file_path.with_name(file_path.name + ".part")
+                open(partial_path, "wb").write(r.content)
+                os.replace(partial_path, file_path)
+            else:
+                print(f"{name} already exists. Download skipped")
+
+        # Files that failed are downloaded again in the next run, before the order counts as downloaded
+        if not complete:
+            print(f"Some files of {order_name} were not stored. Trying again in the next run")
+            return False
+
+        # Files of shared orders are hardlinked into the folder of every query that uses them
+        if "members" in order:
+            self._fan_out(order_name, order["members"], results_names, download_path)
+        return True
+
+    def _download_bucket(self, order_name, order, order_id, download_path, overwrite):
+        """
+        Download the files of an order delivered to the bucket, once its manifest lists them all. Without a
+        storage folder the files stay in the bucket. Returns False while the delivery is incomplete.
+        """
+        files = self.bucket.delivered_files(order_id)
+        if files is None:
+            print(f"Order {order_name} is not completely delivered to {self.bucket.url} yet. Trying again in the next run")
+            return False
+        # Orders shared by several queries with the same ROI also deliver the items of the other queries
+        if "order_group" in order:
+            files = [
+                file for file in files
+                if file["path"] == "manifest.json"
+                or any(pathlib.Path(file["path"]).name.startswith(item_id) for item_id in order["items"])
+            ]
+        results_names = [f'{order_name}/{file["path"]}' for file in files]
+
+        if download_path is None:
+            print(f"{len(files)} files of {order_name} are in {self.bucket.url}/{order_id}")
+        else:
+            destination = pathlib.Path(download_path) / order_name
+            if self.asset_store is not None:
+                bundle = order.get("bundle") or DEFAULT_BUNDLE
+                clip_hash = self._clip_hash(order)
+                # Files already in the store are linked instead of downloaded
+                stored = []
+                for file in files:
+                    blob = None if file["digest"] is None else self.asset_store.find(file["item_id"], bundle, clip_hash, file["digest"])
+                    if blob is not None:
+                        print(f'{file["path"]} is already stored. Linking')
+                        self.metrics.count("files_deduplicated")
+                        self.asset_store.link(blob, destination / file["path"])
+                        stored.append(file["path"])
+                files = [file for file in files if file["path"] not in stored]
+
+            local_files = self.bucket.download(files, destination, overwrite)
+            if len(local_files) < len(files):
+                print(f"Some files of {order_name} were not downloaded. Trying again in the next run")
+                return False
+
+            if self.asset_store is not None:
+                for file in files:
+                    file_path = local_files[file["path"]]
+                    if file_path.is_symlink() or file_path.stat().st_nlink > 1:
+                        continue
+                    blob = self.asset_store.add(file_path, file["item_id"], bundle, clip_hash)
+                    self.asset_store.link(blob, file_path)
+
+        # Files of shared orders are hardlinked into the folder of every query that uses them
+        if "members" in order:
+            self._fan_out(order_name, order["members"], results_names, download_path)
+        return True
+
+    def _clip_hash(self, entry):
+        # Stored files are keyed by the clip AOI of the queue entry, the one its orders were placed with, so that
+        # the same delivery gets the same key whatever the route it was downloaded through
+        return self.asset_store.clip_hash(entry["roi"] if entry.get("clip", True) else None)
+
+    def _store_file(self, url, name, file_path, manifest_file, bundle, clip_hash):
+        # Files listed in the delivery manifest are looked up by digest before downloading.
+        # Returns False if the downloaded file does not match the manifest
+        if manifest_file is not None:
+            item_id = manifest_file.get("annotations", {}).get("planet/item_id", "")
+            digest = manifest_file["digests"]["sha256"]
+            blob = self.asset_store.find(item_id, bundle, clip_hash, digest)
+            if blob is not None:
+                print(f"{name} is already stored. Linking")
+                self.metrics.count("files_deduplicated")
+                self.asset_store.link(blob, file_path)
+                return True
+        else:
+            item_id = ""
+            digest = None
+
+        print(f"Downloading {name}")
+        partial_path = self.asset_store.path / "partial" / f"{os.getpid()}_{file_path.name}"
+        partial_path.parent.mkdir(parents=True, exist_ok=True)
+        with requests.get(url, allow_redirects=True, stream=True, hooks=self.metrics.hooks) as r:
+            with open(partial_path, "wb") as file:
+                for chunk in r.iter_content(chunk_size=1024 * 1024):
+                    file.write(chunk)
+                    self.metrics.count("bytes_downloaded", len(chunk))
+        self.metrics.count("files_downloaded")
+
+        stored_digest = self.asset_store.file_digest(partial_path)
+        if digest is not None and stored_digest != digest:
+            print(f"\033[31m Digest of {name} does not match the manifest. Not stored \033[0m")
+            partial_path.unlink()
+            return False
+
+        blob = self.asset_store.add(partial_path, item_id, bundle, clip_hash, stored_digest)
+        self.asset_store.link(blob, file_path)
+        return True
+
+    @staticmethod
+    def _read_manifest(results):
+        # The delivery manifest lists the digest and item id of every delivered file
+        for result in results:
+            if pathlib.Path(result["name"]).name == "manifest.json":
+                manifest = requests.get(result["location"], allow_redirects=True).json()
+                return {file["path"]: file for file in manifest.get("files", [])}
+        return {}
+
+    def _fan_out(self, order_name, members, results_names, download_path):
+        # Shared orders left in the bucket have no files to link
+        if download_path is not None:
+            linked_bytes = 0
+            for name in results_names:
+                source = pathlib.Path(os.path.join(download_path, name))
+                relative_path = pathlib.Path(*pathlib.Path(name).parts[1:])
+                for member in members:
+                    destination = pathlib.Path(os.path.join(download_path, member, relative_path))
+                    if not destination.exists():
+                        self._link_file(source, destination)
+                        linked_bytes += source.stat().st_size
+
+            print(f"Shared order {order_name} linked into {len(members)} queries, saving {linked_bytes / 1e6:.1f} MB of downloads")
+
+        # Queries with no items of their own are complete once their shared orders are downloaded
+        for member in members:
+            member_order = self.queue.get(member)
+            if member_order["ordered"] and not member_order["items"]:
+                if not self._pending_shared_orders(member, downloaded=order_name):
+                    self._mark_downloaded(member, download_path)
+
+    def _pending_shared_orders(self, name, downloaded=None):
+        pending = []
+        for shared_name, shared_order in self.queue.items():
+            if name in shared_order.get("members", []) and shared_name != downloaded and not shared_order["downloaded"]:
+                pending.append(shared_name)
+        return pending
+
+    @staticmethod
+    def _link_file(source, destination):
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            os.link(source, destination)
+        except OSError:
+            # Hardlinks can not cross file systems, fall back to a copy
+            shutil.copy2(source, destination)
 
     def check_order_status(self):
         colors = {
@@ -126,12 +523,10 @@ class OrderExecutor:
             "end color": "\033[0m",
         }
 
-        for order_name in self.queue:
-            order = self.queue[order_name]
-
-            if order["downloaded"]:
+        for order_name, status in self.queue.statuses():
+            if status == "downloaded":
                 print(colors["downloaded"] + order_name + colors["end color"])
-            elif order["ordered"]:
+            elif status == "ordered":
                 print(colors["submitted"] + order_name + colors["end color"])
             else:
                 print(colors["to be processed"] + order_name + colors["end color"])
@@ -148,6 +543,7 @@ class OrderExecutor:
                 print(
                     f"Error in checking delivery status. Retrying in {sleep ** 2 * 10} seconds"
                 )
+                self.metrics.count("retries", endpoint="orders")
                 time.sleep(sleep**2 * 10)
                 sleep += 1
                 continue
@@ -174,6 +570,7 @@ class OrderExecutor:
                     f"Error in checking order status. Retrying in {sleep ** 2 * 10} seconds",
                     end="\r",
                 )
+                self.metrics.count("retries", endpoint="orders")
                 time.sleep(sleep**2 * 10)
                 sleep += 1
                 continue
@@ -187,40 +584,21 @@ class OrderExecutor:
             time.sleep(60)
 
     def _read_orders(self):
-        orders = []
-        areas = []
-
-        for query_id in self.queue:
-            query = self.queue[query_id]
-            query_items = query["items"]
-            query_roi = query["roi"]
-            query_area = query["area"]
-            # We want the optimally selected items, 4band and surface reflectance
-            query_products = [
-                {
-                    "item_ids": query_items,
-                    "item_type": "PSScene",
-                    "product_bundle": "analytic_8b_sr_udm2",
-                }
-            ]
-            # Clip to given ROI and create a composite from all images
-            clip = {"clip": {"aoi": query_roi}}
-
-            # Build final request
-            order_request = {
-                "name": query_id,
-                "products": query_products,
-                "tools": [clip],
-            }
-
-            areas.append(query_area)
-            orders.append(order_request)
+        # Split, group and estimate the quota used by the orders of queries that were not ordered yet
+        entries = ((name, self.queue.get(name)) for name in self.queue.names(status="queued"))
+        orders = self.packer.pack(
+            (name, entry) for name, entry in entries if self.delivery_mode(entry) == "orders"
+        )
+        if self.bucket is not None:
+            for order in orders:
+                order["request"]["delivery"] = self.bucket.delivery_block()
+        areas = [order["cost"] for order in orders]
 
         return orders, areas
 
     def _available_quota(self):
         quotas = self.session.get(
-            "https://api.planet.com/auth/v1/experimental/public/my/subscriptions"
+            SUBSCRIPTIONS_URL
         ).json()
         try:
             remaining = quotas[0]["quota_sqkm"] - quotas[0]["quota_used"]
@@ -0,0 +1,180 @@
+import json
+
+from GeoTools import project_vectors
+from OrderTools import DEFAULT_BUNDLE, build_tools, delivered_bytes, delivery_key
+
+# Maximum number of items the Orders API accepts in a single order
+MAX_ORDER_ITEMS = 500
+
+
+class OrderPacker:
+    """
+    Turns download queue entries into orders. Queries with more items than an order accepts are split in parts,
+    small queries that share the same ROI are grouped in a single order, and orders are scheduled so that
+    they fit in the remaining quota before any of them is placed.
+    """
+
+    def __init__(self, max_items=MAX_ORDER_ITEMS, strategy="count"):
+        if strategy not in ("count", "area"):
+            raise ValueError(f"Unknown packing strategy {strategy}")
+        self.max_items = max_items
+        self.strategy = strategy
+
+    def pack(self, queue_entries):
+        """
+        Returns a list of orders: {"request": order request, "queries": query names, "part": part name or None,
+        "cost": km2, "bytes": estimated delivered bytes}
+        """
+        units = []
+        for name, entry in queue_entries:
+            # Queries whose items were all moved into shared orders are not ordered themselves
+            if not entry["items"]:
+                continue
+
+            cost_per_item = self.estimate_cost(entry) / len(entry["items"])
+            for part, items in self.split(name, entry):
+                # Parts ordered in a previous run no longer use quota
+                if part is not None and entry.get("parts", {}).get(part, {}).get("state") == "success":
+                    continue
+                units.append(
+                    {
+                        "queries": [name],
+                        "part": part,
+                        "roi": entry["roi"],
+                        "clip": entry.get("clip", True),
+                        "bundle": entry.get("bundle", DEFAULT_BUNDLE),
+                        "tools": entry.get("tools") or {},
+                        "key": delivery_key(entry),
+                        "items": list(items),
+                        "cost": cost_per_item * len(items),
+                        "area": entry["area"] / 1000000,
+                    }
+                )
+
+        orders = []
+        for unit in self.__group(units):
+            order_request = {
+                "name": unit["part"] or unit["queries"][0],
+                "products": [
+                    {
+                        "item_ids": unit["items"],
+                        "item_type": "PSScene",
+                        "product_bundle": unit["bundle"],
+                    }
+                ],
+                # Clip to given ROI, unless the query asks for whole scenes, followed by the tools of the query
+                "tools": build_tools(unit["roi"], unit["clip"], unit["tools"], unit["bundle"]),
+            }
+            orders.append(
+                {
+                    "request": order_request,
+                    "queries": unit["queries"],
+                    "part": unit["part"],
+                    "cost": unit["cost"],
+                    "bytes": self.estimate_bytes(unit),
+                }
+            )
+
+        return orders
+
+    def split(self, name, entry):
+        """
+        Returns the (part name or None, items) of each order of a queue entry. Composited queries are ordered
+        layer by layer, and orders with more items than the Orders API accepts are split in parts.
+        """
+        if (entry.get("tools") or {}).get("composite") and entry.get("layers"):
+            item_set = set(entry["items"])
+            groups = [
+                (f"{name}_layer{j + 1}", [item_id for item_id in layer if item_id in item_set])
+                for j, layer in enumerate(entry["layers"])
+            ]
+            groups = [(group_name, items) for group_name, items in groups if items]
+        else:
+            groups = [(None, entry["items"])]
+
+        parts = []
+        for group_name, items in groups:
+            chunks = [items[i : i + self.max_items] for i in range(0, len(items), self.max_items)]
+            for k, chunk in enumerate(chunks):
+                if len(chunks) > 1:
+                    parts.append((f"{group_name or name}_part{k + 1}", chunk))
+                else:
+                    parts.append((group_name, chunk))
+        return parts
+
+    @staticmethod
+    def estimate_bytes(unit):
+        # A composite delivers one raster per order, never larger than the ROI when clipped
+        area = unit["cost"]
+        if unit["tools"].get("composite") and unit["clip"]:
+            area = min(area, unit["area"])
+        return delivered_bytes(area, unit["bundle"], unit["tools"])
+
+    def schedule(self, orders, remaining_quota):
+        """
+        Select the orders that fit in the remaining quota (km2). The "count" strategy places as many orders as possible,
+        the "area" strategy orders the largest area possible. Returns the scheduled and deferred orders.
+        """
+        if self.strategy == "count":
+            candidates = sorted(orders, key=lambda order: order["cost"])
+        else:
+            candidates = sorted(orders, key=lambda order: order["cost"], reverse=True)
+
+        scheduled = []
+        deferred = []
+        for order in candidates:
+            if order["cost"] <= remaining_quota:
+                scheduled.append(order)
+                remaining_quota -= order["cost"]
+            else:
+                deferred.append(order)
+
+        # Keep queue order for placement
+        position = {id(order): i for i, order in enumerate(orders)}
+        scheduled.sort(key=lambda order: position[id(order)])
+        return scheduled, deferred
+
+    def estimate_cost(self, entry):
+        # Quota is charged on the clipped area of each scene. Without footprints, the ROI area is an upper bound
+        footprints = entry.get("footprints", {})
+        if not all(item_id in footprints for item_id in entry["items"]):
+            return entry["area"] / 1000000 * len(entry["items"])
+
+        from shapely.geometry import shape
+
+        roi = shape(entry["roi"]).buffer(0)
+        cost = 0
+        for item_id in entry["items"]:
+            footprint = shape(footprints[item_id]).buffer(0)
+            # Unclipped scenes are charged in full
+            if entry.get("clip", True):
+                footprint = footprint.intersection(roi)
+            cost += project_vectors(footprint).area / 1000000
+        return cost
+
+    def __group(self, units):
+        # Whole queries with the same ROI share a single order while it stays under the item limit
+        grouped = []
+        open_groups = {}
+        for unit in units:
+            if unit["part"] is not None:
+                grouped.append(unit)
+                continue
+
+            roi_key = json.dumps([unit["roi"], unit["key"]], sort_keys=True)
+            group = open_groups.get(roi_key)
+            if group is not None:
+                # Overlapping date ranges select the same scenes, which are ordered once
+                new_items = [item for item in unit["items"] if item not in group["item_set"]]
+                if len(group["items"]) + len(new_items) <= self.max_items:
+                    group["queries"].extend(unit["queries"])
+                    group["items"].extend(new_items)
+                    group["item_set"].update(new_items)
+                    group["cost"] += unit["cost"] * len(new_items) / len(unit["items"])
+                    continue
+
+            group = dict(unit, queries=list(unit["queries"]), items=list(unit["items"]), item_set=set(unit["items"]))
+            open_groups[roi_key] = group
+            grouped.append(group)
+
+        return grouped
@@ -0,0 +1,162 @@
+"""
+Product bundles and server side tool chains of orders. Each query can select a bundle and a chain of tools
+(band selection or band math, reprojection, harmonization, compositing and COG output) in optional columns of
+the queries CSV, so that processing runs on Planet's side and only the bytes that are used are downloaded.
+"""
+import json
+
+DEFAULT_BUNDLE = "analytic_8b_sr_udm2"
+# Bands, bytes per sample and udm2 mask of the PSScene bundles
+BUNDLES = {
+    "analytic_8b_sr_udm2": {"bands": 8, "sample_bytes": 2, "udm2": True, "surface_reflectance": True},
+    "analytic_sr_udm2": {"bands": 4, "sample_bytes": 2, "udm2": True, "surface_reflectance": True},
+    "analytic_8b_udm2": {"bands": 8, "sample_bytes": 2, "udm2": True, "surface_reflectance": False},
+    "analytic_udm2": {"bands": 4, "sample_bytes": 2, "udm2": True, "surface_reflectance": False},
+    "visual": {"bands": 4, "sample_bytes": 1, "udm2": False, "surface_reflectance": False},
+}
+# Optional columns of the queries CSV, after clip
+TOOL_COLUMNS = ("bundle", "bands", "bandmath", "reproject", "resolution", "file_format", "harmonize", "composite")
+PIXEL_TYPES = {"8U": 1, "16U": 2, "16S": 2, "32R": 4}
+# Band math accepts up to 15 output bands
+MAX_BANDMATH_BANDS = 15
+HARMONIZE_TARGETS = ("Sentinel-2",)
+# PSScene ground sample distance (m) and udm2 bands (one byte each)
+NATIVE_RESOLUTION = 3
+UDM2_BANDS = 8
+# Rough size of the delivered files relative to their raw samples. Deliveries are compressed GeoTIFFs,
+# COGs are deflate compressed but add overviews (about a third more pixels)
+FILE_RATIOS = {"GeoTIFF": 0.7, "COG": 0.75}
+
+
+def parse_tools(columns):
+    """
+    Read the bundle and tool chain of a query from the optional CSV columns ({column: value}).
+    Returns (bundle, tools), where tools only has the tools that were set. Raises ValueError on invalid values.
+    """
+    columns = {name: (value or "").strip() for name, value in columns.items() if name in TOOL_COLUMNS}
+    bundle = columns.get("bundle") or DEFAULT_BUNDLE
+    if bundle not in BUNDLES:
+        raise ValueError(f"Unknown product bundle {bundle}. Use one of {', '.join(BUNDLES)}")
+
+    tools = {}
+    if columns.get("bands") and columns.get("bandmath"):
+        raise ValueError("Set either bands or bandmath, not both")
+
+    if columns.get("bands"):
+        # Band numbers separated by ";" or spaces, e.g. 2;4;6;8
+        bands = [int(band) for band in columns["bands"].replace(";", " ").split()]
+        if not bands or any(band < 1 or band > BUNDLES[bundle]["bands"] for band in bands):
+            raise ValueError(f"Bands of {bundle} go from 1 to {BUNDLES[bundle]['bands']}")
+        tools["bands"] = bands
+
+    if columns.get("bandmath"):
+        # Expressions separated by ";", e.g. b1=(b8-b6)/(b8+b6);pixel_type=32R
+        bandmath = {}
+        for expression in columns["bandmath"].split(";"):
+            key, _, value = expression.partition("=")
+            if not value:
+                raise ValueError(f"Band math expression {expression} has no value")
+            bandmath[key.strip()] = value.strip()
+        pixel_type = bandmath.setdefault("pixel_type", "32R")
+        if pixel_type not in PIXEL_TYPES:
+            raise ValueError(f"Unknown pixel type {pixel_type}. Use one of {', '.join(PIXEL_TYPES)}")
+        band_keys = [key for key in bandmath if key != "pixel_type"]
+        valid_keys = [f"b{i}" for i in range(1, MAX_BANDMATH_BANDS + 1)]
+        if not band_keys or any(key not in valid_keys for key in band_keys):
+            raise ValueError(f"Band math outputs are named b1 to b{MAX_BANDMATH_BANDS}")
+        tools["bandmath"] = bandmath
+
+    if columns.get("reproject"):
+        projection = columns["reproject"].upper()
+        if not projection.startswith("EPSG:"):
+            projection = f"EPSG:{projection}"
+        tools["reproject"] = {"projection": projection}
+        if columns.get("resolution"):
+            tools["reproject"]["resolution"] = float(columns["resolution"])
+    elif columns.get("resolution"):
+        raise ValueError("Resolution needs a reproject projection")
+
+    if columns.get("file_format"):
+        file_format = columns["file_format"].upper()
+        if file_format != "COG":
+            raise ValueError(f"Unknown file format {columns['file_format']}. Only COG is supported")
+        tools["file_format"] = "COG"
+
+    if columns.get("harmonize"):
+        if columns["harmonize"] not in HARMONIZE_TARGETS:
+            raise ValueError(f"Unknown harmonization target {columns['harmonize']}")
+        if not BUNDLES[bundle]["surface_reflectance"]:
+            raise ValueError(f"Harmonization needs a surface reflectance bundle, not {bundle}")
+        tools["harmonize"] = columns["harmonize"]
+
+    if columns.get("composite", "").lower() in ("y", "yes", "true", "1"):
+        # Each mosaic layer is composited into a single raster
+        tools["composite"] = True
+
+    return bundle, tools
+
+
+def build_tools(roi, clip, tools, bundle=DEFAULT_BUNDLE):
+    """
+    Orders API tools of an order, in the order they are applied.
+    """
+    chain = []
+    if clip:
+        chain.append({"clip": {"aoi": roi}})
+    if "harmonize" in tools:
+        chain.append({"harmonize": {"target_sensor": tools["harmonize"]}})
+    if "bands" in tools:
+        pixel_type = next(name for name, size in PIXEL_TYPES.items() if size == BUNDLES[bundle]["sample_bytes"])
+        bandmath = {f"b{i + 1}": f"b{band}" for i, band in enumerate(tools["bands"])}
+        chain.append({"bandmath": dict(bandmath, pixel_type=pixel_type)})
+    if "bandmath" in tools:
+        chain.append({"bandmath": dict(tools["bandmath"])})
+    if "reproject" in tools:
+        chain.append({"reproject": dict(tools["reproject"], kernel="cubic")})
+    if tools.get("composite"):
+        chain.append({"composite": {}})
+    if "file_format" in tools:
+        chain.append({"file_format": {"format": tools["file_format"]}})
+    return chain
+
+
+def delivery_key(entry):
+    # Queue entries with the same key receive the same products, and can share orders
+    return json.dumps(
+        [entry.get("bundle", DEFAULT_BUNDLE), entry.get("tools") or {}, entry.get("clip", True)], sort_keys=True
+    )
+
+
+def delivery_mode(entry, direct_max_items):
+    """
+    How a queue entry is delivered: "data-api" for small jobs that need whole scenes, without server side tools,
+    which skip order creation, polling and staging, or "orders".
+    """
+    if entry.get("clip", True) or entry.get("tools") or entry.get("bundle", DEFAULT_BUNDLE) != DEFAULT_BUNDLE:
+        return "orders"
+    if "members" in entry or "order_group" in entry:
+        return "orders"
+    if 0 < len(entry["items"]) <= direct_max_items:
+        return "data-api"
+    return "orders"
+
+
+def delivered_bytes(area_km2, bundle=DEFAULT_BUNDLE, tools=None):
+    """
+    Estimated size (bytes) of the files delivered for area_km2 of imagery with a bundle and tool chain.
+    """
+    tools = tools or {}
+    resolution = tools.get("reproject", {}).get("resolution", NATIVE_RESOLUTION)
+    pixels = area_km2 * 1000000 / resolution**2
+
+    if "bands" in tools:
+        samples = len(tools["bands"]) * BUNDLES[bundle]["sample_bytes"]
+    elif "bandmath" in tools:
+        n_bands = len([key for key in tools["bandmath"] if key != "pixel_type"])
+        samples = n_bands * PIXEL_TYPES[tools["bandmath"]["pixel_type"]]
+    else:
+        samples = BUNDLES[bundle]["bands"] * BUNDLES[bundle]["sample_bytes"]
+    if BUNDLES[bundle]["udm2"]:
+        samples += UDM2_BANDS
+
+    return pixels * samples * FILE_RATIOS[tools.get("file_format", "GeoTIFF")]
@@ -0,0 +1,189 @@
+import json
+import threading
+import time
+import traceback
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from DownloadQueue import DownloadQueue
+from OrderCreator import OrderCreator
+from OrderExecutor import OrderExecutor
+from PipelineMetrics import PipelineMetrics
+from QueueLease import QueueLease
+from QueryJournal import QueryJournal
+from SceneCatalog import SceneCatalog
+from ThumbnailCache import ThumbnailCache
+from TideInterpolator import TideInterpolator
+
+
+class PipelineDaemon:
+    """
+    Runs the pipeline continuously in a single process. Query CSVs dropped in a folder are searched, optimized
+    and queued, while orders are placed and downloaded in their own threads. Sessions, the thumbnail cache and
+    the tidal tables stay warm between cycles, and a small HTTP endpoint reports the state of each stage.
+    """
+
+    def __init__(
+        self,
+        api_key,
+        queries_path,
+        queue_path,
+        report_path,
+        storage_path,
+        interval=300,
+        status_port=8765,
+        min_coverage=0.90,
+        metrics_path=None,
+    ):
+        self.queries_path = Path(queries_path)
+        self.queue_path = queue_path
+        self.report_path = report_path
+        self.storage_path = storage_path
+        self.interval = interval
+        self.status_port = status_port
+        self.min_coverage = min_coverage
+        # Metrics accumulate over the life of the daemon, and are written after every cycle
+        self.metrics_path = metrics_path
+        self.metrics = PipelineMetrics("pipeline_daemon", enabled=metrics_path is not None)
+
+        # Pooled sessions, shared by every stage. The tide server gets its own, without the Planet credentials
+        self.planet_session = self.metrics.attach(self.__pooled_session())
+        self.planet_session.auth = (api_key, "")
+        self.tide_interpolator = TideInterpolator(session=self.metrics.attach(self.__pooled_session()), metrics=self.metrics)
+        self.thumbnail_cache = ThumbnailCache(self.planet_session, metrics=self.metrics)
+        self.journal = QueryJournal(Path(queue_path).parent / "journal")
+        self.scene_catalog = SceneCatalog()
+        self.queue = DownloadQueue(queue_path)
+        # Each stage leases queries under its own worker id. Leases are held per worker, so stages sharing the
+        # process id would take each other's leases, and release them from under each other
+        self.worker = QueueLease.default_worker()
+
+        self.processed_files = {}
+        self.stop_event = threading.Event()
+        self.stages = {
+            name: {"state": "idle", "cycles": 0, "last_run": None, "last_error": None}
+            for name in ("search", "order", "download")
+        }
+
+    def run(self):
+        threads = [
+            threading.Thread(target=self._run_stage, args=("search", self.search_stage), daemon=True),
+            threading.Thread(target=self._run_stage, args=("order", self.order_stage), daemon=True),
+            threading.Thread(target=self._run_stage, args=("download", self.download_stage), daemon=True),
+        ]
+        for thread in threads:
+            thread.start()
+
+        server = ThreadingHTTPServer(("127.0.0.1", self.status_port), self.__status_handler())
+        status_thread = threading.Thread(target=server.serve_forever, daemon=True)
+        status_thread.start()
+        print(f"Pipeline daemon running. Status at http://127.0.0.1:{self.status_port}/status")
+
+        try:
+            while not self.stop_event.wait(1):
+                pass
+        except KeyboardInterrupt:
+            self.stop()
+
+        server.shutdown()
+        for thread in threads:
+            thread.join()
+
+    def stop(self):
+        print("Stopping pipeline daemon after the current cycles.")
+        self.stop_event.set()
+
+    def status(self):
+        counts = {"queued": 0, "ordered": 0, "downloaded": 0}
+        for _, status in self.queue.statuses():
+            counts[status] = counts.get(status, 0) + 1
+
+        status = {"stages": self.stages, "queue": counts, "processed_files": list(self.processed_files)}
+        if self.metrics.enabled:
+            status["metrics"] = self.metrics.summary()
+        return status
+
+    def search_stage(self):
+        # Query CSVs that are new or changed since they were last processed
+        for csv_path in sorted(self.queries_path.glob("*.csv")):
+            modified = csv_path.stat().st_mtime
+            if self.processed_files.get(str(csv_path)) == modified:
+                continue
+
+            print(f"\nProcessing queries in {csv_path}")
+            order_creator = OrderCreator(
+                self.queue_path,
+                planet_session=self.planet_session,
+                thumbnail_cache=self.thumbnail_cache,
+                journal=self.journal,
+                tide_interpolator=self.tide_interpolator,
+                metrics=self.metrics,
+                scene_catalog=self.scene_catalog,
+            )
+            order_creator.query_available_data(str(csv_path))
+            order_creator.optimize_available_data(min_coverage=self.min_coverage)
+            order_creator.create_download_queue()
+            order_creator.generate_report(3, self.report_path)
+            self.processed_files[str(csv_path)] = modified
+
+    def order_stage(self):
+        order_manager = OrderExecutor(self.queue_path, self.planet_session, worker=f"{self.worker}:order", metrics=self.metrics)
+        # If there is available quota, place new orders
+        if order_manager.monthly_quotas > 0:
+            order_manager.place_orders()
+
+    def download_stage(self):
+        order_manager = OrderExecutor(self.queue_path, self.planet_session, worker=f"{self.worker}:download", metrics=self.metrics)
+        order_manager.download_orders(self.storage_path)
+
+    def _run_stage(self, name, stage):
+        stage_status = self.stages[name]
+        while not self.stop_event.is_set():
+            stage_status["state"] = "running"
+            stage_status["last_run"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+            try:
+                stage()
+                stage_status["last_error"] = None
+            except Exception:
+                # A failed cycle is retried in the next one, the other stages keep running
+                stage_status["last_error"] = traceback.format_exc()
+                print(f"\033[31m Stage {name} failed:\n{stage_status['last_error']} \033[0m")
+            stage_status["cycles"] += 1
+            self.metrics.count("cycles", stage=name)
+            self.metrics.write(self.metrics_path)
+            stage_status["state"] = "waiting"
+            self.stop_event.wait(self.interval)
+        stage_status["state"] = "stopped"
+
+    def __status_handler(self):
+        daemon = self
+
+        class StatusHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.rstrip("/") != "/status":
+                    self.send_error(404)
+                    return
+
+                body = json.dumps(daemon.status(), indent=4).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # Keep status requests out of the pipeline output
+                pass
+
+        return StatusHandler
+
+    @staticmethod
+    def __pooled_session():
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=10, pool_maxsize=20)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
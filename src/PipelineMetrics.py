@@ -0,0 +1,190 @@
+import json
+import os
+import threading
+import time
+from contextlib import ExitStack, contextmanager, nullcontext
+from pathlib import Path
+from urllib.parse import urlsplit
+
+# Upper bounds (seconds) of the HTTP latency histogram buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# Reused by every stage of disabled metrics, so that instrumented code costs a function call
+_NO_STAGE = nullcontext()
+
+
+class PipelineMetrics:
+    """
+    Collects stage durations, HTTP latencies by host and endpoint, retries, items processed, bytes downloaded and
+    optimizer iterations for a run. Results are written as a Prometheus textfile and as a JSON run summary.
+    Disabled metrics record nothing, so components can be instrumented unconditionally.
+    Stage hooks (e.g. the profiler) are context managers entered around every stage, enabled or not.
+    """
+
+    def __init__(self, job="pipeline", enabled=True):
+        self.job = job
+        self.enabled = enabled
+        self.started = time.time()
+        self.stages = {}
+        self.counters = {}
+        self.requests = {}
+        self.stage_hooks = []
+        self._lock = threading.Lock()
+        # requests hooks, passed to the requests that are not made through an instrumented session
+        self.hooks = {"response": [self.observe_response]} if enabled else {}
+
+    def stage(self, name):
+        """
+        Context manager timing one run of a stage. Runs of the same stage, in any thread, are added together.
+        """
+        if not self.enabled and not self.stage_hooks:
+            return _NO_STAGE
+        return self._timed_stage(name)
+
+    def add_stage_hook(self, hook):
+        # hook(stage name) returns a context manager
+        self.stage_hooks.append(hook)
+
+    @contextmanager
+    def _timed_stage(self, name):
+        start = time.perf_counter()
+        try:
+            with ExitStack() as hooks:
+                for hook in self.stage_hooks:
+                    hooks.enter_context(hook(name))
+                yield
+        finally:
+            elapsed = time.perf_counter() - start
+            if self.enabled:
+                with self._lock:
+                    stage = self.stages.setdefault(name, {"runs": 0, "seconds": 0.0})
+                    stage["runs"] += 1
+                    stage["seconds"] += elapsed
+
+    def count(self, name, value=1, **labels):
+        # Counters are identified by name and labels, e.g. count("retries", endpoint="quick-search")
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def attach(self, session):
+        # Every response of the session is recorded. Sessions can be shared by several metrics objects
+        if self.enabled:
+            session.hooks["response"].append(self.observe_response)
+        return session
+
+    def observe_response(self, response, *args, **kwargs):
+        url = urlsplit(response.url)
+        key = (url.hostname or "", self.endpoint(url.path), response.status_code)
+        latency = response.elapsed.total_seconds()
+        with self._lock:
+            histogram = self.requests.setdefault(
+                key, {"count": 0, "seconds": 0.0, "buckets": [0] * len(LATENCY_BUCKETS)}
+            )
+            histogram["count"] += 1
+            histogram["seconds"] += latency
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if latency <= bound:
+                    histogram["buckets"][i] += 1
+        return response
+
+    @staticmethod
+    def endpoint(path):
+        # Item, order and search ids are replaced, so that requests to the same endpoint are added together
+        segments = [
+            "{id}" if len(segment) >= 8 and any(c.isdigit() for c in segment) else segment
+            for segment in path.split("/")
+        ]
+        return "/".join(segments) or "/"
+
+    def summary(self):
+        with self._lock:
+            return {
+                "job": self.job,
+                "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+                "duration": time.time() - self.started,
+                "stages": {name: dict(stage) for name, stage in self.stages.items()},
+                "counters": [
+                    {"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in self.counters.items()
+                ],
+                "requests": [
+                    {
+                        "host": host,
+                        "endpoint": endpoint,
+                        "status": status,
+                        "count": histogram["count"],
+                        "seconds": histogram["seconds"],
+                        "buckets": dict(zip(LATENCY_BUCKETS, histogram["buckets"])),
+                    }
+                    for (host, endpoint, status), histogram in self.requests.items()
+                ],
+            }
+
+    def prometheus(self):
+        summary = self.summary()
+        job = {"job": self.job}
+        lines = [
+            "# HELP planet_pipeline_run_seconds Duration of the run so far",
+            "# TYPE planet_pipeline_run_seconds gauge",
+            f"planet_pipeline_run_seconds{_labels(job)} {summary['duration']}",
+            "# HELP planet_pipeline_stage_seconds_total Time spent in each stage",
+            "# TYPE planet_pipeline_stage_seconds_total counter",
+        ]
+        for name, stage in summary["stages"].items():
+            lines.append(f"planet_pipeline_stage_seconds_total{_labels(job, stage=name)} {stage['seconds']}")
+        lines += [
+            "# HELP planet_pipeline_stage_runs_total Number of runs of each stage",
+            "# TYPE planet_pipeline_stage_runs_total counter",
+        ]
+        for name, stage in summary["stages"].items():
+            lines.append(f"planet_pipeline_stage_runs_total{_labels(job, stage=name)} {stage['runs']}")
+
+        lines += [
+            "# HELP planet_pipeline_http_request_duration_seconds Latency of HTTP requests by host and endpoint",
+            "# TYPE planet_pipeline_http_request_duration_seconds histogram",
+        ]
+        for request in summary["requests"]:
+            labels = dict(job, host=request["host"], endpoint=request["endpoint"], status=request["status"])
+            for bound, count in request["buckets"].items():
+                lines.append(f"planet_pipeline_http_request_duration_seconds_bucket{_labels(labels, le=bound)} {count}")
+            lines.append(f"planet_pipeline_http_request_duration_seconds_bucket{_labels(labels, le='+Inf')} {request['count']}")
+            lines.append(f"planet_pipeline_http_request_duration_seconds_sum{_labels(labels)} {request['seconds']}")
+            lines.append(f"planet_pipeline_http_request_duration_seconds_count{_labels(labels)} {request['count']}")
+
+        names = sorted({counter["name"] for counter in summary["counters"]})
+        for name in names:
+            lines.append(f"# TYPE planet_pipeline_{name}_total counter")
+            for counter in summary["counters"]:
+                if counter["name"] == name:
+                    lines.append(f"planet_pipeline_{name}_total{_labels(job, **counter['labels'])} {counter['value']}")
+
+        return "\n".join(lines) + "\n"
+
+    def write(self, folder):
+        """
+        Write <job>.prom (for the node exporter textfile collector) and <job>.json in the given folder.
+        """
+        if not self.enabled:
+            return
+        folder = Path(folder)
+        folder.mkdir(parents=True, exist_ok=True)
+        _write_atomic(folder / f"{self.job}.prom", self.prometheus())
+        _write_atomic(folder / f"{self.job}.json", json.dumps(self.summary(), indent=4))
+
+
+def _labels(labels, **extra):
+    labels = dict(labels, **extra)
+    values = ",".join(
+        '{}="{}"'.format(key, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for key, value in labels.items()
+    )
+    return "{" + values + "}"
+
+
+def _write_atomic(file_path, content):
+    # The textfile collector may read the file at any time, so it is replaced in one step
+    partial_path = file_path.with_name(f"{file_path.name}.{os.getpid()}.part")
+    partial_path.write_text(content)
+    os.replace(partial_path, file_path)
@@ -0,0 +1,133 @@
+import math
+import time
+
+from DataAPIHelpers import query_stats
+from GeoTools import project_vectors
+from OrderTools import delivered_bytes
+from PipelineMetrics import PipelineMetrics
+
+# Area (km2) of a PSScene (SuperDove scenes are about 32 x 20 km), used when the queue has no footprints yet
+DEFAULT_SCENE_KM2 = 640
+# Footprints of the queue sampled to measure the mean scene area
+SCENE_SAMPLE = 500
+# Queries with more items than this are long to paginate and optimize, and are worth splitting by date range
+SPLIT_ITEMS = 2500
+# Queries delivering more than this (GB) are worth splitting, so that orders can be placed and downloaded in parts
+SPLIT_GB = 100
+
+
+class QueryEstimator:
+    """
+    Dry run of a queries CSV. The items, ordered area (km2) and delivered bytes of each query are projected from
+    a single /stats request, the ROI area and the mean scene area of the download queue, without paginating
+    searches, looking up tides or running the optimizer. Queries worth splitting or dropping are flagged.
+    """
+
+    def __init__(self, planet_session, download_queue=None, roi_preprocessor=None, metrics=None):
+        from RoiPreprocessor import RoiPreprocessor
+
+        self.session = planet_session
+        # Optional queue of previous runs, to measure the mean scene area
+        self.download_queue = download_queue
+        self.roi_preprocessor = roi_preprocessor or RoiPreprocessor()
+        self.metrics = metrics or PipelineMetrics(enabled=False)
+
+    def estimate(self, file_path):
+        """
+        Returns the estimate of each query of a CSV: {"name", "items", "days", "ordered_items", "area", "km2",
+        "bytes", "flags"}. Item counts are upper bounds: tide and ROI overlap filters are not applied.
+        """
+        from OrderCreator import read_queries
+
+        scene_km2 = self.mean_scene_area()
+        print(f"Mean scene area: {scene_km2:.0f} km2")
+
+        estimates = []
+        queries = read_queries(file_path, self.roi_preprocessor)
+        for i, (planet_filter, row, query_name, (bundle, tools)) in enumerate(queries):
+            print(f"Requesting item statistics: {i + 1} of {len(queries)} ({query_name})")
+            with self.metrics.stage("estimate"):
+                buckets = query_stats(self.session, planet_filter, "day", metrics=self.metrics)
+            if buckets is None:
+                continue
+            estimates.append(
+                self.project(query_name, buckets, planet_filter.roi, int(row[8]), row[9], bundle, tools, scene_km2)
+            )
+            # Sleep to respect rate limit of 10 requests per second
+            time.sleep(0.1)
+
+        return estimates
+
+    def project(self, name, buckets, roi, n_layers, clip, bundle, tools, scene_km2):
+        from shapely.geometry import shape
+
+        n_items = sum(bucket["count"] for bucket in buckets)
+        n_days = sum(1 for bucket in buckets if bucket["count"])
+        roi_km2 = project_vectors(shape(roi).buffer(0)).area / 1000000
+        clip = str(clip).strip().lower() not in ("no", "n", "false", "0", "")
+
+        # Each layer needs enough scenes to cover the ROI. Scenes overlap each other and the ROI border, so only
+        # about half of each one is assumed to cover new parts of the ROI
+        scenes_per_layer = max(1, math.ceil(2 * roi_km2 / scene_km2))
+        ordered_items = min(n_items, n_layers * scenes_per_layer)
+        if clip:
+            # Clipped layers are charged about the ROI area, less when there are not enough scenes to cover it
+            km2 = n_layers * roi_km2 * ordered_items / (n_layers * scenes_per_layer)
+        else:
+            km2 = ordered_items * scene_km2
+        n_bytes = delivered_bytes(km2, bundle, tools)
+
+        flags = []
+        if n_items == 0:
+            flags.append("drop: no scenes")
+        elif n_days < n_layers:
+            flags.append(f"drop: scenes of {n_days} days for {n_layers} layers")
+        if n_items > SPLIT_ITEMS:
+            flags.append(f"split: more than {SPLIT_ITEMS} items to search")
+        if n_bytes / 1e9 > SPLIT_GB:
+            flags.append(f"split: more than {SPLIT_GB} GB to download")
+
+        return {
+            "name": name,
+            "items": n_items,
+            "days": n_days,
+            "ordered_items": ordered_items,
+            "area": roi_km2,
+            "km2": km2,
+            "bytes": n_bytes,
+            "flags": flags,
+        }
+
+    def mean_scene_area(self):
+        # Mean area of the footprints of previous queries, or the nominal scene area
+        if self.download_queue is None:
+            return DEFAULT_SCENE_KM2
+
+        from shapely.geometry import shape
+
+        footprints = []
+        for _, entry in self.download_queue.items():
+            footprints.extend((entry.get("footprints") or {}).values())
+            if len(footprints) >= SCENE_SAMPLE:
+                break
+        if not footprints:
+            return DEFAULT_SCENE_KM2
+
+        areas = [project_vectors(shape(footprint).buffer(0)).area / 1000000 for footprint in footprints[:SCENE_SAMPLE]]
+        return sum(areas) / len(areas)
+
+    @staticmethod
+    def print_estimates(estimates):
+        print(f'\n{"query":<48} {"items":>7} {"days":>5} {"ordered":>8} {"km2":>9} {"GB":>8}')
+        for estimate in estimates:
+            print(
+                f'{estimate["name"][:48]:<48} {estimate["items"]:>7} {estimate["days"]:>5} {estimate["ordered_items"]:>8} '
+                f'{estimate["km2"]:>9.1f} {estimate["bytes"] / 1e9:>8.2f}'
+            )
+            for flag in estimate["flags"]:
+                print(f"\033[33m    {flag} \033[0m")
+
+        total_km2 = sum(estimate["km2"] for estimate in estimates)
+        total_gb = sum(estimate["bytes"] for estimate in estimates) / 1e9
+        print(f"\nTotal: about {total_km2:.0f} km2 of quota and {total_gb:.1f} GB to download")
+        print("Item counts are before the tide and ROI overlap filters, so they are upper bounds.")
@@ -0,0 +1,48 @@
+import json
+import os
+import shutil
+from pathlib import Path
+
+
+class QueryJournal:
+    """
+    Records the result of each stage of a query (search results, tide-annotated items, optimizer output) as it
+    completes, keyed by query hash. An interrupted run of the same CSV continues from the last completed stages.
+    Stages are kept until the query is queued, and searches that found nothing are not recorded.
+    """
+
+    STAGES = ("search", "items", "optimized")
+
+    def __init__(self, journal_path):
+        self.path = Path(journal_path)
+        self.path.mkdir(parents=True, exist_ok=True)
+
+    def has(self, query_hash, stage):
+        return self._file_path(query_hash, stage).is_file()
+
+    def load(self, query_hash, stage):
+        with open(self._file_path(query_hash, stage), "r", encoding="utf-8") as file:
+            return json.load(file)["data"]
+
+    def save(self, query_hash, stage, data):
+        if stage not in self.STAGES:
+            raise ValueError(f"Unknown journal stage {stage}")
+
+        file_path = self._file_path(query_hash, stage)
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        # Write to a temporary file first, so that an interruption never leaves a partial stage behind
+        partial_path = file_path.with_name(file_path.name + ".part")
+        with open(partial_path, "w", encoding="utf-8") as file:
+            json.dump({"data": data}, file)
+        os.replace(partial_path, file_path)
+
+    def forget(self, query_hash):
+        # Stages of a query that was queued are stale the next time it is searched
+        shutil.rmtree(self.path / query_hash, ignore_errors=True)
+
+    def clear(self):
+        shutil.rmtree(self.path)
+        self.path.mkdir(parents=True, exist_ok=True)
+
+    def _file_path(self, query_hash, stage):
+        return self.path / query_hash / f"{stage}.json"
@@ -0,0 +1,52 @@
+import os
+import socket
+import threading
+
+
+class QueueLease:
+    """
+    Holds the lease of one order in the download queue while a worker processes it.
+    A background thread renews the lease (heartbeat) until the worker is done, so long polling loops
+    keep the order, while orders of workers that died are taken over once their lease expires.
+    """
+
+    def __init__(self, queue, name, status, worker=None, duration=300):
+        self.queue = queue
+        self.name = name
+        self.status = status
+        self.worker = worker or self.default_worker()
+        self.duration = duration
+        self.acquired = False
+        self.lost = False
+        self._stop = threading.Event()
+        self._heartbeat = None
+
+    @staticmethod
+    def default_worker():
+        return f"{socket.gethostname()}:{os.getpid()}"
+
+    def __enter__(self):
+        self.acquired = self.queue.acquire_lease(
+            self.name, self.worker, self.status, self.duration
+        )
+        if self.acquired:
+            self._heartbeat = threading.Thread(target=self._renew, daemon=True)
+            self._heartbeat.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if not self.acquired:
+            return False
+
+        self._stop.set()
+        self._heartbeat.join()
+        self.queue.release_lease(self.name, self.worker)
+        return False
+
+    def _renew(self):
+        # Renew well before the lease expires, so a slow heartbeat does not lose the order
+        while not self._stop.wait(self.duration / 3):
+            if not self.queue.renew_lease(self.name, self.worker, self.duration):
+                print(f"Lost lease of {self.name} to another worker.")
+                self.lost = True
+                return
@@ -0,0 +1,189 @@
+import math
+from io import BytesIO
+from PIL import Image
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfgen.canvas import Canvas
+
+PAGE_SIZE = 1200
+# Colors used to draw the footprints of each mosaic layer in the overview page
+LAYER_COLORS = [
+    (0.12, 0.47, 0.71),
+    (1.00, 0.50, 0.05),
+    (0.17, 0.63, 0.17),
+    (0.84, 0.15, 0.16),
+    (0.58, 0.40, 0.74),
+]
+
+
+def render_report(report_path, grid_cell_number, layers, thumbnails, roi, downscale=True):
+    """
+    Render the PDF report of one query. Takes only plain data so that reports can be rendered in a process pool.
+    layers is a list of (items, mosaic stats) for each mosaic layer, and thumbnails the thumbnail bytes by item id.
+    """
+    grid_size = math.floor((PAGE_SIZE - 200) / grid_cell_number)
+    canvas = Canvas(str(report_path), pagesize=(PAGE_SIZE, PAGE_SIZE))
+    # The first page shows where the selected items are
+    _draw_footprints(canvas, layers, roi)
+    canvas.translate(0, PAGE_SIZE)
+    # count how many thumbnails were drawn to decide when to change pages
+    drawn_thumbnails = 0
+    cells_per_page = grid_cell_number * grid_cell_number
+    image_size = grid_size - 50
+    col = 0
+    row = 0
+
+    # Store which items must be included in the report for this query
+    query_items = []
+    # And the total bandwith used / wasted by the query
+    query_stats = {"query_area": 0, "wasted_area": 0}
+
+    for layer_items, mosaic_stats in layers:
+        query_items.extend(layer_items)
+        query_stats["query_area"] = (
+            query_stats["query_area"] + mosaic_stats["mosaic_area"]
+        )
+        query_stats["wasted_area"] = (
+            query_stats["wasted_area"] + mosaic_stats["wasted_area"]
+        )
+
+    # Start by adding the stats of that query to the page
+    canvas.drawString(
+        500, -100, f'used bandwidth:{round(query_stats["query_area"])} km2'
+    )
+    canvas.drawString(
+        500, -120, f'wasted bandwidth:{round(query_stats["wasted_area"])} km2'
+    )
+
+    # Each image is prepared once, even if its item is drawn more than once
+    images = {}
+
+    for item in query_items:
+        # Get coordinates in the page for corresponding cell
+        x = col * grid_size
+        y = row * grid_size + 200  # Leave top of page empty for mosaic stats
+
+        acquired = str(item["properties"]["acquired"])
+        cloud_cover = str(item["properties"]["cloud_cover"])
+        stage = str(item["properties"]["publishing_stage"])
+        item_id = str(item["id"])
+        tide = (
+            str(item["properties"]["tidal_height"])
+            if "tidal_height" in item["properties"]
+            else "NA"
+        )
+
+        if item_id not in images:
+            images[item_id] = _prepare_thumbnail(thumbnails.get(item_id), image_size, downscale)
+
+        # Thumbnails that could not be fetched are left blank
+        if images[item_id] is not None:
+            canvas.drawImage(
+                images[item_id],
+                x,
+                -y - image_size,
+                width=image_size,
+                height=image_size,
+            )
+        canvas.drawString(x, -y - image_size - 15, f"{item_id} : {acquired}")
+        canvas.drawString(
+            x, -y - image_size - 30, f"cloud cover:{cloud_cover}  tide:{tide}"
+        )
+        canvas.drawString(x, -y - image_size - 45, stage)
+
+        drawn_thumbnails += 1
+
+        # If page is full, start new page and skip increments to col and row indices
+        if drawn_thumbnails == cells_per_page:
+            canvas.showPage()
+            canvas.translate(0, PAGE_SIZE)
+            drawn_thumbnails = 0
+            row = 0
+            col = 0
+            continue
+
+        # Update row and column indices
+        col += 1
+        if col >= grid_cell_number:
+            col = 0
+            row = row + 1
+
+    canvas.save()
+
+    return report_path
+
+
+def _prepare_thumbnail(content, image_size, downscale):
+    if content is None:
+        return None
+
+    thumbnail = Image.open(BytesIO(content))
+    if not downscale:
+        return ImageReader(thumbnail)
+
+    # Embed the thumbnail at the size it is drawn, as a JPEG. Transparent no data areas become white
+    thumbnail = thumbnail.convert("RGBA")
+    background = Image.new("RGB", thumbnail.size, (255, 255, 255))
+    background.paste(thumbnail, mask=thumbnail.getchannel("A"))
+    background = background.resize((image_size, image_size), Image.LANCZOS)
+    buffer = BytesIO()
+    background.save(buffer, format="JPEG", quality=85, optimize=True)
+    buffer.seek(0)
+    return ImageReader(buffer)
+
+
+def _draw_footprints(canvas, layers, roi):
+    # Overview page with the ROI and the footprints of the selected items, colored by layer
+    polygons = [("roi", _polygons(roi))]
+    for i, (layer_items, _) in enumerate(layers):
+        for item in layer_items:
+            polygons.append((i, _polygons(item["geometry"])))
+
+    points = [point for _, rings in polygons for ring in rings for point in ring]
+    if not points:
+        return
+
+    min_x = min(point[0] for point in points)
+    max_x = max(point[0] for point in points)
+    min_y = min(point[1] for point in points)
+    max_y = max(point[1] for point in points)
+    # Degrees of longitude get shorter away from the equator
+    x_factor = math.cos(math.radians((min_y + max_y) / 2))
+    margin = 100
+    scale = (PAGE_SIZE - 2 * margin) / max((max_x - min_x) * x_factor, max_y - min_y, 1e-9)
+
+    def to_page(point):
+        return (
+            margin + (point[0] - min_x) * x_factor * scale,
+            margin + (point[1] - min_y) * scale,
+        )
+
+    canvas.drawString(margin, PAGE_SIZE - 60, "Footprints of selected items by layer (ROI in grey)")
+    for layer, rings in polygons:
+        if layer == "roi":
+            canvas.setFillColorRGB(0.8, 0.8, 0.8)
+            canvas.setStrokeColorRGB(0.5, 0.5, 0.5)
+            fill = 1
+        else:
+            canvas.setStrokeColorRGB(*LAYER_COLORS[layer % len(LAYER_COLORS)])
+            fill = 0
+
+        path = canvas.beginPath()
+        for ring in rings:
+            path.moveTo(*to_page(ring[0]))
+            for point in ring[1:]:
+                path.lineTo(*to_page(point))
+            path.close()
+        canvas.drawPath(path, stroke=1, fill=fill, fillMode=0)
+
+    canvas.showPage()
+
+
+def _polygons(geometry):
+    # Rings of a GeoJSON Polygon or MultiPolygon
+    if geometry is None:
+        return []
+    if geometry["type"] == "Polygon":
+        return list(geometry["coordinates"])
+    if geometry["type"] == "MultiPolygon":
+        return [ring for polygon in geometry["coordinates"] for ring in polygon]
+    return []
@@ -0,0 +1,90 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+
+# Tolerance (degrees, about 50 m) of the geometries sent as search filters, and ROIs simple enough to send as they are
+SEARCH_TOLERANCE = 0.0005
+MAX_SEARCH_VERTICES = 200
+
+
+class RoiPreprocessor:
+    """
+    Loads the ROIs of a GeoJSON file. Each polygon feature of a FeatureCollection becomes its own ROI.
+    Complex ROIs (e.g. coastlines) get a simplified search geometry for the Data API filter: it is buffered by
+    the tolerance before a topology preserving simplification, so that it still covers the ROI and no scene is
+    missed. The exact geometry is kept for clipping and local filters. Search geometries are cached by the hash
+    of the ROI file and the simplification settings.
+    """
+
+    def __init__(self, cache_path="~/.cache/planet_img_pipeline/rois", tolerance=SEARCH_TOLERANCE, max_vertices=MAX_SEARCH_VERTICES):
+        self.path = Path(os.path.expanduser(cache_path))
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.tolerance = tolerance
+        self.max_vertices = max_vertices
+
+    def load(self, roi_path):
+        """
+        Returns a list of ROIs: {"name": name or None, "roi": exact geometry, "search_roi": search geometry}.
+        The name is only set for files with more than one polygon.
+        """
+        content = Path(roi_path).read_bytes()
+        rois = self.__polygons(json.loads(content), roi_path)
+
+        digest = hashlib.sha256(content).hexdigest()
+        cache_file = self.path / f"{digest}_{self.tolerance}_{self.max_vertices}.json"
+        if cache_file.exists():
+            search_rois = json.loads(cache_file.read_text())
+        else:
+            search_rois = [self.search_geometry(roi["roi"]) for roi in rois]
+            partial_path = cache_file.with_name(cache_file.name + ".part")
+            partial_path.write_text(json.dumps(search_rois))
+            os.replace(partial_path, cache_file)
+
+        for roi, search_roi in zip(rois, search_rois):
+            roi["search_roi"] = search_roi
+        return rois
+
+    def search_geometry(self, geometry):
+        if count_vertices(geometry) <= self.max_vertices:
+            return geometry
+
+        from shapely.geometry import mapping, shape
+
+        roi = shape(geometry).buffer(0)
+        # Half the tolerance is left between the simplified boundary and the ROI
+        search_roi = roi.buffer(self.tolerance).simplify(self.tolerance / 2, preserve_topology=True)
+        if not search_roi.contains(roi):
+            search_roi = roi.buffer(self.tolerance)
+        print(f"ROI simplified from {count_vertices(geometry)} to {count_vertices(mapping(search_roi))} vertices for searches")
+        return mapping(search_roi)
+
+    @staticmethod
+    def __polygons(roi_json, roi_path):
+        if roi_json["type"] in ("Polygon", "MultiPolygon"):
+            return [{"name": None, "roi": roi_json}]
+        if roi_json["type"] == "Feature":
+            return [{"name": None, "roi": roi_json["geometry"]}]
+        if roi_json["type"] != "FeatureCollection":
+            raise ValueError(f"ROI {roi_path} is not a polygon or a collection of polygons")
+
+        features = [
+            feature for feature in roi_json["features"]
+            if feature["geometry"] is not None and feature["geometry"]["type"] in ("Polygon", "MultiPolygon")
+        ]
+        if not features:
+            raise ValueError(f"ROI {roi_path} has no polygons")
+        if len(features) == 1:
+            return [{"name": None, "roi": features[0]["geometry"]}]
+
+        rois = []
+        for i, feature in enumerate(features):
+            # Named features keep their name, the others are numbered
+            name = str((feature.get("properties") or {}).get("name") or i + 1)
+            rois.append({"name": name.replace("_", "-").replace("/", "-"), "roi": feature["geometry"]})
+        return rois
+
+
+def count_vertices(geometry):
+    polygons = [geometry["coordinates"]] if geometry["type"] == "Polygon" else geometry["coordinates"]
+    return sum(len(ring) for polygon in polygons for ring in polygon)
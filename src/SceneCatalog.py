@@ -0,0 +1,302 @@
+import calendar
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from RoiPreprocessor import MAX_SEARCH_VERTICES, count_vertices
+
+# Scenes are published some time after they are acquired, so the last days of a search are searched again
+PUBLICATION_DELAY = 3 * 24 * 3600
+# Parts of a ROI smaller than this (square degrees, about 1 m2) are not searched again
+MIN_MISSING_AREA = 1e-10
+DATE_FORMAT = "%Y-%m-%dT%H:%M:%S.000Z"
+
+
+class SceneCatalog:
+    """
+    Local catalog of the scenes found by every search: item, footprint, acquisition time, cloud cover, the tide
+    heights interpolated for them and the clear fraction of delivered scenes over each ROI (see SceneScorer). Footprints and searched areas are indexed in SQLite R-trees. Each search is
+    recorded with its area, dates, cloud cover and asset type, so a new query is answered from the catalog and
+    only the date ranges and parts of its ROI that no previous search covered are sent to the Data API.
+    """
+
+    def __init__(self, catalog_path="~/.cache/planet_img_pipeline/scenes.db"):
+        self.path = Path(os.path.expanduser(catalog_path))
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        self._create_tables()
+
+    def missing(self, planet_filter):
+        """
+        Search filters of the parts of a query the catalog does not cover, by date range and area.
+        An empty list means the query can be answered by lookup.
+        """
+        from shapely.geometry import mapping, shape
+        from shapely.ops import unary_union
+
+        conditions = _conditions(planet_filter.search_filter)
+        min_date = conditions["DateRangeFilter"]["config"]["gte"]
+        max_date = conditions["DateRangeFilter"]["config"]["lte"]
+        roi = shape(conditions["GeometryFilter"]["config"]).buffer(0)
+
+        # Previous searches over the ROI, in the query dates, with the same asset type and at least its cloud cover
+        min_x, min_y, max_x, max_y = roi.bounds
+        rows = self._connection().execute(
+            """
+            SELECT s.min_date, s.max_date, s.geometry FROM searches s JOIN search_bounds b ON s.id = b.id
+            WHERE b.max_x >= ? AND b.min_x <= ? AND b.max_y >= ? AND b.min_y <= ?
+            AND s.max_date >= ? AND s.min_date <= ? AND s.max_cloud_cover >= ? AND s.asset_type = ?
+            """,
+            (min_x, max_x, min_y, max_y, min_date, max_date,
+             conditions["RangeFilter"]["config"]["lte"], conditions["AssetFilter"]["config"][0]),
+        ).fetchall()
+        # Catalogs written before searches were stored by whole days are normalized as they are read
+        searches = [(_whole_days(row[0]), _whole_days(row[1]), shape(json.loads(row[2]))) for row in rows]
+
+        # The query dates are cut where previous searches start or end, and each interval misses the part of the
+        # ROI not covered by the searches that span it. Consecutive intervals missing the same area are merged
+        limits = sorted({min_date, max_date} | {date for search in searches for date in search[:2] if min_date < date < max_date})
+        pieces = []
+        for start, end in zip(limits, limits[1:]):
+            covered = [geometry for search_start, search_end, geometry in searches if search_start <= start and search_end >= end]
+            uncovered = roi.difference(unary_union(covered)) if covered else roi
+            if uncovered.is_empty or uncovered.area < MIN_MISSING_AREA:
+                continue
+            if pieces and pieces[-1][1] == start and pieces[-1][2].equals(uncovered):
+                pieces[-1][1] = end
+            else:
+                pieces.append([start, end, uncovered])
+
+        search_filters = []
+        for start, end, uncovered in pieces:
+            # The missing area is sent as it is, unless it is too complex. Its convex hull covers it
+            if uncovered.geom_type not in ("Polygon", "MultiPolygon") or count_vertices(mapping(uncovered)) > MAX_SEARCH_VERTICES:
+                uncovered = uncovered.convex_hull
+            search_filter = json.loads(json.dumps(planet_filter.search_filter))
+            piece_conditions = _conditions(search_filter)
+            piece_conditions["DateRangeFilter"]["config"] = {"gte": start, "lte": end}
+            piece_conditions["GeometryFilter"]["config"] = mapping(uncovered)
+            search_filters.append(search_filter)
+        return search_filters
+
+    def add(self, items, search_filter):
+        """
+        Store the items found by a search, and record the area and dates it covered.
+        """
+        from shapely.geometry import shape
+
+        conditions = _conditions(search_filter)
+        asset_type = conditions["AssetFilter"]["config"][0]
+        # Recent dates are not recorded as covered, as more of their scenes can still be published
+        cutoff = time.strftime(DATE_FORMAT, time.gmtime(time.time() - PUBLICATION_DELAY))
+        min_date = _whole_days(conditions["DateRangeFilter"]["config"]["gte"])
+        max_date = _whole_days(min(conditions["DateRangeFilter"]["config"]["lte"], cutoff))
+        geometry = conditions["GeometryFilter"]["config"]
+
+        with self._transaction() as connection:
+            for item in items:
+                row = connection.execute("SELECT id, asset_types FROM scenes WHERE item_id = ?", (item["id"],)).fetchone()
+                asset_types = sorted(set(json.loads(row[1]) if row else []) | {asset_type})
+                values = (
+                    item["properties"]["acquired"],
+                    item["properties"].get("cloud_cover") or 0,
+                    json.dumps(asset_types),
+                    json.dumps(item),
+                )
+                if row is None:
+                    scene_id = connection.execute(
+                        "INSERT INTO scenes (item_id, acquired, cloud_cover, asset_types, item) VALUES (?, ?, ?, ?, ?)",
+                        (item["id"],) + values,
+                    ).lastrowid
+                else:
+                    scene_id = row[0]
+                    connection.execute(
+                        "UPDATE scenes SET acquired = ?, cloud_cover = ?, asset_types = ?, item = ? WHERE id = ?",
+                        values + (scene_id,),
+                    )
+                min_x, min_y, max_x, max_y = shape(item["geometry"]).bounds
+                connection.execute(
+                    "INSERT OR REPLACE INTO scene_bounds VALUES (?, ?, ?, ?, ?)", (scene_id, min_x, max_x, min_y, max_y)
+                )
+
+            if min_date < max_date:
+                search_id = connection.execute(
+                    """
+                    INSERT INTO searches (min_date, max_date, max_cloud_cover, asset_type, geometry, searched_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    """,
+                    (min_date, max_date, conditions["RangeFilter"]["config"]["lte"], asset_type, json.dumps(geometry), time.time()),
+                ).lastrowid
+                min_x, min_y, max_x, max_y = shape(geometry).bounds
+                connection.execute(
+                    "INSERT INTO search_bounds VALUES (?, ?, ?, ?, ?)", (search_id, min_x, max_x, min_y, max_y)
+                )
+
+    def lookup(self, planet_filter):
+        """
+        Items of the catalog matching a query filter, sorted by acquisition time as the Data API returns them.
+        """
+        from shapely.geometry import shape
+
+        conditions = _conditions(planet_filter.search_filter)
+        roi = shape(conditions["GeometryFilter"]["config"]).buffer(0)
+        asset_type = conditions["AssetFilter"]["config"][0]
+        min_x, min_y, max_x, max_y = roi.bounds
+        rows = self._connection().execute(
+            """
+            SELECT s.asset_types, s.item FROM scenes s JOIN scene_bounds b ON s.id = b.id
+            WHERE b.max_x >= ? AND b.min_x <= ? AND b.max_y >= ? AND b.min_y <= ?
+            AND s.acquired >= ? AND s.acquired <= ? AND s.cloud_cover <= ?
+            ORDER BY s.acquired
+            """,
+            (min_x, max_x, min_y, max_y,
+             conditions["DateRangeFilter"]["config"]["gte"], conditions["DateRangeFilter"]["config"]["lte"],
+             conditions["RangeFilter"]["config"]["lte"]),
+        )
+
+        items = []
+        for asset_types, item in rows:
+            if asset_type not in json.loads(asset_types):
+                continue
+            item = json.loads(item)
+            # Bounding boxes only select candidates
+            if roi.intersects(shape(item["geometry"])):
+                items.append(item)
+        return items
+
+    def tide(self, item_id, port):
+        row = self._connection().execute(
+            "SELECT height FROM tides WHERE item_id = ? AND port = ?", (item_id, str(port))
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def set_tide(self, item_id, port, height):
+        with self._transaction() as connection:
+            connection.execute("INSERT OR REPLACE INTO tides VALUES (?, ?, ?)", (item_id, str(port), height))
+
+    def set_score(self, item_id, roi, clear, pixels):
+        with self._transaction() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO scores VALUES (?, ?, ?, ?, ?)", (item_id, _roi_hash(roi), clear, pixels, time.time())
+            )
+
+    def scores(self, item_ids, roi, same_roi=False):
+        """
+        Clear fraction of the scenes that were scored: {item id: clear fraction}. Scores over the same ROI are used
+        first. Otherwise (unless same_roi), the scores over other ROIs are averaged, weighted by their number of pixels.
+        """
+        roi_hash = _roi_hash(roi)
+        connection = self._connection()
+        scores = {}
+        item_ids = list(item_ids)
+        # Batches stay under the number of variables a statement accepts
+        for i in range(0, len(item_ids), 500):
+            batch = item_ids[i:i + 500]
+            rows = connection.execute(
+                f"SELECT item_id, roi_hash, clear, pixels FROM scores WHERE item_id IN ({', '.join(['?'] * len(batch))})",
+                batch,
+            )
+            for item_id, score_roi_hash, clear, pixels in rows:
+                scores.setdefault(item_id, []).append((score_roi_hash == roi_hash, clear, pixels))
+
+        best = {}
+        for item_id, item_scores in scores.items():
+            item_scores = [score for score in item_scores if score[0]] or ([] if same_roi else item_scores)
+            if not item_scores:
+                continue
+            total_pixels = sum(pixels for _, _, pixels in item_scores)
+            best[item_id] = sum(clear * pixels for _, clear, pixels in item_scores) / total_pixels
+        return best
+
+    def close(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+    def _connection(self):
+        # sqlite connections can not be shared between threads, so each thread opens its own
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(str(self.path), timeout=60, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    @contextmanager
+    def _transaction(self):
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    def _create_tables(self):
+        self._connection().executescript(
+            """
+            CREATE TABLE IF NOT EXISTS scenes (
+                id          INTEGER PRIMARY KEY,
+                item_id     TEXT UNIQUE NOT NULL,
+                acquired    TEXT NOT NULL,
+                cloud_cover REAL NOT NULL,
+                asset_types TEXT NOT NULL,
+                item        TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS scenes_acquired ON scenes (acquired);
+            CREATE VIRTUAL TABLE IF NOT EXISTS scene_bounds USING rtree (id, min_x, max_x, min_y, max_y);
+            CREATE TABLE IF NOT EXISTS searches (
+                id              INTEGER PRIMARY KEY,
+                min_date        TEXT NOT NULL,
+                max_date        TEXT NOT NULL,
+                max_cloud_cover REAL NOT NULL,
+                asset_type      TEXT NOT NULL,
+                geometry        TEXT NOT NULL,
+                searched_at     REAL NOT NULL
+            );
+            CREATE VIRTUAL TABLE IF NOT EXISTS search_bounds USING rtree (id, min_x, max_x, min_y, max_y);
+            CREATE TABLE IF NOT EXISTS scores (
+                item_id   TEXT NOT NULL,
+                roi_hash  TEXT NOT NULL,
+                clear     REAL NOT NULL,
+                pixels    INTEGER NOT NULL,
+                scored_at REAL NOT NULL,
+                PRIMARY KEY (item_id, roi_hash)
+            );
+            CREATE TABLE IF NOT EXISTS tides (
+                item_id TEXT NOT NULL,
+                port    TEXT NOT NULL,
+                height  REAL NOT NULL,
+                PRIMARY KEY (item_id, port)
+            );
+            """
+        )
+
+
+def _conditions(search_filter):
+    # Conditions of a Data API search filter by type. They are the same objects, so they can be edited in place
+    return {condition["type"]: condition for condition in search_filter["filter"]["config"]}
+
+
+def _whole_days(date):
+    # Query dates run from 00:00:01 to 23:59:59, which would leave 2 seconds uncovered at each day boundary between
+    # back to back searches. Dates that close to midnight are moved to it
+    moment = calendar.timegm(time.strptime(date[:19], "%Y-%m-%dT%H:%M:%S"))
+    seconds = moment % (24 * 3600)
+    if seconds <= 1:
+        moment -= seconds
+    elif seconds >= 24 * 3600 - 1:
+        moment += 24 * 3600 - seconds
+    return time.strftime(DATE_FORMAT, time.gmtime(moment))
+
+
+def _roi_hash(roi):
+    return hashlib.md5(json.dumps(roi, sort_keys=True).encode("utf-8")).hexdigest()
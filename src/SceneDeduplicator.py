@@ -0,0 +1,127 @@
+import hashlib
+import json
+from shapely.geometry import mapping, shape
+from shapely.ops import unary_union
+
+from GeoTools import project_vectors
+from OrderTools import DEFAULT_BUNDLE, delivered_bytes, delivery_key
+
+# Orders API rejects clip AOIs with too many vertices. Shared orders whose AOI union is larger are not merged
+MAX_CLIP_VERTICES = 1500
+
+
+class SceneDeduplicator:
+    """
+    Finds scenes that are queued by more than one query (overlapping ROIs or date ranges) and moves them
+    into shared orders, clipped to the union of the ROIs of every query that uses them.
+    Each scene is then ordered once, and its files are hardlinked into each query folder after download.
+    """
+
+    def __init__(self, download_queue):
+        self.queue = download_queue
+
+    def build_item_index(self):
+        # Only queries that were not ordered yet can still give up their items. Scenes are only shared between
+        # queries with the same bundle and tools, and composited queries keep every item of their layers
+        item_index = {}
+        for name in self.queue.names(status="queued"):
+            entry = self.queue.get(name)
+            if "members" in entry or (entry.get("tools") or {}).get("composite"):
+                continue
+            for item_id in entry["items"]:
+                item_index.setdefault((item_id, delivery_key(entry)), []).append(name)
+
+        return item_index
+
+    def deduplicate(self):
+        item_index = self.build_item_index()
+        # Group shared items by the set of queries that use them. Each group becomes one shared order
+        shared_groups = {}
+        for (item_id, _), names in item_index.items():
+            if len(names) > 1:
+                shared_groups.setdefault(tuple(sorted(names)), []).append(item_id)
+
+        report = {"shared_orders": 0, "shared_items": 0, "quota_saved_km2": 0, "bytes_saved": 0}
+        entries = {}
+
+        for members, item_ids in shared_groups.items():
+            for name in members:
+                if name not in entries:
+                    entries[name] = self.queue.get(name)
+
+            rois = [shape(entries[name]["roi"]).buffer(0) for name in members]
+            shared_roi = unary_union(rois)
+            if self.__count_vertices(shared_roi) > MAX_CLIP_VERTICES:
+                print(f"Shared AOI of {', '.join(members)} is too complex to clip. Keeping separate orders.")
+                continue
+
+            quota_saved = self.__quota_saved(item_ids, members, entries, rois, shared_roi)
+            first = entries[members[0]]
+            report["shared_orders"] += 1
+            report["shared_items"] += len(item_ids) * (len(members) - 1)
+            report["quota_saved_km2"] += quota_saved
+            report["bytes_saved"] += delivered_bytes(quota_saved, first.get("bundle", DEFAULT_BUNDLE), first.get("tools"))
+
+            # Remove the shared items from each member query, and order them once in a shared order
+            shared_ids = set(item_ids)
+            for name in members:
+                entries[name]["items"] = [
+                    item_id for item_id in entries[name]["items"] if item_id not in shared_ids
+                ]
+                self.queue.set_items(name, entries[name]["items"])
+
+            shared_hash = hashlib.md5(
+                json.dumps([sorted(item_ids), list(members)]).encode("utf-8")
+            ).hexdigest()
+            footprints = {
+                item_id: entries[name]["footprints"][item_id]
+                for name in members
+                if "footprints" in entries[name]
+                for item_id in item_ids
+                if item_id in entries[name]["footprints"]
+            }
+            shared_entry = {
+                "roi": mapping(shared_roi),
+                "hash": shared_hash,
+                "items": sorted(item_ids),
+                "ordered": False,
+                "downloaded": False,
+                "area": project_vectors(shared_roi).area,
+                "members": list(members),
+                # Members share the bundle and tools of the shared order
+                "clip": first.get("clip", True),
+                "bundle": first.get("bundle", DEFAULT_BUNDLE),
+                "tools": first.get("tools") or {},
+            }
+            if footprints:
+                shared_entry["footprints"] = footprints
+            self.queue.add(f"shared_{shared_hash[:10]}", shared_entry)
+
+        return report
+
+    def __quota_saved(self, item_ids, members, entries, rois, shared_roi):
+        # Quota is the clipped area of each scene. Items without a stored footprint are left out of the estimate:
+        # their overlap with the ROIs is not known
+        saved = 0
+        for item_id in item_ids:
+            footprint = None
+            for name in members:
+                if item_id in entries[name].get("footprints", {}):
+                    footprint = shape(entries[name]["footprints"][item_id]).buffer(0)
+                    break
+            if footprint is None:
+                continue
+
+            separate = sum(project_vectors(footprint.intersection(roi)).area for roi in rois)
+            shared = project_vectors(footprint.intersection(shared_roi)).area
+            saved += (separate - shared) / 1000000
+
+        return saved
+
+    @staticmethod
+    def __count_vertices(geometry):
+        polygons = geometry.geoms if hasattr(geometry, "geoms") else [geometry]
+        return sum(
+            len(polygon.exterior.coords) + sum(len(ring.coords) for ring in polygon.interiors)
+            for polygon in polygons
+        )
@@ -0,0 +1,101 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from MosaicBuilder import UDM2_CLEAR_BAND, WINDOW_SIZE, find_scene_files
+
+# udm2 band 8 is the legacy unusable data mask. Its first bit marks pixels outside the scene footprint
+UDM2_UNUSABLE_BAND = 8
+# Scenes with less of the ROI clear than this are reported after scoring
+HAZY_FRACTION = 0.8
+
+
+class SceneScorer:
+    """
+    Scores delivered scenes by the fraction of their pixels inside the ROI that udm2 marks as clear. Masks are read
+    in windows by a process pool, so memory use does not depend on the scene size. Scores are kept in the scene
+    catalog, where MosaicOptimizer finds them when the scenes are candidates again. Needs rasterio and numpy.
+    """
+
+    def __init__(self, catalog, max_workers=None, window_size=WINDOW_SIZE):
+        try:
+            import rasterio  # noqa: F401
+            import numpy  # noqa: F401
+        except ImportError:
+            raise ImportError("Scene scoring needs rasterio and numpy. Install them with pip install rasterio numpy")
+
+        self.catalog = catalog
+        self.window_size = window_size
+        self.pool = ProcessPoolExecutor(max_workers or os.cpu_count())
+
+    def score(self, name, entry, folder):
+        """
+        Score the downloaded scenes of a query. Returns {item id: clear fraction}.
+        """
+        files = find_scene_files(folder, scene_ids(entry))
+        futures = [
+            (item_id, self.pool.submit(score_scene, scene["udm2"], entry["roi"], self.window_size))
+            for item_id, scene in files.items()
+            if scene["udm2"] is not None
+        ]
+        print(f"Scoring {len(futures)} scenes of {name}")
+
+        scores = {}
+        for item_id, future in futures:
+            try:
+                clear, pixels = future.result()
+            except Exception as error:
+                print(f"\033[31m Could not score {item_id}: {error} \033[0m")
+                continue
+            # Scenes that do not reach the ROI have no score
+            if pixels:
+                scores[item_id] = clear
+                self.catalog.set_score(item_id, entry["roi"], clear, pixels)
+
+        hazy = sorted(item_id for item_id, clear in scores.items() if clear < HAZY_FRACTION)
+        if scores:
+            print(f"{name}: mean clear fraction {sum(scores.values()) / len(scores):.2f}, {len(hazy)} scenes under {HAZY_FRACTION}")
+        for item_id in hazy:
+            print(f"\033[33m    {item_id}: {scores[item_id]:.2f} clear \033[0m")
+        return scores
+
+    def close(self):
+        self.pool.shutdown()
+
+
+def scene_ids(entry):
+    # Scenes of a query folder. Scenes shared with other queries were moved to a shared order, and are only left
+    # in the layers of the query. Their files are linked into its folder after download
+    return list(dict.fromkeys(entry["items"] + [item_id for layer in entry.get("layers") or [] for item_id in layer]))
+
+
+def score_scene(udm2_path, roi, window_size=WINDOW_SIZE):
+    """
+    Clear fraction of the pixels of a udm2 mask inside the ROI and the scene footprint, and the number of those
+    pixels. The mask is read one window at a time.
+    """
+    import rasterio
+    from rasterio.features import geometry_mask
+    from rasterio.warp import transform_geom
+    from rasterio.windows import Window, transform as window_transform
+
+    clear = 0
+    usable = 0
+    with rasterio.open(udm2_path) as udm2:
+        roi = transform_geom("EPSG:4326", udm2.crs, roi)
+        for row in range(0, udm2.height, window_size):
+            for col in range(0, udm2.width, window_size):
+                window = Window(col, row, min(window_size, udm2.width - col), min(window_size, udm2.height - row))
+                inside = geometry_mask(
+                    [roi],
+                    out_shape=(window.height, window.width),
+                    transform=window_transform(window, udm2.transform),
+                    invert=True,
+                )
+                if not inside.any():
+                    continue
+                unusable = udm2.read(UDM2_UNUSABLE_BAND, window=window)
+                valid = inside & (unusable & 1 == 0)
+                usable += int(valid.sum())
+                clear += int((valid & (udm2.read(UDM2_CLEAR_BAND, window=window) == 1)).sum())
+
+    return (clear / usable if usable else 0.0), usable
@@ -0,0 +1,198 @@
+import cProfile
+import json
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+
+
+class StageProfiler:
+    """
+    Profiles each pipeline stage (search, tide, optimize, thumbnails, report, order, download) separately.
+    Registered as a stage hook of PipelineMetrics. For each stage it writes a pstats file, a speedscope file and
+    the wall-clock time next to the CPU time, so that time spent waiting on the network stands out from the
+    CPU-bound geometry and parsing work. With memory=True, it also records tracemalloc peaks and snapshots.
+    """
+
+    def __init__(self, profile_path, job="pipeline", memory=False):
+        # Every run gets its own folder
+        self.path = Path(profile_path) / f'{job}_{time.strftime("%Y%m%d_%H%M%S")}'
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.memory = memory
+        self.stages = {}
+        self.stats = {}
+        self.snapshots = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        # Only one cProfile profiler can be active at a time in recent Python versions
+        self._profiling_thread = None
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def attach(self, metrics):
+        metrics.add_stage_hook(self.stage)
+        return self
+
+    @contextmanager
+    def stage(self, name):
+        # Nested stages (e.g. tide lookups while optimizing) pause the profile of the outer stage
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        outer = stack[-1] if stack else None
+        if outer is not None:
+            outer.disable()
+
+        profiler = self.__start_profiler()
+        stack.append(profiler)
+        if self.memory:
+            tracemalloc.reset_peak()
+
+        wall_start = time.perf_counter()
+        cpu_start = time.thread_time()
+        # Reports are rendered in worker processes, their CPU time is counted once they are joined
+        children_start = _children_cpu_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall_start
+            cpu = time.thread_time() - cpu_start + _children_cpu_time() - children_start
+
+            stack.pop()
+            if profiler is not None:
+                profiler.disable()
+                self.__release_profiler()
+
+            peak = tracemalloc.get_traced_memory()[1] if self.memory else None
+            self.__record(name, profiler, wall, cpu, peak)
+            if outer is not None:
+                outer.enable()
+
+    def write(self):
+        """
+        Write <stage>.pstats, <stage>.speedscope.json, <stage>.tracemalloc and summary.json. Returns the run folder.
+        """
+        with self._lock:
+            for name, stats in self.stats.items():
+                stats.dump_stats(str(self.path / f"{name}.pstats"))
+                with open(self.path / f"{name}.speedscope.json", "w") as file:
+                    json.dump(speedscope(stats, name), file)
+            for name, snapshot in self.snapshots.items():
+                snapshot.dump(str(self.path / f"{name}.tracemalloc"))
+
+            summary = {}
+            for name, stage in self.stages.items():
+                summary[name] = dict(stage, wait_seconds=max(stage["wall_seconds"] - stage["cpu_seconds"], 0))
+
+        with open(self.path / "summary.json", "w") as file:
+            json.dump(summary, file, indent=4)
+
+        print(f"\nStage profiles written to {self.path}")
+        for name, stage in summary.items():
+            line = f'{name:<12} wall {stage["wall_seconds"]:9.2f}s  cpu {stage["cpu_seconds"]:9.2f}s  wait {stage["wait_seconds"]:9.2f}s'
+            if stage["peak_memory"] is not None:
+                line += f'  peak {stage["peak_memory"] / 1e6:.1f} MB'
+            print(line)
+
+        return self.path
+
+    def __start_profiler(self):
+        # Stages running at the same time in other threads are timed, but not profiled
+        with self._lock:
+            if self._profiling_thread not in (None, threading.get_ident()):
+                return None
+            self._profiling_thread = threading.get_ident()
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+
+    def __release_profiler(self):
+        with self._lock:
+            if not getattr(self._local, "stack", None):
+                self._profiling_thread = None
+
+    def __record(self, name, profiler, wall, cpu, peak):
+        with self._lock:
+            stage = self.stages.setdefault(
+                name, {"runs": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0, "peak_memory": None}
+            )
+            stage["runs"] += 1
+            stage["wall_seconds"] += wall
+            stage["cpu_seconds"] += cpu
+
+            if profiler is not None:
+                if name in self.stats:
+                    self.stats[name].add(profiler)
+                else:
+                    self.stats[name] = pstats.Stats(profiler)
+
+            if peak is not None and (stage["peak_memory"] is None or peak > stage["peak_memory"]):
+                stage["peak_memory"] = peak
+                # Snapshot of the run with the highest peak, taken when the stage ends
+                self.snapshots[name] = tracemalloc.take_snapshot()
+
+
+def speedscope(stats, name):
+    """
+    Convert pstats to a speedscope sampled profile. pstats only keeps caller and callee pairs, so each function's
+    own time is placed under its most expensive chain of callers.
+    """
+    frames = []
+    frame_index = {}
+
+    def frame(function):
+        if function not in frame_index:
+            file_name, line, function_name = function
+            frame_index[function] = len(frames)
+            frames.append({"name": function_name, "file": file_name, "line": line})
+        return frame_index[function]
+
+    samples = []
+    weights = []
+    for function, (_, _, own_time, _, callers) in stats.stats.items():
+        if own_time <= 0:
+            continue
+
+        chain = [function]
+        current = function
+        while len(chain) < 128:
+            callers_of_current = stats.stats[current][4]
+            # Follow the caller that spent the most time calling the current function
+            candidates = [
+                (timing[3] if isinstance(timing, tuple) else 0, caller)
+                for caller, timing in callers_of_current.items()
+                if caller not in chain and caller in stats.stats
+            ]
+            if not candidates:
+                break
+            current = max(candidates)[1]
+            chain.append(current)
+
+        samples.append([frame(function) for function in reversed(chain)])
+        weights.append(own_time)
+
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "shared": {"frames": frames},
+        "profiles": [
+            {
+                "type": "sampled",
+                "name": name,
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": sum(weights),
+                "samples": samples,
+                "weights": weights,
+            }
+        ],
+        "name": name,
+        "exporter": "planet_img_pipeline",
+    }
+
+
+def _children_cpu_time():
+    times = os.times()
+    return times.children_user + times.children_system
@@ -0,0 +1,118 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from PipelineMetrics import PipelineMetrics
+
+
+class ThumbnailCache:
+    """
+    Fetches item thumbnails in a rate-limited thread pool and keeps them on disk, keyed by item id.
+    The cache is bounded in size, and the least recently used thumbnails are evicted first.
+    """
+
+    def __init__(
+        self,
+        planet_session,
+        cache_path="~/.cache/planet_img_pipeline/thumbnails",
+        max_bytes=500 * 1024 * 1024,
+        max_workers=8,
+        requests_per_second=10,
+        metrics=None,
+    ):
+        self.session = planet_session
+        self.metrics = metrics or PipelineMetrics(enabled=False)
+        self.path = Path(os.path.expanduser(cache_path))
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.max_workers = max_workers
+        self.request_interval = 1 / requests_per_second
+        self._next_request = time.monotonic()
+        self._lock = threading.Lock()
+
+    def fetch(self, items):
+        """
+        Returns a dictionary of thumbnail bytes by item id. Missing thumbnails are downloaded concurrently.
+        """
+        thumbnails = {}
+        missing = {}
+        # Items of several layers can be the same scene, which is fetched once
+        for item in items:
+            if item["id"] in thumbnails or item["id"] in missing:
+                continue
+            cached = self._read(item["id"])
+            if cached is None:
+                missing[item["id"]] = item
+            else:
+                thumbnails[item["id"]] = cached
+        missing = list(missing.values())
+
+        if missing:
+            print(f"Fetching {len(missing)} thumbnails ({len(thumbnails)} cached)")
+            with self.metrics.stage("thumbnails"), ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                for item, content in zip(missing, executor.map(self._download, missing)):
+                    thumbnails[item["id"]] = content
+        self.metrics.count("thumbnails", len(thumbnails) - len(missing), source="cache")
+        self.metrics.count("thumbnails", len(missing), source="api")
+
+        self._evict()
+        return thumbnails
+
+    def _wait_turn(self):
+        # Respect the API rate limit across all threads
+        with self._lock:
+            wait = self._next_request - time.monotonic()
+            self._next_request = max(self._next_request, time.monotonic()) + self.request_interval
+        if wait > 0:
+            time.sleep(wait)
+
+    def _download(self, item):
+        # Retries with back off. Failed thumbnails are not cached, and are left out of the report
+        response = None
+        for tries in range(1, 6):
+            # Retries are requests too, and wait for their turn
+            self._wait_turn()
+            try:
+                response = self.session.get(item["_links"]["thumbnail"])
+                if response.ok:
+                    break
+            except Exception:
+                response = None
+            self.metrics.count("retries", endpoint="thumbnail")
+            time.sleep(tries**2)
+
+        if response is None or not response.ok:
+            print(f'Could not fetch thumbnail of {item["id"]}')
+            return None
+
+        content = response.content
+        # Write to a temporary file first, so that concurrent reports never read a partial thumbnail
+        file_path = self._file_path(item["id"])
+        partial_path = file_path.with_name(f"{file_path.name}.{threading.get_ident()}.part")
+        partial_path.write_bytes(content)
+        os.replace(partial_path, file_path)
+        return content
+
+    def _read(self, item_id):
+        file_path = self._file_path(item_id)
+        try:
+            content = file_path.read_bytes()
+        except FileNotFoundError:
+            return None
+        # Mark as recently used
+        os.utime(file_path)
+        return content
+
+    def _evict(self):
+        files = [(file.stat().st_mtime, file.stat().st_size, file) for file in self.path.glob("*.png")]
+        total_size = sum(size for _, size, _ in files)
+        for _, size, file in sorted(files):
+            if total_size <= self.max_bytes:
+                break
+            file.unlink(missing_ok=True)
+            total_size -= size
+
+    def _file_path(self, item_id):
+        return self.path / f"{item_id}.png"
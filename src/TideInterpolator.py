@@ -6,13 +6,21 @@ import requests
 import re
 import numpy as np
 import math
+from ApiEndpoints import TIDE_URL
+from PipelineMetrics import PipelineMetrics
 
 
 class TideInterpolator:
-    def __init__(self):
+    def __init__(self, session=None, metrics=None):
         self.previous_tidal_tables = (
             {}
         )  # Store tidal tables to prevent duplicated requests
+        self.metrics = metrics or PipelineMetrics(enabled=False)
+        # A session keeps the connection to the tide server open between requests
+        if session is None:
+            # Shared sessions are instrumented by their owner
+            session = self.metrics.attach(requests.Session())
+        self.session = session
 
     def interpolate_tide(self, date_time, port):
         # Tidal interpolation is done based on the Portuguese National Hydrographic Institute data
@@ -27,13 +35,14 @@ class TideInterpolator:
         if tidal_table_id in self.previous_tidal_tables.keys():
             table = self.previous_tidal_tables[tidal_table_id]
         else:  # If date is new, query and scrape the data
-            query_str = f"https://www.hidrografico.pt/json/mare.port.val.php?po={port}&dd={starting_date}&nd=2"
-            page = requests.get(query_str)
+            query_str = f"{TIDE_URL}?po={port}&dd={starting_date}&nd=2"
+            page = self.session.get(query_str)
             i = 0
             while not page.ok:
                 print(f"Retrying tidal query in {i**2} seconds", end="\r")
+                self.metrics.count("retries", endpoint="tide")
                 sleep(i**2)
-                page = requests.get(query_str)
+                page = self.session.get(query_str)
                 i += 1
 
             table_elements = lh.fromstring(page.content).xpath("//tr")
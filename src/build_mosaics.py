@@ -0,0 +1,44 @@
+from argparse import ArgumentParser
+from pathlib import Path
+from DownloadQueue import DownloadQueue
+
+
+def main(argv=None):
+    # Load file locations from command line arguments
+    parser = ArgumentParser()
+    parser.add_argument("-q", "--queue", help="Download queue file location", default="./outputs/download_queue.json")
+    parser.add_argument("-s", "--storage", help="Folder the images were downloaded to")
+    parser.add_argument("-o", "--output", help="Folder to write mosaics to (default: a mosaics folder inside each query folder)")
+    parser.add_argument("--format", choices=["cog", "vrt"], default="cog", help="Best pixel COG mosaic masked to the ROI (default), or a VRT referencing the scenes, not masked to the ROI")
+    parser.add_argument("-w", "--workers", type=int, help="Processes computing mosaic windows (default: number of CPUs)")
+    parser.add_argument("--window", type=int, default=1024, help="Size (pixels) of the windows computed by each process")
+    parser.add_argument("--again", action="store_true", help="Also build mosaics of queries that already have them")
+    args = parser.parse_args(argv)
+
+    queue = DownloadQueue(args.queue)
+    # Composited queries were already mosaicked by Planet, and shared orders are mosaicked in their member queries
+    names = [
+        name for name, entry in queue.items()
+        if entry["downloaded"] and "members" not in entry and not (entry.get("tools") or {}).get("composite")
+        and (args.again or "mosaics" not in entry)
+    ]
+    if not names:
+        print("No downloaded queries to mosaic.")
+        return
+
+    from MosaicBuilder import MosaicBuilder
+
+    builder = MosaicBuilder(output_format=args.format, max_workers=args.workers, window_size=args.window)
+    for name in names:
+        folder = Path(args.storage) / name
+        if not folder.exists():
+            print(f"Folder of {name} was not found. Skipping")
+            continue
+        destination = Path(args.output) if args.output else folder / "mosaics"
+        mosaics = builder.build(name, queue.get(name), folder, destination)
+        queue.set_field(name, "mosaics", mosaics)
+
+
+# If running script as standalone, run application
+if __name__ == "__main__":
+    main()
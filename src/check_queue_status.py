@@ -1,8 +1,9 @@
-import json
 from argparse import ArgumentParser
+from pathlib import Path
+from DownloadQueue import DownloadQueue
 
 
-def main():
+def main(argv=None):
     # Control printing colors
     RED = '\033[31m'
     YELLOW = '\033[33m'
@@ -12,18 +13,21 @@ def main():
     # Load file locations from command line arguments
     parser = ArgumentParser()
     parser.add_argument("-q", "--queue", help="Download queue file location", default="./outputs/download_queue.json")
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
-    with open(args.queue, "r", encoding="utf-8") as file:
-        queue = json.load(file)
+    # Opening a queue creates it, so a mistyped path would show an empty queue instead of an error
+    queue_path = Path(args.queue)
+    if not queue_path.exists() and not queue_path.with_suffix(".db").exists():
+        parser.error(f"Download queue {args.queue} does not exist")
+    queue = DownloadQueue(args.queue)
 
-    for order_name in queue:
-            order = queue[order_name]
-            if not order["ordered"]:
+    # Only names and statuses are read, ROIs and item lists stay in the database
+    for order_name, status in queue.statuses():
+            if status == "queued":
                 print(RED + order_name + RESET)
-            elif order["ordered"] and not order["downloaded"]:
+            elif status == "ordered":
                 print(YELLOW + order_name + RESET)
-            elif order["downloaded"]:
+            elif status == "downloaded":
                 print(CYAN + order_name + RESET)
             else:
                 print(RED + "Issue with" + order_name + RESET)
@@ -0,0 +1,19 @@
+from argparse import ArgumentParser
+from AssetStore import AssetStore
+
+
+def main(argv=None):
+    # Load file locations from command line arguments
+    parser = ArgumentParser()
+    parser.add_argument("-a", "--store", help="Content-addressed asset store")
+    parser.add_argument("-s", "--storage", nargs="*", default=[], help="Folders with query links into the store (needed for symlinked stores)")
+    args = parser.parse_args(argv)
+
+    asset_store = AssetStore(args.store)
+    removed, removed_bytes = asset_store.collect_garbage(args.storage)
+    print(f"Removed {removed} unreferenced files ({removed_bytes / 1e9:.2f} GB)")
+
+
+# If running script as standalone, run application
+if __name__ == "__main__":
+    main()
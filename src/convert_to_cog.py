@@ -0,0 +1,46 @@
+from argparse import ArgumentParser
+from pathlib import Path
+from DownloadQueue import DownloadQueue
+
+
+def main(argv=None):
+    # Load file locations from command line arguments
+    parser = ArgumentParser()
+    parser.add_argument("-q", "--queue", help="Download queue file location", default="./outputs/download_queue.json")
+    parser.add_argument("-s", "--storage", help="Folder the images were downloaded to")
+    parser.add_argument("-w", "--workers", type=int, help="Conversion processes (default: number of CPUs)")
+    parser.add_argument("--again", action="store_true", help="Also convert queries that were already converted")
+    parser.add_argument("--store", help="Asset store the query folders are linked to. Converted files are added to it")
+    parser.add_argument("--symlinks", action="store_true", help="Query folders are linked to the asset store with symlinks instead of hardlinks")
+    args = parser.parse_args(argv)
+
+    queue = DownloadQueue(args.queue)
+    # Downloaded queries that were not converted yet, e.g. downloaded without --cog or by an interrupted run
+    names = [
+        name for name, entry in queue.items()
+        if entry["downloaded"] and "members" not in entry and (args.again or "cog" not in entry)
+    ]
+    if not names:
+        print("No downloaded queries to convert.")
+        return
+
+    from CogConverter import CogConverter
+
+    asset_store = None
+    if args.store:
+        from AssetStore import AssetStore
+
+        asset_store = AssetStore(args.store, link_type="symlink" if args.symlinks else "hardlink")
+    converter = CogConverter(queue, max_workers=args.workers, asset_store=asset_store)
+    for name in names:
+        folder = Path(args.storage) / name
+        if folder.exists():
+            converter.submit(name, folder)
+        else:
+            print(f"Folder of {name} was not found. Skipping")
+    converter.wait()
+
+
+# If running script as standalone, run application
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,23 @@
+from argparse import ArgumentParser
+from DownloadQueue import DownloadQueue
+from SceneDeduplicator import SceneDeduplicator
+
+
+def main(argv=None):
+    # Load file locations from command line arguments
+    parser = ArgumentParser()
+    parser.add_argument("-q", "--queue", help="Download queue file location", default="./outputs/download_queue.json")
+    args = parser.parse_args(argv)
+
+    queue = DownloadQueue(args.queue)
+    report = SceneDeduplicator(queue).deduplicate()
+
+    print(f'Shared orders created: {report["shared_orders"]}')
+    print(f'Duplicated scene orders avoided: {report["shared_items"]}')
+    print(f'Quota saved: {round(report["quota_saved_km2"], 1)} km2 (scenes with stored footprints only)')
+    print(f'Download saved (estimate): {report["bytes_saved"] / 1e9:.2f} GB')
+
+
+# If running script as standalone, run application
+if __name__ == "__main__":
+    main()
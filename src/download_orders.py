@@ -1,12 +1,59 @@
 import os
-import requests
 from argparse import ArgumentParser
-from dotenv import load_dotenv
-from src.OrderExecutor import OrderExecutor
+from DownloadQueue import DownloadQueue
+from OrderTools import delivery_mode
 
 
+def main(argv=None):
+    # Load file locations from command line arguments
+    parser = ArgumentParser()
+    parser.add_argument("-q", "--queue", help="Download queue file location")
+    parser.add_argument("-s", "--storage", help="Folder to store imagery. With --bucket it can be left out, and files stay in the bucket")
+    parser.add_argument("--stages", nargs="+", choices=["order", "download"], default=["order", "download"], help="Place orders, download them, or both")
+    parser.add_argument("-w", "--worker", help="Worker name, when several workers share the queue (default: host:pid)")
+    parser.add_argument("--lease", type=int, default=300, help="Seconds before an order held by an unresponsive worker is taken over")
+    parser.add_argument("--shared-storage", action="store_true", help="Queue is on network storage shared by several hosts")
+    parser.add_argument("--packing", choices=["count", "area"], default="count", help="Fit as many orders (count) or as much area (area) as possible in the remaining quota")
+    parser.add_argument("--direct-max-items", type=int, default=20, help="Download unclipped queries with up to this many items through the Data API, without an order (0 to disable)")
+    parser.add_argument("--cog", action="store_true", help="Convert downloaded images to Cloud-Optimized GeoTIFFs (needs rasterio)")
+    parser.add_argument("--cog-workers", type=int, help="COG conversion processes (default: number of CPUs)")
+    parser.add_argument("--bucket", help="Deliver orders to an S3-compatible bucket (s3://bucket/prefix). Credentials are read from S3_ACCESS_KEY_ID and S3_SECRET_ACCESS_KEY (needs boto3)")
+    parser.add_argument("--bucket-endpoint", help="Endpoint of the S3-compatible server, e.g. https://minio.example.com")
+    parser.add_argument("--bucket-region", default="us-east-1", help="Region of the bucket")
+    parser.add_argument("--part-size", type=int, default=16, help="Size (MB) of the byte ranges downloaded in parallel from the bucket")
+    parser.add_argument("--part-workers", type=int, default=8, help="Byte ranges downloaded at the same time from the bucket")
+    parser.add_argument("--store", help="Content-addressed asset store. Query folders become links into it")
+    parser.add_argument("--symlinks", action="store_true", help="Link query folders to the asset store with symlinks instead of hardlinks")
+    parser.add_argument("--metrics", help="Folder to write download_orders.prom (Prometheus textfile) and download_orders.json run metrics to")
+    parser.add_argument("--profile", help="Folder to write a cProfile of each stage (pstats and speedscope) and a wall-clock versus CPU summary to")
+    parser.add_argument("--profile-memory", action="store_true", help="With --profile, also record tracemalloc peak memory of each stage")
+    args = parser.parse_args(argv)
+
+    # Cron runs with nothing to do exit before loading the network and geometry libraries
+    queue = DownloadQueue(args.queue, shared_storage=args.shared_storage)
+    queued = queue.names(status="queued")
+    # Small unclipped queries are downloaded straight from the queued status. With a bucket, everything is ordered
+    direct_max_items = 0 if args.bucket else args.direct_max_items
+    pending = {
+        "order": bool(queued),
+        "download": bool(queue.names(status="ordered"))
+        or any(delivery_mode(queue.get(name), direct_max_items) == "data-api" for name in queued),
+    }
+    if not any(pending[stage] for stage in args.stages):
+        print("No orders to place or download.")
+        return
+
+    # Only bucket deliveries can stay where they are. Download links and Data API assets need a folder
+    if "download" in args.stages and pending["download"] and args.storage is None and args.bucket is None:
+        parser.error("--storage is needed to download orders, unless they are delivered to a bucket (--bucket)")
+
+    import requests
+    from dotenv import load_dotenv
+    from AssetStore import AssetStore
+    from OrderExecutor import OrderExecutor
+    from OrderPacker import OrderPacker
+    from PipelineMetrics import PipelineMetrics
 
-def main():
     # Load planet API key
     load_dotenv()
     API_KEY = os.getenv("PLANET_KEY")
@@ -14,21 +61,71 @@ def main():
     planet_session = requests.Session()
     planet_session.auth = (API_KEY, "")
 
-    # Load file locations from command line arguments
-    parser = ArgumentParser()
-    parser.add_argument("-q", "--queue", help="Download queue file location")
-    parser.add_argument("-s", "--storage", help="Folder to store imagery")
-    args = parser.parse_args()
+    metrics = PipelineMetrics("download_orders", enabled=args.metrics is not None)
+    metrics.attach(planet_session)
+    profiler = None
+    if args.profile:
+        from StageProfiler import StageProfiler
+
+        profiler = StageProfiler(args.profile, "download_orders", memory=args.profile_memory).attach(metrics)
+
+    asset_store = None
+    if args.store:
+        asset_store = AssetStore(args.store, link_type="symlink" if args.symlinks else "hardlink")
+
+    converter = None
+    if args.cog and "download" in args.stages:
+        from CogConverter import CogConverter
+
+        converter = CogConverter(queue, max_workers=args.cog_workers, asset_store=asset_store)
+
+    bucket = None
+    if args.bucket:
+        from BucketDelivery import BucketDelivery
+
+        bucket = BucketDelivery(
+            args.bucket,
+            endpoint=args.bucket_endpoint,
+            region=args.bucket_region,
+            access_key=os.getenv("S3_ACCESS_KEY_ID"),
+            secret_key=os.getenv("S3_SECRET_ACCESS_KEY"),
+            part_size=args.part_size * 1024 * 1024,
+            max_workers=args.part_workers,
+            metrics=metrics,
+        )
 
     # Create order manager
-    order_manager = OrderExecutor(args.queue, planet_session)
-    
-    # If there is available quota, place new orders
-    if order_manager._available_quota() > 0:
-        order_manager.place_orders()
-
-    # Download any placed orders that have not yet been downloaded
-    order_manager.download_orders(args.storage)
+    order_manager = OrderExecutor(
+        args.queue,
+        planet_session,
+        worker=args.worker,
+        lease_duration=args.lease,
+        shared_storage=args.shared_storage,
+        asset_store=asset_store,
+        packer=OrderPacker(strategy=args.packing),
+        metrics=metrics,
+        direct_max_items=args.direct_max_items,
+        converter=converter,
+        bucket=bucket,
+    )
+
+    try:
+        # If there is available quota, place new orders
+        if "order" in args.stages and order_manager.monthly_quotas > 0:
+            order_manager.place_orders()
+
+        # Download any placed orders that have not yet been downloaded
+        if "download" in args.stages:
+            order_manager.download_orders(args.storage)
+
+        # Conversions started during the downloads are finished before exiting
+        if converter is not None:
+            with metrics.stage("convert"):
+                converter.wait()
+    finally:
+        metrics.write(args.metrics)
+        if profiler is not None:
+            profiler.write()
 
 
 # If running script, run application
@@ -0,0 +1,44 @@
+import os
+from pathlib import Path
+
+from argparse import ArgumentParser
+from ThumbnailCache import ThumbnailCache
+
+
+def main(argv=None):
+    # Load file locations from command line arguments
+    parser = ArgumentParser(description="Regenerate the PDF reports of queries that are in the download queue")
+    parser.add_argument("-q", "--queries", help="CSV file with the queries to report on (default: every query in the queue)")
+    parser.add_argument("-o", "--queue", help="Download queue the queries were added to")
+    parser.add_argument("-r", "--report", help="folder to output reports to")
+    parser.add_argument("-t", "--thumbnails", help="Thumbnail cache folder", default="~/.cache/planet_img_pipeline/thumbnails")
+    parser.add_argument("-g", "--grid", type=int, default=3, help="Number of thumbnails per row and column of each page")
+    args = parser.parse_args(argv)
+
+    import requests
+    from dotenv import load_dotenv
+    from OrderCreator import OrderCreator, read_queries
+    from RoiPreprocessor import RoiPreprocessor
+
+    load_dotenv()
+    API_KEY = os.getenv("PLANET_KEY")
+    planet_session = requests.Session()
+    planet_session.auth = (API_KEY, "")
+
+    thumbnail_cache = ThumbnailCache(planet_session, cache_path=args.thumbnails)
+    # Reports show the scenes that were queued. Nothing is searched or optimized again, and the journal is left alone
+    available_data_selector = OrderCreator(
+        args.queue,
+        planet_session=planet_session,
+        thumbnail_cache=thumbnail_cache,
+    )
+    names = None
+    if args.queries:
+        names = [query_name for _, _, query_name, _ in read_queries(args.queries, RoiPreprocessor())]
+    Path(args.report).mkdir(parents=True, exist_ok=True)
+    available_data_selector.generate_queue_report(args.grid, args.report, names=names)
+
+
+# If running script, run application
+if __name__ == "__main__":
+    main()
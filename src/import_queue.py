@@ -0,0 +1,19 @@
+from argparse import ArgumentParser
+from DownloadQueue import DownloadQueue
+
+
+def main(argv=None):
+    # Load file locations from command line arguments
+    parser = ArgumentParser()
+    parser.add_argument("-j", "--json", help="Download queue JSON file created by older versions")
+    parser.add_argument("-q", "--queue", help="Download queue database to import into", default="./outputs/download_queue.db")
+    args = parser.parse_args(argv)
+
+    queue = DownloadQueue(args.queue)
+    imported = queue.import_json(args.json)
+    print(f"Imported {imported} queries from {args.json} into {queue.path}")
+
+
+# If running script as standalone, run application
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+import os
+import signal
+from argparse import ArgumentParser
+from dotenv import load_dotenv
+from PipelineDaemon import PipelineDaemon
+
+
+def main(argv=None):
+    # Load planet API key
+    load_dotenv()
+    API_KEY = os.getenv("PLANET_KEY")
+
+    # Load file locations from command line arguments
+    parser = ArgumentParser()
+    parser.add_argument("-q", "--queries", help="Folder watched for CSV files with queries")
+    parser.add_argument("-o", "--queue", help="Download queue to manage existing queries")
+    parser.add_argument("-r", "--report", help="folder to output reports to")
+    parser.add_argument("-s", "--storage", help="Folder to store imagery")
+    parser.add_argument("-i", "--interval", type=int, default=300, help="Seconds between cycles of each stage")
+    parser.add_argument("-p", "--port", type=int, default=8765, help="Local port of the status endpoint")
+    parser.add_argument("--metrics", help="Folder to write pipeline_daemon.prom (Prometheus textfile) and pipeline_daemon.json to after every cycle")
+    args = parser.parse_args(argv)
+
+    daemon = PipelineDaemon(
+        API_KEY,
+        queries_path=args.queries,
+        queue_path=args.queue,
+        report_path=args.report,
+        storage_path=args.storage,
+        interval=args.interval,
+        status_port=args.port,
+        metrics_path=args.metrics,
+    )
+    # Finish the current cycles before exiting when stopped by the system
+    signal.signal(signal.SIGTERM, lambda signum, frame: daemon.stop())
+    daemon.run()
+
+
+# If running script, run application
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+import importlib
+import sys
+from argparse import ArgumentParser, RawDescriptionHelpFormatter
+
+# Subcommand: (script module, arguments added before the user's, help). Only the selected module is imported
+COMMANDS = {
+    "prepare": ("prepare_download_queues", [], "Search, optimize and queue the queries of a CSV file"),
+    "order": ("download_orders", ["--stages", "order"], "Place orders for queued queries"),
+    "download": ("download_orders", ["--stages", "download"], "Download placed orders"),
+    "cog": ("convert_to_cog", [], "Convert downloaded images to Cloud-Optimized GeoTIFFs"),
+    "mosaic": ("build_mosaics", [], "Assemble the layers of downloaded queries into mosaics"),
+    "score": ("score_scenes", [], "Score downloaded scenes by their clear fraction over the ROI"),
+    "status": ("check_queue_status", [], "Show the status of each query in the download queue"),
+    "report": ("generate_reports", [], "Regenerate the reports of prepared queries"),
+    "dedup": ("deduplicate_queue", [], "Move scenes shared by several queries into shared orders"),
+    "import": ("import_queue", [], "Import a JSON download queue into the database"),
+    "clean-store": ("clean_asset_store", [], "Remove unreferenced blobs from the asset store"),
+    "daemon": ("pipeline_daemon", [], "Run the pipeline continuously"),
+}
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+
+    parser = ArgumentParser(
+        prog="planet-pipeline",
+        formatter_class=RawDescriptionHelpFormatter,
+        epilog="commands:\n" + "\n".join(f"  {command:<12} {description}" for command, (_, _, description) in COMMANDS.items()),
+    )
+    parser.add_argument("command", choices=COMMANDS, metavar="command", help="See below. Run a command with -h for its options")
+    # Everything after the command is parsed by its script, so that its help and defaults stay in one place
+    args = parser.parse_args(argv[:1])
+
+    module_name, extra_arguments, _ = COMMANDS[args.command]
+    module = importlib.import_module(module_name)
+    return module.main(extra_arguments + list(argv[1:]))
+
+
+# If running script, run application
+if __name__ == "__main__":
+    sys.exit(main())
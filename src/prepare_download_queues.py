@@ -1,42 +1,122 @@
 import os
-import requests
+from pathlib import Path
 
 from argparse import ArgumentParser
-from OrderCreator import OrderCreator
-from dotenv import load_dotenv
+from QueryJournal import QueryJournal
+from RoiPreprocessor import RoiPreprocessor
+from SceneCatalog import SceneCatalog
+from PipelineMetrics import PipelineMetrics
+from ThumbnailCache import ThumbnailCache
 
 
-def main():
-    # Create HTML session with proper Planets key 
+def main(argv=None):
+    # Load file locations from command line arguments
+    parser = ArgumentParser()
+    parser.add_argument("-q", "--queries", help="CSV file with desired queries")
+    parser.add_argument("-o", "--queue", help="Download queue to manage existing queries")
+    parser.add_argument("-r", "--report", help="folder to output reports to")
+    parser.add_argument("-t", "--thumbnails", help="Thumbnail cache folder", default="~/.cache/planet_img_pipeline/thumbnails")
+    parser.add_argument("--catalog", help="Local catalog of the scenes found by previous searches", default="~/.cache/planet_img_pipeline/scenes.db")
+    parser.add_argument("--no-catalog", action="store_true", help="Search every query in the Data API, without the scene catalog")
+    parser.add_argument("--min-overlap", type=float, default=0.01, help="Minimum fraction of the ROI an item must cover")
+    parser.add_argument("--search-workers", type=int, default=4, help="Queries (and polygons of multi-polygon ROI files) searched concurrently")
+    parser.add_argument("--roi-tolerance", type=float, default=0.0005, help="Tolerance (degrees) of the simplified ROIs sent to the Data API")
+    parser.add_argument("--lazy-tide", action="store_true", help="Only interpolate tides for the items considered by the optimizer")
+    parser.add_argument("-j", "--journal", help="Folder to journal completed query stages (default: journal folder next to the queue)")
+    parser.add_argument("--estimate", action="store_true", help="Only estimate the items, quota and download size of each query, from one statistics request per query")
+    parser.add_argument("--refresh", action="store_true", help="Search queued queries again, and add their new items to the existing mosaics")
+    parser.add_argument("--restart", action="store_true", help="Ignore stages completed by previous runs")
+    parser.add_argument("--thumbnail-cache-size", type=int, default=500, help="Maximum size of the thumbnail cache (MB)")
+    parser.add_argument("--metrics", help="Folder to write prepare.prom (Prometheus textfile) and prepare.json run metrics to")
+    parser.add_argument("--profile", help="Folder to write a cProfile of each stage (pstats and speedscope) and a wall-clock versus CPU summary to")
+    parser.add_argument("--profile-memory", action="store_true", help="With --profile, also record tracemalloc peak memory of each stage")
+    args = parser.parse_args(argv)
+
+    # Network and geometry libraries are loaded once the arguments are valid
+    import requests
+    from dotenv import load_dotenv
+    from OrderCreator import OrderCreator
+
+    # Create HTML session with proper Planets key
     # Get your key in your Planet account page and place it in .env
     load_dotenv()
     API_KEY = os.getenv("PLANET_KEY")
     planet_session = requests.Session()
     planet_session.auth = (API_KEY, "")
 
-    # Load file locations from command line arguments
-    parser = ArgumentParser()
-    parser.add_argument("-q", "--queries", help="CSV file with desired queries")
-    parser.add_argument("-o", "--queue", help="Download queue to manage existing queries")
-    parser.add_argument("-r", "--report", help="folder to output reports to")
-    args = parser.parse_args()
+    metrics = PipelineMetrics("prepare", enabled=args.metrics is not None)
+    metrics.attach(planet_session)
+    profiler = None
+    if args.profile:
+        from StageProfiler import StageProfiler
+
+        profiler = StageProfiler(args.profile, "prepare", memory=args.profile_memory).attach(metrics)
+
+    if args.estimate:
+        from DownloadQueue import DownloadQueue
+        from QueryEstimator import QueryEstimator
+
+        # Dry run: nothing is searched, journaled or queued. The queue only provides the mean scene area
+        estimator = QueryEstimator(
+            planet_session,
+            download_queue=DownloadQueue(args.queue) if args.queue else None,
+            roi_preprocessor=RoiPreprocessor(tolerance=args.roi_tolerance),
+            metrics=metrics,
+        )
+        try:
+            estimator.print_estimates(estimator.estimate(args.queries))
+        finally:
+            metrics.write(args.metrics)
+            if profiler is not None:
+                profiler.write()
+        return
+
+    thumbnail_cache = ThumbnailCache(
+        planet_session,
+        cache_path=args.thumbnails,
+        max_bytes=args.thumbnail_cache_size * 1024 * 1024,
+        metrics=metrics,
+    )
+
+    # Searches, tide lookups and optimizations are journaled as they complete, so that an interrupted run
+    # of the same CSV continues where it stopped
+    journal = QueryJournal(args.journal or Path(args.queue).parent / "journal")
+    if args.restart:
+        journal.clear()
 
     # Load the previous image queries and setup settings for new requests
     available_data_selector = OrderCreator(
         args.queue,
-        planet_session=planet_session
+        planet_session=planet_session,
+        thumbnail_cache=thumbnail_cache,
+        journal=journal,
+        metrics=metrics,
+        roi_preprocessor=RoiPreprocessor(tolerance=args.roi_tolerance),
+        scene_catalog=None if args.no_catalog else SceneCatalog(args.catalog),
     )
 
-    # Load new requests from CSV file
-    available_data_selector.query_available_data(args.queries)
+    try:
+        # Load new requests from CSV file
+        available_data_selector.query_available_data(
+            args.queries,
+            min_overlap=args.min_overlap,
+            lazy_tide=args.lazy_tide,
+            max_workers=args.search_workers,
+            refresh=args.refresh,
+        )
 
-    print("\nStarting data optimization")
-    available_data_selector.optimize_available_data(min_coverage=0.90)
-    print("\nCreating asset download queue.")
-    available_data_selector.create_download_queue()
+        print("\nStarting data optimization")
+        available_data_selector.optimize_available_data(min_coverage=0.90, refresh=args.refresh)
+        print("\nCreating asset download queue.")
+        available_data_selector.create_download_queue()
 
-    available_data_selector.generate_report(3, args.report)
-    print("\nDownload queue has been created successfully.")
+        available_data_selector.generate_report(3, args.report)
+        print("\nDownload queue has been created successfully.")
+    finally:
+        # Interrupted and failed runs are the ones worth looking at
+        metrics.write(args.metrics)
+        if profiler is not None:
+            profiler.write()
 
 # If running script, run application
 if __name__ == "__main__":
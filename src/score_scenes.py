@@ -0,0 +1,48 @@
+from argparse import ArgumentParser
+from pathlib import Path
+from DownloadQueue import DownloadQueue
+from SceneCatalog import SceneCatalog
+from SceneScorer import SceneScorer, scene_ids
+
+
+def main(argv=None):
+    # Load file locations from command line arguments
+    parser = ArgumentParser()
+    parser.add_argument("-q", "--queue", help="Download queue file location", default="./outputs/download_queue.json")
+    parser.add_argument("-s", "--storage", help="Folder the images were downloaded to")
+    parser.add_argument("--catalog", help="Scene catalog to store the scores in", default="~/.cache/planet_img_pipeline/scenes.db")
+    parser.add_argument("-w", "--workers", type=int, help="Processes reading udm2 masks (default: number of CPUs)")
+    parser.add_argument("--window", type=int, default=1024, help="Size (pixels) of the windows read at a time")
+    parser.add_argument("--again", action="store_true", help="Also score scenes that already have a score over the query ROI")
+    args = parser.parse_args(argv)
+
+    queue = DownloadQueue(args.queue)
+    # Shared orders are scored in their member queries, over each ROI. Composites have no scenes left to score
+    names = [
+        name for name, entry in queue.items()
+        if entry["downloaded"] and "members" not in entry and not (entry.get("tools") or {}).get("composite")
+    ]
+    if not names:
+        print("No downloaded queries to score.")
+        return
+
+    catalog = SceneCatalog(args.catalog)
+    scorer = SceneScorer(catalog, max_workers=args.workers, window_size=args.window)
+    try:
+        for name in names:
+            entry = queue.get(name)
+            item_ids = scene_ids(entry)
+            if not args.again and set(item_ids) <= set(catalog.scores(item_ids, entry["roi"], same_roi=True)):
+                continue
+            folder = Path(args.storage) / name
+            if not folder.exists():
+                print(f"Folder of {name} was not found. Skipping")
+                continue
+            scorer.score(name, entry, folder)
+    finally:
+        scorer.close()
+
+
+# If running script as standalone, run application
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from AssetStore import AssetStore  # noqa: E402
+
+ROI = {"type": "Polygon", "coordinates": [[[-9.5, 38.7], [-9.5, 38.8], [-9.4, 38.8], [-9.4, 38.7], [-9.5, 38.7]]]}
+
+
+@pytest.fixture
+def store(tmp_path):
+    return AssetStore(tmp_path / "store")
+
+
+def test_clip_hash_does_not_depend_on_key_order():
+    reordered = {"coordinates": ROI["coordinates"], "type": "Polygon"}
+    assert AssetStore.clip_hash(ROI) == AssetStore.clip_hash(reordered)
+    assert AssetStore.clip_hash(None) == "none"
+    assert AssetStore.clip_hash(ROI) != AssetStore.clip_hash(None)
+
+
+def delivered(folder, name, content=b"scene"):
+    file_path = folder / name
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    file_path.write_bytes(content)
+    return file_path
+
+
+def test_identical_files_are_stored_once(store, tmp_path):
+    first = delivered(tmp_path / "query-a", "scene.tif")
+    blob = store.add(first, "item", "analytic_sr_udm2", AssetStore.clip_hash(ROI))
+    store.link(blob, first)
+
+    # The same bytes delivered to another query, under another clip
+    second = delivered(tmp_path / "query-b", "scene.tif")
+    assert store.add(second, "item", "analytic_sr_udm2", AssetStore.clip_hash(None)) == blob
+    store.link(blob, second)
+
+    digest = AssetStore.file_digest(blob)
+    assert blob == store.blob_path(digest)
+    assert sorted(store.keys(digest)) == sorted([("item", "analytic_sr_udm2", AssetStore.clip_hash(ROI)), ("item", "analytic_sr_udm2", "none")])
+    assert os.path.samefile(first, second)
+    assert [path for path in store.blobs_path.rglob("*") if path.is_file()] == [blob]
+
+
+def test_find_reuses_blobs_by_digest(store, tmp_path):
+    blob = store.add(delivered(tmp_path, "scene.tif"), "item", "analytic_sr_udm2", "none")
+    digest = AssetStore.file_digest(blob)
+
+    # Found whatever key it is looked up under, which is then indexed too
+    assert store.find("item", "analytic_sr_udm2", AssetStore.clip_hash(ROI), digest) == blob
+    assert len(store.keys(digest)) == 2
+    assert store.find("item", "analytic_sr_udm2", "none", "0" * 64) is None
+
+
+def test_garbage_collection_keeps_linked_blobs(store, tmp_path):
+    kept = store.add(delivered(tmp_path / "query", "kept.tif", b"kept"), "kept", "analytic_sr_udm2", "none")
+    store.link(kept, tmp_path / "query" / "kept.tif")
+    removed = store.add(delivered(tmp_path / "query", "removed.tif", b"removed"), "removed", "analytic_sr_udm2", "none")
+    store.link(removed, tmp_path / "query" / "removed.tif")
+    # The query folder of one of them was deleted
+    (tmp_path / "query" / "removed.tif").unlink()
+
+    assert store.collect_garbage() == (1, len(b"removed"))
+    assert kept.exists()
+    assert not removed.exists()
+    assert store.keys(AssetStore.file_digest(kept)) == [("kept", "analytic_sr_udm2", "none")]
+
+
+def test_garbage_collection_of_symlinked_blobs(tmp_path):
+    store = AssetStore(tmp_path / "store", link_type="symlink")
+    views = tmp_path / "views"
+    kept = store.add(delivered(views / "query", "kept.tif", b"kept"), "kept", "analytic_sr_udm2", "none")
+    store.link(kept, views / "query" / "kept.tif")
+    removed = store.add(delivered(views / "query", "removed.tif", b"removed"), "removed", "analytic_sr_udm2", "none")
+
+    assert (views / "query" / "kept.tif").is_symlink()
+    assert store.collect_garbage(view_roots=[views]) == (1, len(b"removed"))
+    assert kept.exists()
+    assert not removed.exists()
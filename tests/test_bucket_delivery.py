@@ -0,0 +1,217 @@
+import io
+import json
+import os
+import sys
+import uuid
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from ApiEndpoints import SUBSCRIPTIONS_URL  # noqa: E402
+
+# Runs against a local MinIO server, e.g.
+# docker run -p 9000:9000 minio/minio server /data
+# MINIO_ENDPOINT=http://127.0.0.1:9000 MINIO_ACCESS_KEY=minioadmin MINIO_SECRET_KEY=minioadmin pytest tests/test_bucket_delivery.py
+MINIO_ENDPOINT = os.getenv("MINIO_ENDPOINT")
+MINIO_ACCESS_KEY = os.getenv("MINIO_ACCESS_KEY")
+MINIO_SECRET_KEY = os.getenv("MINIO_SECRET_KEY")
+
+requires_minio = pytest.mark.skipif(
+    not (MINIO_ENDPOINT and MINIO_ACCESS_KEY and MINIO_SECRET_KEY),
+    reason="MINIO_ENDPOINT, MINIO_ACCESS_KEY and MINIO_SECRET_KEY are not set",
+)
+
+
+@pytest.fixture
+def bucket():
+    pytest.importorskip("boto3")
+    from BucketDelivery import BucketDelivery
+
+    name = f"planet-test-{uuid.uuid4().hex[:12]}"
+    delivery = BucketDelivery(
+        f"s3://{name}/deliveries",
+        endpoint=MINIO_ENDPOINT,
+        access_key=MINIO_ACCESS_KEY,
+        secret_key=MINIO_SECRET_KEY,
+        # Small parts, so that every file is retrieved in several ranges
+        part_size=1000,
+        max_workers=4,
+    )
+    delivery.client.create_bucket(Bucket=name)
+    yield delivery
+
+    for page in delivery.client.get_paginator("list_objects_v2").paginate(Bucket=name):
+        for bucket_object in page.get("Contents", []):
+            delivery.client.delete_object(Bucket=name, Key=bucket_object["Key"])
+    delivery.client.delete_bucket(Bucket=name)
+
+
+def deliver(bucket, order_id, files, listed=None):
+    # Files as Planet writes them: <prefix>/<order id>/<path>, and the manifest listing them
+    for path, content in files.items():
+        bucket.client.put_object(Bucket=bucket.bucket, Key=f"deliveries/{order_id}/{path}", Body=content)
+    manifest = {
+        "files": [
+            {"path": path, "size": len(content), "annotations": {"planet/item_id": path.split("/")[-1][:23]}}
+            for path, content in (listed or files).items()
+        ]
+    }
+    bucket.client.put_object(Bucket=bucket.bucket, Key=f"deliveries/{order_id}/manifest.json", Body=json.dumps(manifest))
+
+
+@requires_minio
+def test_delivery_is_incomplete_without_manifest_or_files(bucket):
+    assert bucket.delivered_files("order-1") is None
+
+    analytic = os.urandom(2500)
+    deliver(bucket, "order-1", {}, listed={"PSScene/20240101_103045_12_2455_3B_AnalyticMS_SR_8b_clip.tif": analytic})
+    assert bucket.manifest("order-1") is not None
+    assert bucket.delivered_files("order-1") is None
+
+
+@requires_minio
+def test_ranged_download_of_complete_delivery(bucket, tmp_path):
+    files = {
+        "PSScene/20240101_103045_12_2455_3B_AnalyticMS_SR_8b_clip.tif": os.urandom(4321),
+        "PSScene/20240101_103045_12_2455_3B_udm2_clip.tif": os.urandom(999),
+        "PSScene/20240101_103045_12_2455_metadata.json": b"{}",
+    }
+    deliver(bucket, "order-2", files)
+
+    delivered = bucket.delivered_files("order-2")
+    assert sorted(file["path"] for file in delivered) == sorted(list(files) + ["manifest.json"])
+    assert delivered[0]["item_id"] == "20240101_103045_12_2455"
+
+    local_files = bucket.download(delivered, tmp_path)
+    assert len(local_files) == len(delivered)
+    for path, content in files.items():
+        assert (tmp_path / path).read_bytes() == content
+    assert not list(tmp_path.rglob("*.part"))
+
+    # Files of the same size are not downloaded again
+    modified_time = (tmp_path / list(files)[0]).stat().st_mtime_ns
+    bucket.download(delivered, tmp_path)
+    assert (tmp_path / list(files)[0]).stat().st_mtime_ns == modified_time
+
+
+class StubClient:
+    """
+    In-memory stand-in for the S3 client, so that downloads and the order flow are tested without a server.
+    Ranges listed in fail_ranges, as (key, start), raise instead of returning their bytes.
+    """
+
+    def __init__(self):
+        self.objects = {}
+        self.fail_ranges = set()
+
+    def get_object(self, Bucket, Key, Range=None):
+        if Key not in self.objects:
+            error = Exception(f"{Key} does not exist")
+            error.response = {"Error": {"Code": "NoSuchKey"}}
+            raise error
+        content = self.objects[Key]
+        if Range is not None:
+            start, end = (int(value) for value in Range[len("bytes="):].split("-"))
+            if (Key, start) in self.fail_ranges:
+                raise IOError(f"Range {start}-{end} of {Key} failed")
+            content = content[start:end + 1]
+        return {"Body": io.BytesIO(content)}
+
+    def put_object(self, Bucket, Key, Body):
+        self.objects[Key] = Body.encode() if isinstance(Body, str) else Body
+
+    def get_paginator(self, operation):
+        return self
+
+    def paginate(self, Bucket, Prefix):
+        return [{"Contents": [{"Key": key, "Size": len(content)} for key, content in self.objects.items() if key.startswith(Prefix)]}]
+
+
+class StubResponse:
+    def __init__(self, content):
+        self.content = content
+        self.ok = True
+        self.status_code = 200
+
+    def json(self):
+        return self.content
+
+
+class StubSession:
+    # Planet API: the subscription quota, placed orders and their state
+    def __init__(self, state="success"):
+        self.state = state
+        self.placed = []
+
+    def get(self, url):
+        if url == SUBSCRIPTIONS_URL:
+            return StubResponse([{"quota_sqkm": 1000, "quota_used": 0}])
+        return StubResponse({"name": url.split("/")[-1], "state": self.state, "last_message": "Manifest delivery completed"})
+
+    def post(self, url, data, headers):
+        self.placed.append(json.loads(data))
+        return StubResponse({"id": "order-1"})
+
+
+@pytest.fixture
+def stub_bucket():
+    from BucketDelivery import BucketDelivery
+
+    return BucketDelivery("s3://planet/deliveries", part_size=1000, max_workers=4, client=StubClient())
+
+
+def queued_query(queue, name):
+    roi = {"type": "Polygon", "coordinates": [[[0, 0], [0, 1], [1, 1], [1, 0], [0, 0]]]}
+    queue.add(name, {"roi": roi, "hash": name, "items": ["20240101_103045_12_2455"], "ordered": False, "downloaded": False, "area": 1000000})
+
+
+def test_failed_range_discards_only_its_file(stub_bucket, tmp_path):
+    files = {
+        "PSScene/20240101_103045_12_2455_3B_AnalyticMS_SR_8b_clip.tif": os.urandom(4321),
+        "PSScene/20240101_103045_12_2455_3B_udm2_clip.tif": os.urandom(2999),
+    }
+    deliver(stub_bucket, "order-1", files)
+    stub_bucket.client.fail_ranges.add(("deliveries/order-1/PSScene/20240101_103045_12_2455_3B_AnalyticMS_SR_8b_clip.tif", 2000))
+
+    local_files = stub_bucket.download(stub_bucket.delivered_files("order-1"), tmp_path)
+    assert "PSScene/20240101_103045_12_2455_3B_AnalyticMS_SR_8b_clip.tif" not in local_files
+    assert not (tmp_path / "PSScene/20240101_103045_12_2455_3B_AnalyticMS_SR_8b_clip.tif").exists()
+    assert (tmp_path / "PSScene/20240101_103045_12_2455_3B_udm2_clip.tif").read_bytes() == files["PSScene/20240101_103045_12_2455_3B_udm2_clip.tif"]
+    assert not list(tmp_path.rglob("*.part"))
+
+
+def test_order_delivered_to_bucket(stub_bucket, tmp_path):
+    # OrderExecutor imports requests
+    pytest.importorskip("requests")
+    from DownloadQueue import DownloadQueue
+    from OrderExecutor import OrderExecutor
+
+    queue_path = tmp_path / "download_queue.db"
+    queued_query(DownloadQueue(queue_path), "query-1")
+    session = StubSession()
+    executor = OrderExecutor(queue_path, session, bucket=stub_bucket)
+    executor.place_orders()
+
+    # Orders ask for the bucket, and the queue remembers where the files of each query are
+    assert session.placed[0]["delivery"] == stub_bucket.delivery_block()
+    entry = DownloadQueue(queue_path).get("query-1")
+    assert entry["ordered"] and entry["id"] == "order-1"
+    assert entry["delivery"] == stub_bucket.location()
+
+    # Nothing is marked downloaded until the manifest and its files are in the bucket
+    download_path = tmp_path / "storage"
+    executor.download_orders(download_path)
+    assert not executor.queue.get("query-1")["downloaded"]
+
+    analytic = os.urandom(2500)
+    deliver(stub_bucket, "order-1", {"PSScene/20240101_103045_12_2455_3B_AnalyticMS_SR_8b_clip.tif": analytic})
+    stub_bucket.client.fail_ranges.add(("deliveries/order-1/PSScene/20240101_103045_12_2455_3B_AnalyticMS_SR_8b_clip.tif", 1000))
+    executor.download_orders(download_path)
+    assert not executor.queue.get("query-1")["downloaded"]
+
+    stub_bucket.client.fail_ranges.clear()
+    executor.download_orders(download_path)
+    assert executor.queue.get("query-1")["downloaded"]
+    assert (download_path / "query-1/PSScene/20240101_103045_12_2455_3B_AnalyticMS_SR_8b_clip.tif").read_bytes() == analytic
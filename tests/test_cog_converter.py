@@ -0,0 +1,91 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+np = pytest.importorskip("numpy")
+rasterio = pytest.importorskip("rasterio")
+from rasterio.transform import from_origin  # noqa: E402
+
+from AssetStore import AssetStore  # noqa: E402
+from CogConverter import CogConverter, convert_file  # noqa: E402
+
+
+class Queue:
+    def __init__(self):
+        self.fields = {}
+
+    def set_field(self, name, field, value):
+        self.fields[(name, field)] = value
+
+
+def write_tif(path, size=700):
+    data = (np.arange(4 * size * size, dtype="uint16") % 5000).reshape(4, size, size)
+    with rasterio.open(path, "w", driver="GTiff", width=size, height=size, count=4, dtype="uint16",
+                       crs="EPSG:32629", transform=from_origin(480000, 4300000, 3, 3)) as dataset:
+        dataset.write(data)
+    return data
+
+
+def test_converts_in_place(tmp_path):
+    path = tmp_path / "scene_AnalyticMS_SR.tif"
+    data = write_tif(path)
+
+    assert convert_file(path)
+    with rasterio.open(path) as cog:
+        assert cog.profile["tiled"]
+        assert cog.block_shapes[0] == (512, 512)
+        assert cog.overviews(1)
+        assert cog.compression.name.lower() == "deflate"
+        assert (cog.read() == data).all()
+        assert cog.crs.to_epsg() == 32629
+    assert not list(tmp_path.glob("*.part"))
+
+    # Already a COG
+    assert not convert_file(path)
+
+
+def test_records_conversions_in_the_queue(tmp_path):
+    folder = tmp_path / "query"
+    folder.mkdir()
+    write_tif(folder / "a.tif", size=300)
+    (folder / "b.tif").write_text("not a tiff")
+
+    queue = Queue()
+    converter = CogConverter(queue, max_workers=1)
+    converter.submit("query", folder)
+    converter.wait()
+
+    assert queue.fields[("query", "cog")] == {"converted": 1, "failed": ["b.tif"]}
+    with rasterio.open(folder / "a.tif") as cog:
+        assert cog.profile["tiled"]
+
+
+def test_linked_files_are_stored_as_cogs(tmp_path):
+    store = AssetStore(tmp_path / "store")
+    folder = tmp_path / "query"
+    folder.mkdir()
+    source = folder / "scene.tif"
+    data = write_tif(source, size=300)
+    stored = store.add(source, "item", "analytic_sr_udm2", "none")
+    store.link(stored, source)
+    stored_digest = AssetStore.file_digest(stored)
+
+    queue = Queue()
+    converter = CogConverter(queue, max_workers=1, asset_store=store)
+    converter.submit("query", folder)
+    converter.wait()
+
+    assert queue.fields[("query", "cog")] == {"converted": 1, "failed": []}
+    # The stored file is left as it was, and the query folder links to its COG
+    assert AssetStore.file_digest(stored) == stored_digest
+    cog_digest = AssetStore.file_digest(source)
+    assert [tuple(key) for key in store.keys(cog_digest)] == [("item", "analytic_sr_udm2", "none")]
+    assert os.path.samefile(store.blob_path(cog_digest), source)
+    assert not list(folder.glob("*.cog*"))
+    with rasterio.open(source) as cog:
+        assert cog.profile["tiled"]
+        assert (cog.read() == data).all()
@@ -0,0 +1,89 @@
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from DownloadQueue import DownloadQueue  # noqa: E402
+
+ROI = {"type": "Polygon", "coordinates": [[[-9.5, 38.7], [-9.5, 38.8], [-9.4, 38.8], [-9.4, 38.7], [-9.5, 38.7]]]}
+
+
+def entry(query_hash, items=("20240101_103045_12_2455",), **fields):
+    return dict({"roi": ROI, "hash": query_hash, "items": list(items), "ordered": False, "downloaded": False, "area": 1000000}, **fields)
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = DownloadQueue(tmp_path / "download_queue.db")
+    yield queue
+    queue.close()
+
+
+def test_json_queue_is_imported_once(tmp_path):
+    json_path = tmp_path / "download_queue.json"
+    json_queue = {
+        "queued": entry("a", clip=False, layers=[["20240101_103045_12_2455"]]),
+        "ordered": entry("b", ordered=True, id="order-1"),
+        "downloaded": entry("c", ordered=True, downloaded=True, id="order-2"),
+    }
+    json_path.write_text(json.dumps(json_queue))
+
+    queue = DownloadQueue(json_path)
+    assert queue.path == tmp_path / "download_queue.db"
+    assert queue.statuses() == [("queued", "queued"), ("ordered", "ordered"), ("downloaded", "downloaded")]
+    assert queue.get("queued") == json_queue["queued"]
+    assert queue.get("ordered")["id"] == "order-1"
+    assert queue.names(status="downloaded") == ["downloaded"]
+
+    # The database is used from then on, changes to the JSON file are not imported again
+    queue.mark_downloaded("queued")
+    json_path.write_text(json.dumps({"other": entry("d")}))
+    reopened = DownloadQueue(json_path)
+    assert reopened.names() == ["queued", "ordered", "downloaded"]
+    assert reopened.get("queued")["downloaded"]
+
+
+def test_get_of_missing_query_raises(queue):
+    with pytest.raises(KeyError):
+        queue.get("missing")
+
+
+def test_has_hash(queue):
+    queue.add("query", entry("hash-1"))
+    assert queue.has_hash("hash-1")
+    assert not queue.has_hash("hash-2")
+    # Queries are matched by hash whatever name they were queued under
+    assert queue.name_of_hash("hash-1") == "query"
+    assert queue.name_of_hash("hash-2") is None
+
+
+def test_leases(queue):
+    queue.add("query", entry("hash-1"))
+
+    assert queue.acquire_lease("query", "worker-1", "queued", 300)
+    # Held by another worker, or in another status than expected
+    assert not queue.acquire_lease("query", "worker-2", "queued", 300)
+    assert not queue.acquire_lease("query", "worker-1", "ordered", 300)
+    assert not queue.acquire_lease("missing", "worker-1", "queued", 300)
+    assert queue.renew_lease("query", "worker-1", 300)
+    assert not queue.renew_lease("query", "worker-2", 300)
+
+    queue.release_lease("query", "worker-1")
+    assert queue.leases() == []
+    assert queue.acquire_lease("query", "worker-2", "queued", 300)
+
+
+def test_expired_lease_is_taken_over(queue):
+    queue.add("query", entry("hash-1"))
+
+    # A worker that stopped sending heartbeats
+    assert queue.acquire_lease("query", "worker-1", "queued", -1)
+    assert queue.acquire_lease("query", "worker-2", "queued", 300)
+    assert [lease[:3] for lease in queue.leases()] == [("query", "worker-2", "queued")]
+    # The first worker finds out at its next heartbeat, and its release leaves the new lease alone
+    assert not queue.renew_lease("query", "worker-1", 300)
+    queue.release_lease("query", "worker-1")
+    assert len(queue.leases()) == 1
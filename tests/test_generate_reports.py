@@ -0,0 +1,90 @@
+import io
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+pytest.importorskip("shapely")
+pytest.importorskip("pyproj")
+pytest.importorskip("reportlab")
+Image = pytest.importorskip("PIL.Image")
+
+from DownloadQueue import DownloadQueue  # noqa: E402
+from OrderCreator import OrderCreator  # noqa: E402
+from ThumbnailCache import ThumbnailCache  # noqa: E402
+
+ROI = {"type": "Polygon", "coordinates": [[[-9.5, 38.7], [-9.5, 38.8], [-9.4, 38.8], [-9.4, 38.7], [-9.5, 38.7]]]}
+FOOTPRINT = {"type": "Polygon", "coordinates": [[[-9.6, 38.6], [-9.6, 38.9], [-9.3, 38.9], [-9.3, 38.6], [-9.6, 38.6]]]}
+QUEUED = "20240101_103045_12_2455"
+SHARED = "20240102_103045_12_2455"
+
+
+class Response:
+    def __init__(self, ok=True, data=None, content=b""):
+        self.ok = ok
+        self.data = data
+        self.content = content
+
+    def json(self):
+        return self.data
+
+
+class ItemSession:
+    # Answers item lookups and thumbnails. Searches are not expected
+    def __init__(self):
+        self.requests = []
+        thumbnail = io.BytesIO()
+        Image.new("RGBA", (8, 8), (0, 0, 255, 255)).save(thumbnail, format="PNG")
+        self.thumbnail = thumbnail.getvalue()
+
+    def get(self, url):
+        self.requests.append(("GET", url))
+        if url.endswith("/thumb"):
+            return Response(content=self.thumbnail)
+        item_id = url.rsplit("/", 1)[-1]
+        return Response(data={
+            "id": item_id,
+            "geometry": None,
+            "properties": {"acquired": "2024-01-01T10:30:45Z", "cloud_cover": 0, "publishing_stage": "finalized"},
+            "_links": {"thumbnail": f"https://tiles.example/{item_id}/thumb"},
+        })
+
+    def post(self, url, **kwargs):
+        self.requests.append(("POST", url))
+        raise AssertionError("Reports of queued queries must not search again")
+
+
+def test_report_is_built_from_the_queued_scenes(tmp_path, monkeypatch):
+    monkeypatch.setenv("HOME", str(tmp_path))
+    monkeypatch.setattr("time.sleep", lambda seconds: None)
+    queue_path = tmp_path / "download_queue.db"
+    queue = DownloadQueue(queue_path)
+    # Deduplication moved the shared scene to a shared order, it is still in the layers of the query
+    queue.add("query", {
+        "roi": ROI, "hash": "hash", "items": [QUEUED], "ordered": False, "downloaded": False, "area": 1,
+        "layers": [[QUEUED], [SHARED]], "footprints": {QUEUED: FOOTPRINT, SHARED: FOOTPRINT},
+    })
+    queue.add("shared_1", {"roi": ROI, "hash": "shared", "items": [SHARED], "ordered": False, "downloaded": False, "area": 1, "members": ["query", "other"]})
+    queue.close()
+
+    session = ItemSession()
+    creator = OrderCreator(queue_path, session, thumbnail_cache=ThumbnailCache(session, cache_path=tmp_path / "thumbnails"))
+    creator.generate_queue_report(2, tmp_path, max_workers=1)
+
+    assert (tmp_path / "query.pdf").is_file()
+    assert not (tmp_path / "shared_1.pdf").exists()
+    assert all(method == "GET" for method, _ in session.requests)
+    looked_up = sorted(url.rsplit("/", 1)[-1] for _, url in session.requests if not url.endswith("/thumb"))
+    assert looked_up == [QUEUED, SHARED]
+
+
+def test_queries_missing_from_the_queue_are_skipped(tmp_path, monkeypatch):
+    monkeypatch.setenv("HOME", str(tmp_path))
+    session = ItemSession()
+    creator = OrderCreator(tmp_path / "download_queue.db", session, thumbnail_cache=ThumbnailCache(session, cache_path=tmp_path / "thumbnails"))
+    creator.generate_queue_report(2, tmp_path, names=["missing"], max_workers=1)
+
+    assert session.requests == []
+    assert list(tmp_path.glob("*.pdf")) == []
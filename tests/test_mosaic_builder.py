@@ -0,0 +1,99 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+np = pytest.importorskip("numpy")
+rasterio = pytest.importorskip("rasterio")
+from rasterio.transform import from_origin  # noqa: E402
+from rasterio.warp import transform_geom  # noqa: E402
+
+from MosaicBuilder import MosaicBuilder, find_scene_files  # noqa: E402
+
+CRS = "EPSG:32629"
+WEST = "20240101_103045_12_2455"
+EAST = "20240101_103047_34_2455"
+# The ROI reaches into both scenes, which overlap between x = 486000 and 489000. Its top left corner is cut off
+ROI = transform_geom(CRS, "EPSG:4326", {
+    "type": "Polygon",
+    "coordinates": [[(482000, 4292000), (493000, 4292000), (493000, 4298000), (485000, 4298000), (482000, 4295000), (482000, 4292000)]],
+})
+
+
+def write_scene(folder, item_id, left, value, confidence, clear_columns, size=300):
+    transform = from_origin(left, 4300000, 30, 30)
+    options = {"driver": "GTiff", "width": size, "height": size, "crs": CRS, "transform": transform}
+    with rasterio.open(folder / f"{item_id}_3B_AnalyticMS_SR_clip.tif", "w", count=4, dtype="uint16", **options) as analytic:
+        analytic.write(np.full((4, size, size), value, dtype="uint16"))
+    udm2 = np.zeros((8, size, size), dtype="uint8")
+    udm2[0, :, :clear_columns] = 1
+    udm2[6] = confidence
+    with rasterio.open(folder / f"{item_id}_3B_udm2_clip.tif", "w", count=8, dtype="uint8", **options) as mask:
+        mask.write(udm2)
+
+
+@pytest.fixture
+def folder(tmp_path):
+    folder = tmp_path / "query" / "files"
+    folder.mkdir(parents=True)
+    write_scene(folder, WEST, 480000, 100, confidence=10, clear_columns=150)
+    write_scene(folder, EAST, 486000, 200, confidence=90, clear_columns=300)
+    return tmp_path / "query"
+
+
+def test_finds_analytic_and_udm2_files(folder):
+    files = find_scene_files(folder, [WEST, EAST, "20240101_103049_56_2455"])
+    assert sorted(files) == [WEST, EAST]
+    assert files[WEST]["analytic"].endswith("AnalyticMS_SR_clip.tif")
+    assert files[WEST]["udm2"].endswith("udm2_clip.tif")
+
+
+def read_at(mosaic, x, y):
+    row, col = mosaic.index(x, y)
+    return int(mosaic.read(1)[row, col])
+
+
+def test_cog_mosaic_keeps_the_clearest_pixels(folder, tmp_path):
+    entry = {"layers": [[WEST, EAST]], "roi": ROI}
+    [path] = MosaicBuilder(max_workers=2, window_size=64).build("query", entry, folder, tmp_path / "mosaics")
+
+    assert path.endswith("query_layer1.tif")
+    with rasterio.open(path) as mosaic:
+        assert mosaic.crs.to_epsg() == 32629
+        assert mosaic.overviews(1)
+        # Only the west scene, both scenes (the east one is clearer), only the east scene
+        assert read_at(mosaic, 484000, 4295000) == 100
+        assert read_at(mosaic, 487500, 4295000) == 200
+        assert read_at(mosaic, 491000, 4295000) == 200
+        # Outside the ROI, in its cut off corner
+        assert read_at(mosaic, mosaic.bounds.left + 15, mosaic.bounds.top - 15) == 0
+
+
+def test_windows_do_not_change_the_mosaic(folder, tmp_path):
+    entry = {"layers": [[WEST, EAST]], "roi": ROI}
+    [windowed] = MosaicBuilder(max_workers=2, window_size=50).build("query", entry, folder, tmp_path / "windowed")
+    [whole] = MosaicBuilder(max_workers=1, window_size=4096).build("query", entry, folder, tmp_path / "whole")
+
+    with rasterio.open(windowed) as first, rasterio.open(whole) as second:
+        assert first.shape == second.shape
+        assert (first.read() == second.read()).all()
+
+
+def test_vrt_mosaic_draws_the_clearest_scene_last(folder, tmp_path):
+    entry = {"layers": [[EAST, WEST]], "roi": ROI}
+    [path] = MosaicBuilder("vrt").build("query", entry, folder, tmp_path / "mosaics")
+
+    sources = [line for line in Path(path).read_text().splitlines() if "SourceFilename" in line]
+    assert len(sources) == 8
+    assert WEST in sources[0] and EAST in sources[1]
+    with rasterio.open(path) as mosaic:
+        assert mosaic.bounds.left == 480000 and mosaic.bounds.right == 495000
+
+
+def test_layers_without_scenes_are_skipped(folder, tmp_path):
+    entry = {"layers": [[WEST], ["20240101_103049_56_2455"]], "roi": ROI}
+    mosaics = MosaicBuilder(max_workers=1).build("query", entry, folder, tmp_path / "mosaics")
+    assert [Path(path).name for path in mosaics] == ["query_layer1.tif"]
+    assert MosaicBuilder(max_workers=1).build("query", {"roi": ROI}, folder, tmp_path / "mosaics") == []
@@ -0,0 +1,127 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+pytest.importorskip("shapely")
+pytest.importorskip("pyproj")
+
+from shapely.geometry import box, mapping  # noqa: E402
+
+from MosaicOptimizer import MosaicOptimizer  # noqa: E402
+
+ROI = mapping(box(-9.5, 38.7, -9.3, 38.8))
+# Scenes over the western and eastern halves of the ROI, each reaching a little into the other half
+WEST = box(-9.52, 38.68, -9.38, 38.82)
+EAST = box(-9.42, 38.68, -9.28, 38.82)
+
+
+class Query:
+    # The parts of AvailableDataQuery that MosaicOptimizer uses. Items named in out_of_tide are outside the tidal range
+    def __init__(self, items, out_of_tide=()):
+        self.filter = type("Filter", (), {"roi": ROI})()
+        self.items = items
+        self.session = None
+        self.metrics = None
+        self.out_of_tide = set(out_of_tide)
+        self.tide_checks = []
+
+    def within_tide(self, index):
+        self.tide_checks.append(self.items[index]["id"])
+        return self.items[index]["id"] not in self.out_of_tide
+
+
+def item(item_id, geometry, cloud_cover=0.0):
+    return {"id": item_id, "geometry": mapping(geometry), "properties": {"cloud_cover": cloud_cover}}
+
+
+def selected_ids(query, mosaics):
+    return [[query.items[index]["id"] for index in indices] for indices, _ in mosaics]
+
+
+def test_select_tiles_covers_the_roi():
+    query = Query([item("west", WEST), item("east", EAST)])
+    mosaics = MosaicOptimizer(query).select_tiles(1, 0.95)
+
+    assert sorted(selected_ids(query, mosaics)[0]) == ["east", "west"]
+    assert mosaics[0][1]["missing_fraction"] == pytest.approx(0, abs=1e-6)
+
+
+def test_tiles_out_of_the_tidal_range_are_skipped():
+    # The clearest eastern scene is out of the tidal range, and a cloudier one over the same area replaces it
+    query = Query([item("west", WEST), item("east", EAST), item("east-cloudy", EAST, cloud_cover=0.05)], out_of_tide=["east"])
+    mosaics = MosaicOptimizer(query).select_tiles(1, 0.95)
+
+    assert sorted(selected_ids(query, mosaics)[0]) == ["east-cloudy", "west"]
+    assert "east" in query.tide_checks
+
+
+def test_starter_tiles_out_of_the_tidal_range_are_skipped():
+    query = Query([item("whole", box(-9.52, 38.68, -9.28, 38.82)), item("west", WEST), item("east", EAST)], out_of_tide=["whole"])
+    mosaics = MosaicOptimizer(query).select_tiles(1, 0.95)
+
+    assert "whole" not in selected_ids(query, mosaics)[0]
+    assert mosaics[0][1]["missing_fraction"] == pytest.approx(0, abs=1e-6)
+
+
+def test_no_tile_in_range_leaves_the_mosaic_incomplete():
+    query = Query([item("west", WEST), item("east", EAST)], out_of_tide=["east"])
+    mosaics = MosaicOptimizer(query).select_tiles(1, 0.95)
+
+    assert selected_ids(query, mosaics) == [["west"]]
+    assert mosaics[0][1]["missing_fraction"] > 0.05
+
+
+def initial_state(items):
+    query = Query(items)
+    optimizer = MosaicOptimizer(query)
+    return optimizer.mosaic_state(optimizer.select_tiles(1, 0.95))
+
+
+def test_new_scenes_fill_the_missing_region():
+    state = initial_state([item("west", WEST)])
+    assert state["layers"][0]["missing_fraction"] > 0.05
+
+    query = Query([item("west", WEST), item("east", EAST)])
+    new_state, changes = MosaicOptimizer(query).update_tiles(state, 0.95)
+
+    assert changes == [{"type": "add", "layer": 0, "new": "east"}]
+    assert new_state["layers"][0]["items"] == ["west", "east"]
+    assert new_state["layers"][0]["missing_fraction"] == pytest.approx(0, abs=1e-6)
+    assert new_state["candidates"] == ["west", "east"]
+
+
+def test_clearer_scenes_replace_queued_ones():
+    state = initial_state([item("west", WEST, cloud_cover=0.3), item("east", EAST)])
+
+    query = Query([item("west", WEST, cloud_cover=0.3), item("east", EAST), item("west-clear", WEST)])
+    new_state, changes = MosaicOptimizer(query).update_tiles(state, 0.95)
+
+    assert changes == [{"type": "swap", "layer": 0, "old": "west", "new": "west-clear"}]
+    assert sorted(new_state["layers"][0]["items"]) == ["east", "west-clear"]
+    assert new_state["layers"][0]["missing_fraction"] == pytest.approx(0, abs=1e-6)
+
+
+def test_ordered_scenes_are_not_replaced():
+    state = initial_state([item("west", WEST, cloud_cover=0.3), item("east", EAST)])
+
+    query = Query([item("west", WEST, cloud_cover=0.3), item("east", EAST), item("west-clear", WEST)])
+    new_state, changes = MosaicOptimizer(query).update_tiles(state, 0.95, replaceable=False)
+
+    assert changes == []
+    assert sorted(new_state["layers"][0]["items"]) == ["east", "west"]
+
+
+def test_scenes_that_were_candidates_are_not_checked_again():
+    # east was already a candidate when the mosaic was chosen (and was left out), so it is not added now
+    state = initial_state([item("west", WEST)])
+    state["candidates"].append("east")
+
+    query = Query([item("west", WEST), item("east", EAST)])
+    new_state, changes = MosaicOptimizer(query).update_tiles(state, 0.95)
+
+    assert changes == []
+    assert new_state["layers"][0]["items"] == ["west"]
+    assert new_state["layers"][0]["missing_fraction"] > 0.05
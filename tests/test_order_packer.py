@@ -0,0 +1,97 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from OrderPacker import MAX_ORDER_ITEMS, OrderPacker  # noqa: E402
+
+ROI_A = {"type": "Polygon", "coordinates": [[[-9.5, 38.7], [-9.5, 38.8], [-9.4, 38.8], [-9.4, 38.7], [-9.5, 38.7]]]}
+ROI_B = {"type": "Polygon", "coordinates": [[[-8.5, 37.7], [-8.5, 37.8], [-8.4, 37.8], [-8.4, 37.7], [-8.5, 37.7]]]}
+
+
+def item_ids(count, start=0):
+    return [f"20240101_{i:06d}_12_2455" for i in range(start, start + count)]
+
+
+def entry(items, roi=ROI_A, **fields):
+    # Without footprints, each item costs the ROI area (1 km2)
+    return dict({"roi": roi, "hash": "hash", "items": list(items), "ordered": False, "downloaded": False, "area": 1000000}, **fields)
+
+
+def test_orders_are_split_at_the_item_limit():
+    items = item_ids(1200)
+    parts = OrderPacker().split("query", entry(items))
+
+    assert MAX_ORDER_ITEMS == 500
+    assert [name for name, _ in parts] == ["query_part1", "query_part2", "query_part3"]
+    assert [len(part_items) for _, part_items in parts] == [500, 500, 200]
+    assert [item for _, part_items in parts for item in part_items] == items
+
+
+def test_orders_at_the_item_limit_are_not_split():
+    items = item_ids(500)
+    assert OrderPacker().split("query", entry(items)) == [(None, items)]
+
+
+def test_composites_are_ordered_layer_by_layer():
+    items = item_ids(3)
+    parts = OrderPacker().split("query", entry(items, tools={"composite": True}, layers=[items[:2], items[2:]]))
+    assert parts == [("query_layer1", items[:2]), ("query_layer2", items[2:])]
+
+
+def test_parts_are_ordered_separately_and_skipped_once_placed():
+    packer = OrderPacker()
+    orders = packer.pack([("query", entry(item_ids(1200)))])
+    assert [order["request"]["name"] for order in orders] == ["query_part1", "query_part2", "query_part3"]
+    assert [len(order["request"]["products"][0]["item_ids"]) for order in orders] == [500, 500, 200]
+    assert [order["cost"] for order in orders] == pytest.approx([500, 500, 200])
+
+    placed = entry(item_ids(1200), parts={"query_part1": {"id": "order-1", "state": "success"}})
+    assert [order["part"] for order in packer.pack([("query", placed)])] == ["query_part2", "query_part3"]
+
+
+def test_queries_with_the_same_roi_are_grouped():
+    orders = OrderPacker().pack([
+        ("january", entry(item_ids(3))),
+        # Overlapping dates select some of the same scenes, which are ordered once
+        ("february", entry(item_ids(3, start=2))),
+        ("elsewhere", entry(item_ids(2), roi=ROI_B)),
+        ("harmonized", entry(item_ids(2), tools={"harmonize": "Sentinel-2"})),
+    ])
+
+    assert [order["queries"] for order in orders] == [["january", "february"], ["elsewhere"], ["harmonized"]]
+    assert orders[0]["request"]["products"][0]["item_ids"] == item_ids(5)
+    assert orders[0]["cost"] == pytest.approx(5)
+    assert orders[0]["request"]["tools"] == [{"clip": {"aoi": ROI_A}}]
+
+
+def test_groups_stay_under_the_item_limit():
+    orders = OrderPacker(max_items=4).pack([("first", entry(item_ids(3))), ("second", entry(item_ids(3, start=10)))])
+    assert [order["queries"] for order in orders] == [["first"], ["second"]]
+
+
+def test_queries_without_items_are_not_ordered():
+    assert OrderPacker().pack([("query", entry([]))]) == []
+
+
+@pytest.mark.parametrize(
+    "strategy, expected",
+    [
+        # As many orders as possible, or as much area as possible, in 10 km2
+        ("count", ["small", "medium"]),
+        ("area", ["large"]),
+    ],
+)
+def test_schedule(strategy, expected):
+    orders = [{"name": "large", "cost": 9}, {"name": "small", "cost": 2}, {"name": "medium", "cost": 6}]
+    scheduled, deferred = OrderPacker(strategy=strategy).schedule(orders, 10)
+
+    assert [order["name"] for order in scheduled] == [order["name"] for order in orders if order["name"] in expected]
+    assert sorted(order["name"] for order in deferred) == sorted(order["name"] for order in orders if order["name"] not in expected)
+
+
+def test_unknown_strategy_raises():
+    with pytest.raises(ValueError):
+        OrderPacker(strategy="fastest")
@@ -0,0 +1,93 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from DataAPIHelpers import AvailableDataQuery, PlanetFilter  # noqa: E402
+from OrderTools import DEFAULT_BUNDLE, parse_tools  # noqa: E402
+
+ROI = {"type": "Polygon", "coordinates": [[[-9.5, 38.7], [-9.5, 38.8], [-9.4, 38.8], [-9.4, 38.7], [-9.5, 38.7]]]}
+
+
+def test_empty_columns_select_the_default_bundle():
+    assert parse_tools({}) == (DEFAULT_BUNDLE, {})
+    assert parse_tools({"bundle": "", "bands": " ", "composite": "no", "unknown": "1"}) == (DEFAULT_BUNDLE, {})
+
+
+def test_tool_chain():
+    bundle, tools = parse_tools(
+        {
+            "bundle": "analytic_sr_udm2",
+            "bands": "3;4",
+            "reproject": "32629",
+            "resolution": "5",
+            "file_format": "cog",
+            "harmonize": "Sentinel-2",
+            "composite": "Yes",
+        }
+    )
+    assert bundle == "analytic_sr_udm2"
+    assert tools == {
+        "bands": [3, 4],
+        "reproject": {"projection": "EPSG:32629", "resolution": 5.0},
+        "file_format": "COG",
+        "harmonize": "Sentinel-2",
+        "composite": True,
+    }
+
+
+def test_bandmath():
+    _, tools = parse_tools({"bandmath": "b1=(b8-b6)/(b8+b6); b2=b4"})
+    assert tools["bandmath"] == {"b1": "(b8-b6)/(b8+b6)", "b2": "b4", "pixel_type": "32R"}
+
+    _, tools = parse_tools({"bandmath": "b1=b4;pixel_type=16U"})
+    assert tools["bandmath"]["pixel_type"] == "16U"
+
+
+@pytest.mark.parametrize(
+    "columns",
+    [
+        {"bundle": "unknown"},
+        {"bands": "1;2", "bandmath": "b1=b2"},
+        # analytic_sr_udm2 has 4 bands
+        {"bundle": "analytic_sr_udm2", "bands": "5"},
+        {"bands": "0"},
+        {"bandmath": "b1"},
+        {"bandmath": "b16=b1"},
+        {"bandmath": "b1=b2;pixel_type=64R"},
+        {"resolution": "5"},
+        {"file_format": "NetCDF"},
+        {"harmonize": "Landsat"},
+        {"bundle": "analytic_udm2", "harmonize": "Sentinel-2"},
+    ],
+)
+def test_invalid_columns_raise(columns):
+    with pytest.raises(ValueError):
+        parse_tools(columns)
+
+
+class StubJournal:
+    # Every query finds its filtered items in the journal, so nothing is searched
+    def has(self, query_hash, stage):
+        return stage == "items"
+
+    def load(self, query_hash, stage):
+        return None
+
+
+def query_hash(**delivery):
+    planet_filter = PlanetFilter(ROI, "2024-01-01", "2024-01-31", 0.1, "ortho_analytic_8b_sr")
+    planet_filter.build_filter()
+    query = AvailableDataQuery(planet_filter, None, "", "", "", 2, "yes", "query", journal=StubJournal(), **delivery)
+    return query.hash
+
+
+def test_query_hash_depends_on_bundle_and_tools():
+    default_hash = query_hash()
+    # Queues of older versions stored queries without bundle or tools under the same hash
+    assert query_hash(bundle=DEFAULT_BUNDLE, tools={}) == default_hash
+    assert query_hash(bundle="analytic_sr_udm2") != default_hash
+    assert query_hash(tools={"bands": [3, 4]}) != default_hash
+    assert query_hash(tools={"bands": [3, 4]}) != query_hash(tools={"bands": [2, 4]})
@@ -0,0 +1,74 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+pytest.importorskip("requests")
+pytest.importorskip("lxml")
+
+import PipelineDaemon as pipeline_daemon  # noqa: E402
+from DownloadQueue import DownloadQueue  # noqa: E402
+from QueueLease import QueueLease  # noqa: E402
+
+ROI = {"type": "Polygon", "coordinates": [[[-9.5, 38.7], [-9.5, 38.8], [-9.4, 38.8], [-9.4, 38.7], [-9.5, 38.7]]]}
+
+
+class LeasingExecutor:
+    """
+    Stands in for OrderExecutor. Each stage leases the same query, and runs the other stage while it holds it.
+    """
+
+    inside_lease = None
+    results = {}
+
+    def __init__(self, queue_path, planet_session, worker=None, metrics=None):
+        self.queue = DownloadQueue(queue_path)
+        self.worker = worker
+        self.monthly_quotas = 1
+
+    def place_orders(self):
+        self._lease("order")
+
+    def download_orders(self, download_path):
+        self._lease("download")
+
+    def _lease(self, stage):
+        with QueueLease(self.queue, "query", "queued", self.worker) as lease:
+            self.results[stage] = lease.acquired
+            if lease.acquired and self.inside_lease is not None:
+                inside_lease, LeasingExecutor.inside_lease = self.inside_lease, None
+                inside_lease()
+                # The lease is still held once the other stage is done with the query
+                self.results[f"{stage} kept"] = self.queue.renew_lease("query", self.worker, 300)
+
+
+@pytest.fixture
+def daemon(tmp_path, monkeypatch):
+    # Caches of the daemon go in the test folder
+    monkeypatch.setenv("HOME", str(tmp_path))
+    monkeypatch.setattr(pipeline_daemon, "OrderExecutor", LeasingExecutor)
+    LeasingExecutor.results = {}
+    queue_path = tmp_path / "download_queue.db"
+    queue = DownloadQueue(queue_path)
+    queue.add("query", {"roi": ROI, "hash": "hash", "items": ["20240101_103045_12_2455"], "ordered": False, "downloaded": False})
+    queue.close()
+    daemon = pipeline_daemon.PipelineDaemon("key", tmp_path, queue_path, tmp_path / "reports", tmp_path / "storage")
+    yield daemon
+    daemon.queue.close()
+
+
+def test_stages_lease_under_their_own_worker(daemon):
+    LeasingExecutor.inside_lease = daemon.download_stage
+    daemon.order_stage()
+
+    assert LeasingExecutor.results == {"order": True, "download": False, "order kept": True}
+
+
+def test_order_stage_does_not_release_the_download_lease(daemon):
+    LeasingExecutor.inside_lease = daemon.order_stage
+    daemon.download_stage()
+
+    assert LeasingExecutor.results == {"download": True, "order": False, "download kept": True}
+    assert daemon.queue.leases() == []
@@ -0,0 +1,86 @@
+import json
+import sys
+from contextlib import contextmanager
+from datetime import timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from PipelineMetrics import PipelineMetrics  # noqa: E402
+
+
+class Response:
+    def __init__(self, url, status_code=200, seconds=0.2):
+        self.url = url
+        self.status_code = status_code
+        self.elapsed = timedelta(seconds=seconds)
+
+
+def test_stages_and_counters_add_up():
+    metrics = PipelineMetrics("test")
+    for _ in range(2):
+        with metrics.stage("search"):
+            pass
+    metrics.count("retries", endpoint="quick-search")
+    metrics.count("retries", 2, endpoint="quick-search")
+    metrics.count("bytes_downloaded", 100)
+
+    summary = metrics.summary()
+    assert summary["stages"]["search"]["runs"] == 2
+    counters = {(counter["name"], tuple(counter["labels"].items())): counter["value"] for counter in summary["counters"]}
+    assert counters == {("retries", (("endpoint", "quick-search"),)): 3, ("bytes_downloaded", ()): 100}
+
+
+def test_disabled_metrics_record_nothing(tmp_path):
+    metrics = PipelineMetrics("test", enabled=False)
+    with metrics.stage("search"):
+        metrics.count("retries")
+
+    assert metrics.summary()["stages"] == {}
+    assert metrics.summary()["counters"] == []
+    assert metrics.hooks == {}
+    metrics.write(tmp_path)
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_stage_hooks_run_when_disabled():
+    entered = []
+
+    @contextmanager
+    def hook(name):
+        entered.append(name)
+        yield
+
+    metrics = PipelineMetrics("test", enabled=False)
+    metrics.add_stage_hook(hook)
+    with metrics.stage("order"):
+        pass
+    assert entered == ["order"]
+
+
+def test_requests_are_grouped_by_endpoint():
+    metrics = PipelineMetrics("test")
+    metrics.observe_response(Response("https://api.planet.com/compute/ops/orders/v2/3f1c9a2e-1d4b-4e0a-9c2f-0b7f6a5e4d3c", seconds=0.2))
+    metrics.observe_response(Response("https://api.planet.com/compute/ops/orders/v2/7a8b9c0d-2e3f-4a5b-8c7d-1e2f3a4b5c6d", seconds=3))
+
+    (request,) = metrics.summary()["requests"]
+    assert (request["host"], request["endpoint"], request["status"]) == ("api.planet.com", "/compute/ops/orders/v2/{id}", 200)
+    assert request["count"] == 2
+    assert request["buckets"][0.25] == 1
+    assert request["buckets"][5] == 2
+
+
+def test_prometheus_textfile_and_json_summary(tmp_path):
+    metrics = PipelineMetrics("download_orders")
+    with metrics.stage("download"):
+        pass
+    metrics.count("files_downloaded", 3)
+    metrics.observe_response(Response("https://api.planet.com/data/v1/quick-search"))
+    metrics.write(tmp_path)
+
+    prometheus = (tmp_path / "download_orders.prom").read_text()
+    assert 'planet_pipeline_stage_runs_total{job="download_orders",stage="download"} 1' in prometheus
+    assert 'planet_pipeline_files_downloaded_total{job="download_orders"} 3' in prometheus
+    assert 'planet_pipeline_http_request_duration_seconds_count{job="download_orders",host="api.planet.com",endpoint="/data/v1/quick-search",status="200"} 1' in prometheus
+    assert json.loads((tmp_path / "download_orders.json").read_text())["job"] == "download_orders"
+    assert not list(tmp_path.glob("*.part"))
@@ -1,10 +1,17 @@
 from __future__ import division, print_function
+import sys
+from pathlib import Path
+
 import pytest
-import planet_img_pipeline
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+# The modules live directly in src, there is no planet_img_pipeline package to import
+import planet_pipeline  # noqa: E402
 
 
 def test_basic():
-    pass  # TODO - add unit tests
+    assert callable(planet_pipeline.main)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,84 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+pytest.importorskip("shapely")
+pytest.importorskip("pyproj")
+
+from shapely.geometry import box, mapping  # noqa: E402
+
+from QueryEstimator import DEFAULT_SCENE_KM2, SPLIT_GB, SPLIT_ITEMS, QueryEstimator  # noqa: E402
+
+# About 9 x 11 km
+ROI = mapping(box(-9.5, 38.7, -9.4, 38.8))
+
+
+class Queue:
+    def __init__(self, entries):
+        self.entries = entries
+
+    def items(self):
+        return self.entries.items()
+
+
+def days(*counts):
+    return [{"start_time": f"2024-01-{i + 1:02d}T00:00:00.000000Z", "count": count} for i, count in enumerate(counts)]
+
+
+@pytest.fixture
+def estimator():
+    return QueryEstimator(None, roi_preprocessor=object())
+
+
+def test_clipped_layers_are_charged_the_roi_area(estimator):
+    estimate = estimator.project("query", days(3, 2, 0), ROI, 2, "yes", "analytic_sr_udm2", None, DEFAULT_SCENE_KM2)
+
+    assert estimate["items"] == 5
+    assert estimate["days"] == 2
+    # One scene covers the ROI
+    assert estimate["ordered_items"] == 2
+    assert estimate["area"] == pytest.approx(96, rel=0.05)
+    assert estimate["km2"] == pytest.approx(2 * estimate["area"])
+    assert estimate["bytes"] > 0
+    assert estimate["flags"] == []
+
+
+def test_unclipped_layers_are_charged_whole_scenes(estimator):
+    estimate = estimator.project("query", days(3, 2), ROI, 2, "no", "analytic_sr_udm2", None, DEFAULT_SCENE_KM2)
+    assert estimate["km2"] == 2 * DEFAULT_SCENE_KM2
+
+
+def test_queries_without_enough_scenes_are_flagged_to_drop(estimator):
+    empty = estimator.project("empty", days(0, 0), ROI, 1, "yes", "analytic_sr_udm2", None, DEFAULT_SCENE_KM2)
+    assert empty["flags"] == ["drop: no scenes"]
+    assert empty["ordered_items"] == 0 and empty["km2"] == 0
+
+    short = estimator.project("short", days(4, 0, 1), ROI, 3, "yes", "analytic_sr_udm2", None, DEFAULT_SCENE_KM2)
+    assert short["flags"] == ["drop: scenes of 2 days for 3 layers"]
+
+
+def test_large_queries_are_flagged_to_split(estimator):
+    searched = estimator.project("searched", days(SPLIT_ITEMS, 1), ROI, 1, "yes", "analytic_sr_udm2", None, DEFAULT_SCENE_KM2)
+    assert searched["flags"] == [f"split: more than {SPLIT_ITEMS} items to search"]
+
+    downloaded = estimator.project("downloaded", days(*[1] * 200), ROI, 200, "no", "analytic_sr_udm2", None, DEFAULT_SCENE_KM2)
+    assert downloaded["bytes"] / 1e9 > SPLIT_GB
+    assert downloaded["flags"] == [f"split: more than {SPLIT_GB} GB to download"]
+
+
+def test_mean_scene_area_of_the_queue():
+    assert QueryEstimator(None, roi_preprocessor=object()).mean_scene_area() == DEFAULT_SCENE_KM2
+
+    queue = Queue({
+        "old": {"items": []},
+        "a": {"footprints": {"x": ROI, "y": ROI}},
+        "b": {"footprints": {"z": mapping(box(-9.5, 38.7, -9.3, 38.8))}},
+    })
+    area = QueryEstimator(None, queue, roi_preprocessor=object()).mean_scene_area()
+    # Two ROIs and one scene twice as large
+    assert area == pytest.approx(4 / 3 * 96, rel=0.05)
+
+    assert QueryEstimator(None, Queue({"old": {"items": []}}), roi_preprocessor=object()).mean_scene_area() == DEFAULT_SCENE_KM2
@@ -0,0 +1,105 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from QueryJournal import QueryJournal  # noqa: E402
+
+ROI = {"type": "Polygon", "coordinates": [[[-9.5, 38.7], [-9.5, 38.8], [-9.4, 38.8], [-9.4, 38.7], [-9.5, 38.7]]]}
+ITEM = {
+    "id": "20240110_103045_12_2455",
+    "geometry": ROI,
+    "properties": {"acquired": "2024-01-10T10:30:45.000Z", "cloud_cover": 0.1, "strip_id": "1"},
+}
+
+
+@pytest.fixture
+def journal(tmp_path):
+    return QueryJournal(tmp_path / "journal")
+
+
+def test_stages_are_saved_and_loaded(journal):
+    assert not journal.has("hash", "search")
+    journal.save("hash", "search", [ITEM])
+
+    assert journal.has("hash", "search")
+    assert journal.load("hash", "search") == [ITEM]
+    assert not journal.has("hash", "items")
+    assert not list(journal.path.rglob("*.part"))
+
+
+def test_unknown_stages_are_refused(journal):
+    with pytest.raises(ValueError):
+        journal.save("hash", "tides", [])
+
+
+def test_forget_and_clear(journal):
+    journal.save("queued", "search", [ITEM])
+    journal.save("queued", "optimized", [[[0], None]])
+    journal.save("other", "search", [ITEM])
+
+    journal.forget("queued")
+    assert not journal.has("queued", "search")
+    assert not journal.has("queued", "optimized")
+    assert journal.has("other", "search")
+
+    journal.clear()
+    assert not journal.has("other", "search")
+    assert journal.path.is_dir()
+
+
+class Response:
+    def __init__(self, data):
+        self.ok = True
+        self.data = data
+
+    def json(self):
+        return self.data
+
+
+class SearchSession:
+    def __init__(self, items):
+        self.items = items
+        self.searches = 0
+
+    def post(self, url, json=None):
+        self.searches += 1
+        return Response({"features": self.items, "_links": {"_next": None}})
+
+
+def search(session, journal):
+    from DataAPIHelpers import AvailableDataQuery, PlanetFilter
+
+    planet_filter = PlanetFilter(ROI, "2024-01-01", "2024-01-31", 0.5, "ortho_analytic_8b_sr")
+    planet_filter.build_filter()
+    return AvailableDataQuery(planet_filter, session, "", "", "", 1, "yes", "query", journal=journal)
+
+
+def test_interrupted_runs_resume_from_the_journal(journal):
+    pytest.importorskip("shapely")
+    session = SearchSession([ITEM])
+
+    query = search(session, journal)
+    assert [item["id"] for item in query.items] == [ITEM["id"]]
+    assert journal.has(query.hash, "search")
+    assert journal.has(query.hash, "items")
+
+    # The next run loads the filtered items instead of searching again
+    assert [item["id"] for item in search(session, journal).items] == [ITEM["id"]]
+    assert session.searches == 1
+
+
+def test_empty_searches_are_not_journaled(journal):
+    pytest.importorskip("shapely")
+    session = SearchSession([])
+
+    query = search(session, journal)
+    assert query.items is None
+    assert not journal.has(query.hash, "search")
+
+    # Scenes published since then are found by the next run
+    session.items = [ITEM]
+    assert [item["id"] for item in search(session, journal).items] == [ITEM["id"]]
+    assert session.searches == 2
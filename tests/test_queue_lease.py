@@ -0,0 +1,57 @@
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from DownloadQueue import DownloadQueue  # noqa: E402
+from QueueLease import QueueLease  # noqa: E402
+
+ROI = {"type": "Polygon", "coordinates": [[[-9.5, 38.7], [-9.5, 38.8], [-9.4, 38.8], [-9.4, 38.7], [-9.5, 38.7]]]}
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = DownloadQueue(tmp_path / "download_queue.db")
+    queue.add("query", {"roi": ROI, "hash": "hash", "items": ["20240101_103045_12_2455"], "ordered": False, "downloaded": False})
+    yield queue
+    queue.close()
+
+
+def test_lease_is_held_until_the_worker_is_done(queue):
+    with QueueLease(queue, "query", "queued", "worker-1") as lease:
+        assert lease.acquired
+        with QueueLease(queue, "query", "queued", "worker-2") as other:
+            assert not other.acquired
+        # Workers that did not get the lease leave it alone
+        assert [row[1] for row in queue.leases()] == ["worker-1"]
+
+    assert queue.leases() == []
+
+
+def test_heartbeat_keeps_long_leases(queue):
+    with QueueLease(queue, "query", "queued", "worker-1", duration=0.3) as lease:
+        time.sleep(0.6)
+        assert queue.leases()[0][3] > time.time()
+        assert not lease.lost
+        with QueueLease(queue, "query", "queued", "worker-2") as other:
+            assert not other.acquired
+
+
+def test_lease_taken_over_is_lost(queue):
+    with QueueLease(queue, "query", "queued", "worker-1", duration=0.3) as lease:
+        # Another worker took the order over while this one was not sending heartbeats
+        queue.release_lease("query", "worker-1")
+        assert queue.acquire_lease("query", "worker-2", "queued", 300)
+        time.sleep(0.3)
+        assert lease.lost
+
+    # Leaving the context does not release the lease of the new worker
+    assert [row[1] for row in queue.leases()] == ["worker-2"]
+
+
+def test_leases_are_only_acquired_in_the_expected_status(queue):
+    with QueueLease(queue, "query", "ordered", "worker-1") as lease:
+        assert not lease.acquired
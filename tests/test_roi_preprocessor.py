@@ -0,0 +1,39 @@
+import json
+import math
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+pytest.importorskip("shapely")
+
+from RoiPreprocessor import RoiPreprocessor, count_vertices  # noqa: E402
+
+
+def coastline(tmp_path, n_vertices=400):
+    ring = [[-9.5 + 0.05 * math.cos(2 * math.pi * i / n_vertices), 38.7 + 0.05 * math.sin(2 * math.pi * i / n_vertices)] for i in range(n_vertices)]
+    roi_path = tmp_path / "coastline.geojson"
+    roi_path.write_text(json.dumps({"type": "Polygon", "coordinates": [ring + [ring[0]]]}))
+    return roi_path
+
+
+def test_complex_rois_get_a_covering_search_geometry(tmp_path):
+    from shapely.geometry import shape
+
+    roi_path = coastline(tmp_path)
+    roi = RoiPreprocessor(cache_path=tmp_path / "cache").load(roi_path)[0]
+
+    assert count_vertices(roi["search_roi"]) < count_vertices(roi["roi"])
+    assert shape(roi["search_roi"]).contains(shape(roi["roi"]))
+
+
+def test_cached_search_geometries_depend_on_the_vertex_limit(tmp_path):
+    roi_path = coastline(tmp_path)
+    simplified = RoiPreprocessor(cache_path=tmp_path / "cache", max_vertices=200).load(roi_path)[0]
+    exact = RoiPreprocessor(cache_path=tmp_path / "cache", max_vertices=1000).load(roi_path)[0]
+
+    assert simplified["search_roi"] != simplified["roi"]
+    assert exact["search_roi"] == exact["roi"]
+    assert len(list((tmp_path / "cache").glob("*.json"))) == 2
@@ -0,0 +1,121 @@
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+shapely = pytest.importorskip("shapely")
+
+from shapely.geometry import box, mapping, shape  # noqa: E402
+
+from DataAPIHelpers import PlanetFilter  # noqa: E402
+from SceneCatalog import SceneCatalog  # noqa: E402
+
+ASSET_TYPE = "ortho_analytic_8b_sr"
+# Two ROIs sharing their western half
+ROI_A = mapping(box(-9.5, 38.7, -9.3, 38.8))
+ROI_B = mapping(box(-9.4, 38.7, -9.2, 38.8))
+
+
+def planet_filter(roi, min_date, max_date, max_cloud_cover=0.5, asset_type=ASSET_TYPE):
+    query_filter = PlanetFilter(roi, min_date, max_date, max_cloud_cover, asset_type)
+    query_filter.build_filter()
+    return query_filter
+
+
+def item(item_id, acquired, geometry, cloud_cover=0.1):
+    return {"id": item_id, "geometry": mapping(geometry), "properties": {"acquired": acquired, "cloud_cover": cloud_cover}}
+
+
+def conditions(search_filter):
+    return {condition["type"]: condition["config"] for condition in search_filter["filter"]["config"]}
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    catalog = SceneCatalog(tmp_path / "scenes.db")
+    # January over ROI A
+    catalog.add(
+        [
+            item("west", "2024-01-10T10:30:00.000Z", box(-9.45, 38.65, -9.35, 38.85)),
+            item("east", "2024-01-12T10:30:00.000Z", box(-9.25, 38.65, -9.15, 38.85)),
+            item("cloudy", "2024-01-14T10:30:00.000Z", box(-9.45, 38.65, -9.35, 38.85), cloud_cover=0.9),
+        ],
+        planet_filter(ROI_A, "2024-01-01", "2024-01-31", max_cloud_cover=1).search_filter,
+    )
+    yield catalog
+    catalog.close()
+
+
+def test_empty_catalog_misses_the_whole_query(tmp_path):
+    missing = SceneCatalog(tmp_path / "scenes.db").missing(planet_filter(ROI_A, "2024-01-01", "2024-01-31"))
+    assert len(missing) == 1
+    assert conditions(missing[0])["DateRangeFilter"] == {"gte": "2024-01-01T00:00:01.000Z", "lte": "2024-01-31T23:59:59.000Z"}
+    assert shape(conditions(missing[0])["GeometryFilter"]).equals(shape(ROI_A))
+
+
+def test_covered_query_is_answered_by_lookup(catalog):
+    query = planet_filter(ROI_A, "2024-01-05", "2024-01-20")
+    assert catalog.missing(query) == []
+    # Cloud cover of the query applies to the stored scenes, and scenes outside the ROI are left out
+    assert [scene["id"] for scene in catalog.lookup(query)] == ["west"]
+
+
+def test_partially_covered_dates(catalog):
+    query = planet_filter(ROI_A, "2024-01-15", "2024-02-15")
+    missing = catalog.missing(query)
+
+    # Only February is searched, over the whole ROI
+    assert len(missing) == 1
+    assert conditions(missing[0])["DateRangeFilter"] == {"gte": "2024-02-01T00:00:00.000Z", "lte": "2024-02-15T23:59:59.000Z"}
+    assert shape(conditions(missing[0])["GeometryFilter"]).equals(shape(ROI_A))
+    assert catalog.lookup(query) == []
+
+
+def test_partially_covered_roi(catalog):
+    query = planet_filter(ROI_B, "2024-01-01", "2024-01-31")
+    missing = catalog.missing(query)
+
+    # Only the eastern half of ROI B, which ROI A does not cover, is searched
+    assert len(missing) == 1
+    assert conditions(missing[0])["DateRangeFilter"] == {"gte": "2024-01-01T00:00:01.000Z", "lte": "2024-01-31T23:59:59.000Z"}
+    assert shape(conditions(missing[0])["GeometryFilter"]).equals(box(-9.3, 38.7, -9.2, 38.8))
+    # Scenes found over ROI A that reach ROI B are already known
+    assert [scene["id"] for scene in catalog.lookup(query)] == ["west", "east"]
+
+
+def test_partially_covered_dates_and_roi(catalog):
+    query = planet_filter(ROI_B, "2024-01-20", "2024-02-10")
+    missing = sorted(catalog.missing(query), key=lambda search_filter: conditions(search_filter)["DateRangeFilter"]["gte"])
+
+    # January misses the eastern half of the ROI, February misses all of it
+    assert len(missing) == 2
+    assert conditions(missing[0])["DateRangeFilter"]["lte"] == "2024-02-01T00:00:00.000Z"
+    assert shape(conditions(missing[0])["GeometryFilter"]).equals(box(-9.3, 38.7, -9.2, 38.8))
+    assert conditions(missing[1])["DateRangeFilter"]["gte"] == "2024-02-01T00:00:00.000Z"
+    assert shape(conditions(missing[1])["GeometryFilter"]).equals(shape(ROI_B))
+
+
+def test_back_to_back_date_ranges_cover_the_day_boundary(catalog):
+    # February is searched after January, starting on the day after it ended
+    catalog.add([], planet_filter(ROI_A, "2024-02-01", "2024-02-29", max_cloud_cover=1).search_filter)
+
+    assert catalog.missing(planet_filter(ROI_A, "2024-01-20", "2024-02-10")) == []
+
+
+def test_other_asset_types_and_cloudier_queries_are_not_covered(catalog):
+    assert len(catalog.missing(planet_filter(ROI_A, "2024-01-05", "2024-01-20", asset_type="ortho_udm2"))) == 1
+    assert catalog.lookup(planet_filter(ROI_A, "2024-01-05", "2024-01-20", asset_type="ortho_udm2")) == []
+
+
+def test_recent_dates_are_searched_again(tmp_path):
+    catalog = SceneCatalog(tmp_path / "scenes.db")
+    today = time.strftime("%Y-%m-%d", time.gmtime())
+    start = time.strftime("%Y-%m-%d", time.gmtime(time.time() - 30 * 24 * 3600))
+    catalog.add([], planet_filter(ROI_A, start, today).search_filter)
+
+    missing = catalog.missing(planet_filter(ROI_A, start, today))
+    assert len(missing) == 1
+    assert conditions(missing[0])["DateRangeFilter"]["lte"] == f"{today}T23:59:59.000Z"
@@ -0,0 +1,111 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+pytest.importorskip("shapely")
+pytest.importorskip("pyproj")
+
+from shapely.geometry import box, mapping, shape  # noqa: E402
+
+from DownloadQueue import DownloadQueue  # noqa: E402
+from SceneDeduplicator import SceneDeduplicator  # noqa: E402
+
+# Two ROIs sharing their western half, and a scene over that half
+ROI_A = box(-9.5, 38.7, -9.3, 38.8)
+ROI_B = box(-9.4, 38.7, -9.2, 38.8)
+SHARED = "20240101_103045_12_2455"
+OWN_A = "20240102_103045_12_2455"
+OWN_B = "20240103_103045_12_2455"
+FOOTPRINT = mapping(box(-9.45, 38.65, -9.35, 38.85))
+
+
+def entry(roi, items, **fields):
+    return dict(
+        {
+            "roi": mapping(roi), "hash": "-".join(items), "items": list(items), "ordered": False, "downloaded": False,
+            "area": 1, "footprints": {item_id: FOOTPRINT for item_id in items}, "layers": [list(items)],
+        },
+        **fields,
+    )
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = DownloadQueue(tmp_path / "download_queue.db")
+    yield queue
+    queue.close()
+
+
+def test_shared_scenes_are_ordered_once_over_the_union_of_the_rois(queue):
+    queue.add("a", entry(ROI_A, [SHARED, OWN_A]))
+    queue.add("b", entry(ROI_B, [SHARED, OWN_B]))
+
+    report = SceneDeduplicator(queue).deduplicate()
+
+    shared = [name for name in queue.names() if name.startswith("shared_")]
+    assert len(shared) == 1
+    shared_entry = queue.get(shared[0])
+    assert shared_entry["items"] == [SHARED]
+    assert shared_entry["members"] == ["a", "b"]
+    assert shape(shared_entry["roi"]).equals(ROI_A.union(ROI_B))
+    assert list(shared_entry["footprints"]) == [SHARED]
+    # Members keep their own scenes, and the shared one in their layers
+    assert queue.get("a")["items"] == [OWN_A]
+    assert queue.get("b")["items"] == [OWN_B]
+    assert queue.get("a")["layers"] == [[SHARED, OWN_A]]
+
+    assert report["shared_orders"] == 1
+    assert report["shared_items"] == 1
+    # The scene is clipped once to the union instead of once to each ROI, which overlap over the scene
+    assert report["quota_saved_km2"] > 0
+
+
+def test_scenes_with_other_deliveries_are_not_shared(queue):
+    queue.add("a", entry(ROI_A, [SHARED, OWN_A]))
+    queue.add("b", entry(ROI_B, [SHARED, OWN_B], bundle="analytic_udm2"))
+
+    assert SceneDeduplicator(queue).deduplicate()["shared_orders"] == 0
+    assert queue.names() == ["a", "b"]
+    assert queue.get("a")["items"] == [SHARED, OWN_A]
+
+
+def test_scenes_without_footprints_are_left_out_of_the_quota_estimate(queue):
+    queue.add("a", entry(ROI_A, [SHARED], footprints={}))
+    queue.add("b", entry(ROI_B, [SHARED], footprints={}))
+
+    report = SceneDeduplicator(queue).deduplicate()
+    assert report["shared_items"] == 1
+    assert report["quota_saved_km2"] == 0
+
+
+def test_shared_files_are_linked_into_every_member(queue, tmp_path, monkeypatch):
+    pytest.importorskip("requests")
+    import OrderExecutor as order_executor
+
+    queue.add("a", entry(ROI_A, [SHARED, OWN_A]))
+    queue.add("b", entry(ROI_B, [SHARED]))
+    SceneDeduplicator(queue).deduplicate()
+    shared_name = next(name for name in queue.names() if name.startswith("shared_"))
+    # b has nothing left to order itself
+    queue.mark_ordered("b", None)
+
+    monkeypatch.setattr(order_executor.OrderExecutor, "_read_orders", lambda self: ([], []))
+    monkeypatch.setattr(order_executor.OrderExecutor, "_available_quota", lambda self: 0)
+    executor = order_executor.OrderExecutor(queue.path, None)
+
+    storage = tmp_path / "storage"
+    delivered = storage / shared_name / "PSScene" / f"{SHARED}_3B_AnalyticMS_SR_clip.tif"
+    delivered.parent.mkdir(parents=True)
+    delivered.write_bytes(b"scene")
+    executor._fan_out(shared_name, ["a", "b"], [f"{shared_name}/PSScene/{delivered.name}"], storage)
+
+    for member in ("a", "b"):
+        linked = storage / member / "PSScene" / delivered.name
+        assert os.path.samefile(linked, delivered)
+    # b is complete once its only shared order is downloaded, a still waits for its own order
+    assert queue.get("b")["downloaded"]
+    assert not queue.get("a")["downloaded"]
@@ -0,0 +1,54 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from MosaicBuilder import find_scene_files  # noqa: E402
+from SceneScorer import scene_ids, score_scene  # noqa: E402
+
+OWN = "20240101_103045_12_2455"
+SHARED = "20240102_103045_12_2455"
+
+
+def test_scene_ids_of_a_query_without_layers():
+    assert scene_ids({"items": [OWN]}) == [OWN]
+
+
+def test_scenes_moved_to_a_shared_order_are_scored_in_their_members(tmp_path):
+    # Deduplication removed the shared scene from the member items, its files were linked into the member folder
+    entry = {"items": [OWN], "layers": [[OWN, SHARED], [SHARED]]}
+    for item_id in (OWN, SHARED):
+        (tmp_path / f"{item_id}_3B_AnalyticMS_SR_clip.tif").touch()
+        (tmp_path / f"{item_id}_3B_udm2_clip.tif").touch()
+
+    assert scene_ids(entry) == [OWN, SHARED]
+    files = find_scene_files(tmp_path, scene_ids(entry))
+    assert sorted(files) == [OWN, SHARED]
+    assert files[SHARED]["udm2"].endswith(f"{SHARED}_3B_udm2_clip.tif")
+
+
+def test_scores_the_clear_pixels_inside_the_roi_and_footprint(tmp_path):
+    np = pytest.importorskip("numpy")
+    rasterio = pytest.importorskip("rasterio")
+    from rasterio.transform import from_origin
+    from rasterio.warp import transform_geom
+
+    # Clear left half, top 10 rows outside the footprint
+    udm2 = np.zeros((8, 100, 100), dtype="uint8")
+    udm2[0, :, :50] = 1
+    udm2[7, :10] = 1
+    path = tmp_path / f"{OWN}_3B_udm2_clip.tif"
+    with rasterio.open(path, "w", driver="GTiff", width=100, height=100, count=8, dtype="uint8", crs="EPSG:32629",
+                       transform=from_origin(480000, 4300000, 30, 30)) as dataset:
+        dataset.write(udm2)
+    # From column 25 to past the right edge of the scene
+    roi = transform_geom("EPSG:32629", "EPSG:4326", {
+        "type": "Polygon",
+        "coordinates": [[(480750, 4296000), (484000, 4296000), (484000, 4301000), (480750, 4301000), (480750, 4296000)]],
+    })
+
+    fraction, usable = score_scene(path, roi, window_size=32)
+    assert usable == 90 * 75
+    assert fraction == pytest.approx(25 / 75)
@@ -0,0 +1,51 @@
+import json
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from PipelineMetrics import PipelineMetrics  # noqa: E402
+from StageProfiler import StageProfiler  # noqa: E402
+
+
+def busy():
+    return sum(i * i for i in range(20000))
+
+
+def test_each_stage_gets_its_own_profile(tmp_path):
+    metrics = PipelineMetrics("test", enabled=False)
+    profiler = StageProfiler(tmp_path, "test").attach(metrics)
+    with metrics.stage("optimize"):
+        busy()
+        # Nested stages are profiled on their own, and pause the outer one
+        with metrics.stage("tide"):
+            busy()
+    with metrics.stage("optimize"):
+        busy()
+    run_path = profiler.write()
+
+    assert run_path.parent == tmp_path
+    for stage in ("optimize", "tide"):
+        assert (run_path / f"{stage}.pstats").is_file()
+        speedscope = json.loads((run_path / f"{stage}.speedscope.json").read_text())
+        assert speedscope["profiles"][0]["name"] == stage
+        assert len(speedscope["profiles"][0]["samples"]) == len(speedscope["profiles"][0]["weights"])
+
+    summary = json.loads((run_path / "summary.json").read_text())
+    assert summary["optimize"]["runs"] == 2
+    assert summary["tide"]["runs"] == 1
+    assert summary["optimize"]["wait_seconds"] >= 0
+    assert summary["optimize"]["peak_memory"] is None
+
+
+def test_memory_peaks(tmp_path):
+    metrics = PipelineMetrics("test", enabled=False)
+    profiler = StageProfiler(tmp_path, "test", memory=True).attach(metrics)
+    with metrics.stage("report"):
+        data = [bytes(1024) for _ in range(1000)]
+    del data
+    run_path = profiler.write()
+
+    summary = json.loads((run_path / "summary.json").read_text())
+    assert summary["report"]["peak_memory"] >= 1000 * 1024
+    assert (run_path / "report.tracemalloc").is_file()
@@ -0,0 +1,80 @@
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+SRC_PATH = Path(__file__).resolve().parent.parent / "src"
+# Modules that must only be loaded by the stages that use them
+HEAVY_MODULES = ["shapely", "pyproj", "reportlab", "PIL", "lxml", "numpy", "requests"]
+# Interpreter start up is excluded, this is the time the CLI adds on top of it
+STARTUP_BUDGET = 0.25
+
+RUN_COMMAND = """
+import json, sys, time
+sys.path.insert(0, {src!r})
+start = time.perf_counter()
+import planet_pipeline
+planet_pipeline.main({argv!r})
+elapsed = time.perf_counter() - start
+print(json.dumps({{"elapsed": elapsed, "heavy": [name for name in {heavy!r} if name in sys.modules]}}))
+"""
+
+
+def run_cli(argv):
+    code = RUN_COMMAND.format(src=str(SRC_PATH), argv=argv, heavy=HEAVY_MODULES)
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+@pytest.mark.parametrize(
+    "command",
+    [
+        ["status"],
+        # Cron runs with an empty queue exit before placing or downloading anything
+        ["order"],
+        ["download"],
+    ],
+)
+def test_light_commands_start_fast(tmp_path, command):
+    queue_path = tmp_path / "download_queue.json"
+    queue_path.write_text("{}")
+    result = run_cli(command + ["-q", str(queue_path)])
+
+    assert result["heavy"] == []
+    assert result["elapsed"] < STARTUP_BUDGET
+
+
+def test_status_refuses_missing_queue(tmp_path):
+    queue_path = tmp_path / "download_queue.json"
+    result = subprocess.run(
+        [sys.executable, str(SRC_PATH / "planet_pipeline.py"), "status", "-q", str(queue_path)],
+        capture_output=True,
+        text=True,
+    )
+    assert result.returncode != 0
+    assert "does not exist" in result.stderr
+    assert not queue_path.with_suffix(".db").exists()
+
+
+def test_unknown_command_fails(tmp_path):
+    result = subprocess.run(
+        [sys.executable, str(SRC_PATH / "planet_pipeline.py"), "unknown"],
+        capture_output=True,
+        text=True,
+    )
+    assert result.returncode != 0
+    assert "invalid choice" in result.stderr
+
+
+def test_download_refuses_missing_storage(tmp_path):
+    queue_path = tmp_path / "download_queue.json"
+    queue_path.write_text(json.dumps({"query": {"roi": {}, "hash": "a", "items": ["item"], "ordered": True, "downloaded": False, "id": "order-1"}}))
+    result = subprocess.run(
+        [sys.executable, str(SRC_PATH / "planet_pipeline.py"), "download", "-q", str(queue_path)],
+        capture_output=True,
+        text=True,
+    )
+    assert result.returncode != 0
+    assert "--storage is needed" in result.stderr
@@ -0,0 +1,80 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from ThumbnailCache import ThumbnailCache  # noqa: E402
+
+
+class Response:
+    def __init__(self, ok, content=b""):
+        self.ok = ok
+        self.content = content
+
+
+class ThumbnailSession:
+    # Thumbnails are their URL. URLs in failures fail that many times before they are served
+    def __init__(self, failures=None):
+        self.failures = dict(failures or {})
+        self.requests = []
+
+    def get(self, url):
+        self.requests.append(url)
+        if self.failures.get(url, 0) > 0:
+            self.failures[url] -= 1
+            return Response(False)
+        return Response(True, url.encode("utf-8"))
+
+
+def item(item_id):
+    return {"id": item_id, "_links": {"thumbnail": f"https://tiles.example/{item_id}"}}
+
+
+@pytest.fixture(autouse=True)
+def no_back_off(monkeypatch):
+    monkeypatch.setattr("time.sleep", lambda seconds: None)
+
+
+def cache(tmp_path, session, **kwargs):
+    return ThumbnailCache(session, cache_path=tmp_path / "thumbnails", requests_per_second=1000, **kwargs)
+
+
+def test_thumbnails_are_fetched_once(tmp_path):
+    session = ThumbnailSession()
+    thumbnails = cache(tmp_path, session).fetch([item("a"), item("b"), item("a")])
+
+    assert thumbnails == {"a": b"https://tiles.example/a", "b": b"https://tiles.example/b"}
+    assert sorted(session.requests) == ["https://tiles.example/a", "https://tiles.example/b"]
+
+    # Later reports read them from disk
+    assert cache(tmp_path, session).fetch([item("a")]) == {"a": b"https://tiles.example/a"}
+    assert len(session.requests) == 2
+
+
+def test_failed_requests_are_retried(tmp_path):
+    session = ThumbnailSession(failures={"https://tiles.example/a": 2})
+    assert cache(tmp_path, session).fetch([item("a")]) == {"a": b"https://tiles.example/a"}
+    assert len(session.requests) == 3
+
+
+def test_thumbnails_that_can_not_be_fetched_are_not_cached(tmp_path):
+    session = ThumbnailSession(failures={"https://tiles.example/a": 5})
+    assert cache(tmp_path, session).fetch([item("a")]) == {"a": None}
+    assert not (tmp_path / "thumbnails" / "a.png").exists()
+
+
+def test_least_recently_used_thumbnails_are_evicted(tmp_path):
+    session = ThumbnailSession()
+    # Room for two thumbnails
+    thumbnail_cache = cache(tmp_path, session, max_bytes=2 * len(b"https://tiles.example/a"))
+    thumbnail_cache.fetch([item("a"), item("b")])
+    os.utime(tmp_path / "thumbnails" / "a.png", (1, 1))
+    os.utime(tmp_path / "thumbnails" / "b.png", (2, 2))
+    # Reading a marks it as recently used, so b is the oldest when c is added
+    thumbnail_cache.fetch([item("a")])
+    thumbnail_cache.fetch([item("c")])
+
+    assert sorted(path.name for path in (tmp_path / "thumbnails").glob("*.png")) == ["a.png", "c.png"]